@@ -1,56 +1,324 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, send_from_directory, stream_with_context
+import io
+import json
+import os
 import time
+from zoneinfo import ZoneInfo
 from config import Config
+from database.connection import get_database
 from database.db_manager import DatabaseManager
+from database.migrations import migrate
 from utils.helpers import validate_email, validate_required_fields, sanitize_input
-from utils.logger import setup_logger, log_lead_creation, log_appointment_booking, log_error, log_api_request
+from utils.logger import setup_logger, log_lead_creation, log_appointment_booking, log_error
+from utils.slot_cache import SlotCache
+from utils.slot_engine import event_to_interval, interval_dates
+from utils.google_calendar_auth import GoogleCalendarAuth
+from utils.calendar_service import service_factory
+from utils.credential_store import get_credential_store, reset_credential_stores
+from utils.calendar_sync import CalendarMirror
+from utils.calendar_outbox import CalendarOutbox
+from utils.async_booking import AsyncBooking
+from utils.email_messages import build_video_email
+from utils.mail_queue import MailQueue, MailQueueFull
+from utils.reminder_dispatcher import ReminderDispatcher
+from utils.reminder_scheduler import ReminderScheduler
+from utils.lead_query import InvalidLeadQuery, LeadQuery, decode_cursor, parse_filters
+from utils.admin_auth import admin_required
+from utils.admin_panel import render_admin_panel
+from utils.funnel_stats import FunnelStats
+from utils.lead_import import LeadImporter, export_csv, read_csv, read_ndjson
+from utils.idempotency import IdempotencyStore
+from utils.leader import LeaderElection
+from utils.rate_limit import RateLimiter, client_ip
+from utils.request_log import RequestLogger
+from utils.metrics import metrics
+from utils.static_assets import ByteCache, StaticAssets
+from utils.video_stream import VideoStreamer, is_streamed
 
-app = Flask(__name__)
+# Static files are served by serve_static through StaticAssets, not by the built-in route
+app = Flask(__name__, static_folder=None)
 app.config.from_object(Config)
 
 # Initialize database manager
 db_manager = DatabaseManager()
 
+# Apply numbered schema migrations (indexes for hot lookups)
+migrate()
+
 # Setup logger
 logger = setup_logger()
 
+# Request log written in batches by a background thread, off the request path
+request_logger = RequestLogger()
+
+# Static files: fingerprinted URLs, precompressed variants and a shared cache of small files
+static_cache = ByteCache()
+static_assets = StaticAssets(os.path.join(app.root_path, 'static'), cache=static_cache)
+# HTML pages are served with their /static/... links rewritten to fingerprinted (immutable) URLs
+template_assets = StaticAssets(os.path.join(app.root_path, 'templates'), max_age=0, cache=static_cache,
+                               links=static_assets)
+page_assets = StaticAssets(os.path.join(app.root_path, 'pages'), max_age=0, cache=static_cache,
+                           links=static_assets)
+for assets in (static_assets, template_assets, page_assets):
+    assets.scan()
+video_streamer = VideoStreamer(static_assets)
+
+# Cache of available slots per (calendar, date, duration)
+slot_cache = SlotCache()
+
+# Direct Google Calendar client for multi-day availability queries
+calendar_auth = GoogleCalendarAuth()
+
+def invalidate_slot_dates(dates):
+    """Drop cached slots for dates changed in Google Calendar"""
+    for date in dates:
+        slot_cache.invalidate(date=date)
+
+def appointment_schedule(appointment_id):
+    """Current date, time and timezone of an appointment, or None if it does not exist"""
+    with get_database(Config.DATABASE_PATH).transaction() as conn:
+        row = conn.execute(
+            'SELECT appointment_date, appointment_time, timezone FROM appointments WHERE id = ?',
+            (appointment_id,)
+        ).fetchone()
+    return dict(row) if row else None
+
+def event_dates(events):
+    """Dates (in DEFAULT_TIMEZONE) covered by Google Calendar event bodies that have start and end"""
+    tz = ZoneInfo(Config.DEFAULT_TIMEZONE)
+    dates = set()
+    for event in events:
+        interval = event_to_interval(event, tz)
+        if interval:
+            dates.update(interval_dates(*interval, tz))
+    return dates
+
+# Local mirror of Google Calendar kept up to date by a background sync thread
+calendar_mirror = None
+if Config.CALENDAR_SYNC_ENABLED and db_manager.calendar_manager.is_google_calendar_available():
+    calendar_mirror = CalendarMirror(calendar_auth.get_service, on_change=invalidate_slot_dates)
+
+# Outbox that pushes appointment changes to Google Calendar in the background
+calendar_outbox = None
+if Config.CALENDAR_OUTBOX_ENABLED:
+    calendar_outbox = CalendarOutbox(
+        calendar_auth,
+        on_complete=lambda row: calendar_mirror.request_sync() if calendar_mirror else None
+    )
+
+# Email delivery queue in funnel.db, sent by every worker over pooled SMTP connections
+mail_queue = MailQueue()
+
+# Appointment booking (save + queued confirmation email) shared by the Flask and ASGI handlers
+def save_appointment_record(data):
+    """Save an appointment through the calendar outbox when enabled, else directly"""
+    if calendar_outbox:
+        return calendar_outbox.save_appointment(data)
+    return db_manager.save_appointment(data)
+
+booking = AsyncBooking(save_appointment_record, mail_queue)
+
+# Paged, concurrent reminder sender sharing the SMTP connection pool
+reminder_dispatcher = ReminderDispatcher(mail_queue.pool)
+
+# Scheduler that sends each reminder REMINDER_EMAIL_HOURS_BEFORE the appointment (runs in the leader process)
+reminder_scheduler = None
+if Config.REMINDER_EMAIL_ENABLED and Config.REMINDER_SCHEDULER_ENABLED:
+    reminder_scheduler = ReminderScheduler(reminder_dispatcher)
+
+# Keyset-paginated lead listing for /api/leads
+lead_query = LeadQuery()
+
+# Funnel counters maintained by SQLite triggers on leads and appointments
+funnel_stats = FunnelStats()
+
+# Stored responses for retried POST requests carrying an Idempotency-Key header
+idempotency = IdempotencyStore()
+
+# Token buckets by client IP and email for the form endpoints
+rate_limiter = RateLimiter()
+
+def process_services():
+    """Background workers that run in every process, in start order"""
+    return [request_logger, mail_queue]
+
+def singleton_services():
+    """Background workers that must run in one process only (the elected leader), in start order"""
+    services = [calendar_mirror, calendar_outbox, reminder_scheduler]
+    return [service for service in services if service is not None]
+
+def start_singleton_services():
+    """Start the singleton services once this process has become the leader"""
+    for service in singleton_services():
+        service.start()
+
+# One process holds the leader lock and runs the calendar sync, outbox and reminder scheduler
+leader = LeaderElection(on_elected=start_singleton_services)
+
+def start_background_services():
+    """Start background threads of this process and take part in the leader election"""
+    for service in process_services():
+        service.start()
+    leader.start()
+
+def stop_background_services():
+    """Stop background threads, flushing queued log records and metrics"""
+    services = process_services()
+    if leader.is_leader:
+        services += singleton_services()
+    for service in reversed(services):
+        try:
+            service.stop()
+        except Exception as e:
+            log_error(str(e), 'stop_background_services')
+    leader.stop()
+    metrics.stop()
+
+def preload_google_client():
+    """Load Google credentials from the token file before workers are forked"""
+    get_credential_store(calendar_auth.token_file).get()
+
+def init_worker():
+    """Per-process initialisation after fork: fresh clients, per-process threads and the leader election"""
+    global db_manager
+    # Nothing opened by the parent (SQLite handles, HTTP connections, timers) is reused
+    db_manager = DatabaseManager()
+    service_factory.reset()
+    reset_credential_stores()
+    start_background_services()
+
+# Under gunicorn (gunicorn.conf.py) threads are started in each worker by init_worker;
+# only the worker that wins the leader lock runs the singleton services
+if Config.BACKGROUND_SERVICES_AUTOSTART:
+    start_background_services()
+
+def load_available_slots(date):
+    """Load available slots from the calendar mirror, falling back to the database manager"""
+    if calendar_mirror and calendar_mirror.is_ready():
+        return calendar_mirror.get_available_slots(date, Config.APPOINTMENT_DURATION_MINUTES)
+    return db_manager.get_available_slots(date)
+
+def load_stats():
+    """Load funnel statistics from the materialized counters, counting Google Calendar events from the mirror when it is ready"""
+    stats = funnel_stats.get()
+    stats['google_calendar_available'] = db_manager.calendar_manager.is_google_calendar_available()
+    if calendar_mirror and calendar_mirror.is_ready():
+        stats['google_calendar_appointments'] = calendar_mirror.count_upcoming_events()
+    return stats
+
 @app.before_request
 def before_request():
     """Log all requests"""
-    request.start_time = time.time()
+    request.start_time = time.perf_counter()
+    if Config.METRICS_ENABLED:
+        metrics.inc('funnel_http_requests_in_flight')
+        request.in_flight = True
+
+@app.before_request
+def shed_rate_limited():
+    """Reject requests over the rate limit before the JSON body is parsed"""
+    if not Config.RATE_LIMIT_ENABLED or request.method != 'POST' or not rate_limiter.applies(request.path):
+        return None
+    retry_after = rate_limiter.check(
+        request.path,
+        client_ip(request.remote_addr, request.headers),
+        lambda: request.get_data(cache=True)
+    )
+    if retry_after is None:
+        return None
+    return jsonify({'error': 'Too many requests, please retry later'}), 429, {'Retry-After': str(retry_after)}
 
 @app.after_request
 def after_request(response):
-    """Log response and calculate response time"""
+    """Queue a request log record with the response time"""
     if hasattr(request, 'start_time'):
-        response_time = int((time.time() - request.start_time) * 1000)
-        log_api_request(request.method, request.path, response.status_code, response_time)
+        response_time = (time.perf_counter() - request.start_time) * 1000
+        if Config.METRICS_ENABLED:
+            # Route template rather than path keeps the number of series bounded
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            labels = (request.method, route, str(response.status_code))
+            metrics.inc('funnel_http_requests_total', labels)
+            metrics.observe('funnel_http_request_duration_seconds', labels, response_time / 1000)
+        request_logger.log_request(
+            request.method,
+            request.path,
+            response.status_code,
+            response_time,
+            remote_addr=request.remote_addr
+        )
     return response
 
+@app.teardown_request
+def teardown_request(error=None):
+    """Release the in-flight gauge even if the request failed"""
+    if getattr(request, 'in_flight', False):
+        metrics.inc('funnel_http_requests_in_flight', value=-1)
+
+@app.route('/metrics')
+def get_metrics():
+    """Prometheus metrics of all worker processes"""
+    if not Config.METRICS_ENABLED:
+        return jsonify({'error': 'Metrics are disabled'}), 404
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/api/static/stats')
+def get_static_stats():
+    """API endpoint to get static asset index and cache counters"""
+    return jsonify({
+        'static': static_assets.stats(),
+        'templates': template_assets.stats(),
+        'pages': page_assets.stats(),
+        'cache': static_cache.stats(),
+        'video': video_streamer.stats()
+    }), 200
+
+@app.route('/api/rate-limit/stats')
+def get_rate_limit_stats():
+    """API endpoint to get rate limiter counters of this worker"""
+    return jsonify(rate_limiter.stats()), 200
+
+@app.route('/api/background-services')
+def get_background_services():
+    """API endpoint to show whether this worker runs the singleton background services"""
+    return jsonify({
+        'pid': os.getpid(),
+        'leader': leader.is_leader,
+        'singleton_services': [type(service).__name__ for service in singleton_services()]
+    }), 200
+
+@app.route('/api/request-log/stats')
+def get_request_log_stats():
+    """API endpoint to get request log queue counters"""
+    return jsonify(request_logger.stats()), 200
+
 @app.route('/')
 def index():
     """Serve main funnel page"""
     page = request.args.get('page', '1')
-    return send_from_directory('templates', 'index.html')
+    return template_assets.serve('index.html')
 
 @app.route('/<path:filename>')
 def serve_pages(filename):
     """Serve HTML pages"""
     if filename.endswith('.html'):
-        return send_from_directory('pages', filename)
+        return page_assets.serve(filename)
     return send_from_directory('.', filename)
 
 @app.route('/static/<path:filename>')
 def serve_static(filename):
     """Serve static files (CSS, JS, images, videos)"""
-    return send_from_directory('static', filename)
+    if is_streamed(filename):
+        return video_streamer.serve(filename)
+    return static_assets.serve(filename)
 
 @app.route('/admin/<path:filename>')
+@admin_required
 def serve_admin(filename):
     """Serve admin files"""
     return send_from_directory('admin', filename)
 
 @app.route('/api/save-lead', methods=['POST'])
+@idempotency.idempotent
 def save_lead():
     """API endpoint to save lead"""
     try:
@@ -86,7 +354,39 @@ def save_lead():
         log_error(str(e), 'save_lead')
         return jsonify({'error': 'Internal server error'}), 500
 
+def sanitize_appointment_data(data):
+    """Sanitized appointment fields from a /api/save-appointment payload"""
+    return {
+        'name': sanitize_input(data.get('name', '')),
+        'email': sanitize_input(data.get('email', '')),
+        'phone': sanitize_input(data.get('phone', '')),
+        'website': sanitize_input(data.get('website', '')),
+        'revenue': sanitize_input(data.get('revenue', '')),
+        'appointment_date': data.get('appointment_date', '2025-08-23'),
+        'appointment_time': data.get('appointment_time', '11:00'),
+        'timezone': data.get('timezone', 'Europe/Moscow')
+    }
+
+def after_appointment_saved(data, appointment_id):
+    """Refresh slot caches, schedule the reminder and log a new appointment"""
+    slot_cache.invalidate(date=data['appointment_date'])
+    if calendar_mirror:
+        calendar_mirror.request_sync()
+    if reminder_scheduler:
+        reminder_scheduler.schedule(
+            appointment_id,
+            data['appointment_date'],
+            data['appointment_time'],
+            data['timezone']
+        )
+    log_appointment_booking(
+        data['email'], 
+        data['appointment_date'], 
+        data['appointment_time']
+    )
+
 @app.route('/api/save-appointment', methods=['POST'])
+@idempotency.idempotent
 def save_appointment():
     """API endpoint to save appointment with Google Calendar integration"""
     try:
@@ -98,37 +398,27 @@ def save_appointment():
             return jsonify({'error': f'Missing required fields: {", ".join(missing_fields)}'}), 400
         
         # Sanitize input
-        sanitized_data = {
-            'name': sanitize_input(data.get('name', '')),
-            'email': sanitize_input(data.get('email', '')),
-            'phone': sanitize_input(data.get('phone', '')),
-            'website': sanitize_input(data.get('website', '')),
-            'revenue': sanitize_input(data.get('revenue', '')),
-            'appointment_date': data.get('appointment_date', '2025-08-23'),
-            'appointment_time': data.get('appointment_time', '11:00'),
-            'timezone': data.get('timezone', 'Europe/Moscow')
-        }
+        sanitized_data = sanitize_appointment_data(data)
         
         # Validate email format
         if not validate_email(sanitized_data['email']):
             return jsonify({'error': 'Invalid email format'}), 400
         
-        # Save appointment to database and Google Calendar
-        result = db_manager.save_appointment(sanitized_data)
+        # Save appointment to database and Google Calendar (or the calendar outbox), then queue the confirmation
+        result = booking.save_appointment_sync(sanitized_data)
         
         if result['success']:
-            log_appointment_booking(
-                sanitized_data['email'], 
-                sanitized_data['appointment_date'], 
-                sanitized_data['appointment_time']
-            )
+            after_appointment_saved(sanitized_data, result['appointment_id'])
             return jsonify({
                 'success': True,
                 'message': 'Appointment saved successfully',
                 'appointment_id': result['appointment_id'],
                 'google_event_id': result.get('google_event_id'),
                 'google_event_link': result.get('google_event_link'),
-                'calendar_message': result.get('calendar_message')
+                'calendar_message': result.get('calendar_message'),
+                'calendar_sync_status': result.get('calendar_sync_status', 'synced'),
+                'confirmation_sent': result['confirmation_sent'],
+                'confirmation_message_id': result.get('confirmation_message_id')
             }), 200
         else:
             return jsonify({'error': result['error']}), 500
@@ -148,8 +438,9 @@ def get_available_slots(date):
         except ValueError:
             return jsonify({'error': 'Invalid date format. Use YYYY-MM-DD'}), 400
         
-        # Get available slots from Google Calendar or default
-        available_slots = db_manager.get_available_slots(date)
+        # Get available slots from cache, Google Calendar or default
+        cache_key = SlotCache.make_key(Config.GOOGLE_CALENDAR_ID, date, Config.APPOINTMENT_DURATION_MINUTES)
+        available_slots = slot_cache.get_or_load(cache_key, lambda: load_available_slots(date))
         
         return jsonify({
             'success': True,
@@ -162,26 +453,196 @@ def get_available_slots(date):
         log_error(str(e), 'get_available_slots')
         return jsonify({'error': 'Internal server error'}), 500
 
+@app.route('/api/available-slots')
+def get_available_slots_range():
+    """API endpoint to get available time slots for every date in a range"""
+    try:
+        from datetime import datetime, timedelta
+        date_from = request.args.get('from', '')
+        date_to = request.args.get('to', '')
+        try:
+            first_day = datetime.strptime(date_from, '%Y-%m-%d').date()
+            last_day = datetime.strptime(date_to, '%Y-%m-%d').date()
+        except ValueError:
+            return jsonify({'error': 'Invalid date format. Use from=YYYY-MM-DD&to=YYYY-MM-DD'}), 400
+        
+        days = (last_day - first_day).days + 1
+        if days < 1 or days > Config.AVAILABILITY_MAX_RANGE_DAYS:
+            return jsonify({'error': f'Date range must contain 1-{Config.AVAILABILITY_MAX_RANGE_DAYS} days'}), 400
+        
+        dates = [(first_day + timedelta(days=offset)).isoformat() for offset in range(days)]
+        keys = {
+            date: SlotCache.make_key(Config.GOOGLE_CALENDAR_ID, date, Config.APPOINTMENT_DURATION_MINUTES)
+            for date in dates
+        }
+        # Loads that race with a booking's invalidation are not cached
+        generations = {date: slot_cache.generation(keys[date]) for date in dates}
+        slots = {date: slot_cache.get(keys[date]) for date in dates}
+        missing = [date for date in dates if slots[date] is None]
+        google_calendar_available = db_manager.calendar_manager.is_google_calendar_available()
+        
+        # Read uncached days from the local mirror when it is in sync
+        if missing and calendar_mirror and calendar_mirror.is_ready():
+            mirror_slots = calendar_mirror.get_available_slots_range(
+                missing[0], missing[-1], Config.APPOINTMENT_DURATION_MINUTES
+            )
+            for date in missing:
+                slots[date] = mirror_slots[date]
+                slot_cache.set(keys[date], slots[date], generations[date])
+            missing = []
+        
+        # One freeBusy query covers every uncached day in the window
+        if missing and google_calendar_available:
+            range_result = calendar_auth.get_available_slots_range(
+                missing[0], missing[-1], Config.APPOINTMENT_DURATION_MINUTES
+            )
+            if range_result['success']:
+                for date in missing:
+                    slots[date] = range_result['slots'][date]
+                    slot_cache.set(keys[date], slots[date], generations[date])
+            else:
+                log_error(range_result['message'], 'get_available_slots_range')
+        
+        # Fall back to the per-date source for anything still missing
+        for date in dates:
+            if slots[date] is None:
+                slots[date] = slot_cache.get_or_load(keys[date], lambda date=date: load_available_slots(date))
+        
+        return jsonify({
+            'success': True,
+            'from': date_from,
+            'to': date_to,
+            'slots': slots,
+            'google_calendar_available': google_calendar_available
+        }), 200
+        
+    except Exception as e:
+        log_error(str(e), 'get_available_slots_range')
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/slot-cache/stats')
+def get_slot_cache_stats():
+    """API endpoint to get available slots cache counters"""
+    return jsonify(slot_cache.stats()), 200
+
 @app.route('/api/leads')
 def get_leads():
-    """API endpoint to get all leads"""
+    """API endpoint to get leads page by page (?limit=, ?cursor=), as an NDJSON stream (?format=ndjson)
+    or, without paging parameters, as a JSON list of all leads"""
     try:
-        leads = db_manager.get_leads()
-        return jsonify(leads), 200
+        filters = parse_filters(request.args)
+        sort = request.args.get('sort')
+        direction = request.args.get('direction')
+        
+        if request.args.get('format') == 'ndjson' or request.accept_mimetypes.best == 'application/x-ndjson':
+            # Validate sort before the response starts streaming
+            sort, direction = LeadQuery.normalize_sort(sort, direction)
+            
+            def generate():
+                for lead in lead_query.iterate(filters, sort, direction):
+                    yield json.dumps(lead, ensure_ascii=False, default=str) + '\n'
+            
+            return Response(stream_with_context(generate()), mimetype='application/x-ndjson'), 200
+        
+        if 'cursor' not in request.args and 'limit' not in request.args:
+            sort, direction = LeadQuery.normalize_sort(sort, direction)
+            
+            def generate_list():
+                # Same list shape as before, streamed in keyset batches instead of built in memory
+                yield '['
+                for index, lead in enumerate(lead_query.iterate(filters, sort, direction)):
+                    yield (',' if index else '') + json.dumps(lead, ensure_ascii=False, default=str)
+                yield ']'
+            
+            return Response(stream_with_context(generate_list()), mimetype='application/json'), 200
+        
+        page = lead_query.page(
+            filters,
+            cursor=request.args.get('cursor'),
+            limit=request.args.get('limit', type=int),
+            sort=sort,
+            direction=direction
+        )
+        return jsonify(page), 200
+    except InvalidLeadQuery as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         log_error(str(e), 'get_leads')
         return jsonify({'error': 'Internal server error'}), 500
 
+@app.route('/api/leads/import', methods=['POST'])
+@admin_required
+def import_leads():
+    """API endpoint to bulk import leads from a CSV or NDJSON request body"""
+    try:
+        stream = io.TextIOWrapper(request.stream, encoding='utf-8-sig', newline='')
+        if request.mimetype == 'application/x-ndjson':
+            rows = read_ndjson(stream)
+        else:
+            rows = read_csv(stream)
+        
+        report = LeadImporter().run(rows, request.args.get('on_conflict', 'skip'))
+        return jsonify(dict(report, success=True)), 200
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        log_error(str(e), 'import_leads')
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/leads/export.csv')
+@admin_required
+def export_leads():
+    """API endpoint to stream leads as CSV"""
+    try:
+        filters = parse_filters(request.args)
+        return Response(
+            stream_with_context(export_csv(lead_query, filters)),
+            mimetype='text/csv',
+            headers={'Content-Disposition': 'attachment; filename=leads.csv'}
+        ), 200
+    except InvalidLeadQuery as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        log_error(str(e), 'export_leads')
+        return jsonify({'error': 'Internal server error'}), 500
+
 @app.route('/api/stats')
 def get_stats():
     """API endpoint to get funnel statistics"""
     try:
-        stats = db_manager.get_stats()
+        stats = load_stats()
         return jsonify(stats), 200
     except Exception as e:
         log_error(str(e), 'get_stats')
         return jsonify({'error': 'Internal server error'}), 500
 
+@app.route('/api/stats/daily')
+def get_daily_stats():
+    """API endpoint to get a per-day series of leads or appointments"""
+    try:
+        series = funnel_stats.daily(
+            request.args.get('metric', 'leads'),
+            request.args.get('from'),
+            request.args.get('to')
+        )
+        return jsonify({'metric': request.args.get('metric', 'leads'), 'series': series}), 200
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        log_error(str(e), 'get_daily_stats')
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/stats/rebuild', methods=['POST'])
+@admin_required
+def rebuild_stats():
+    """API endpoint to recompute the funnel counters from the leads and appointments tables"""
+    try:
+        stats = funnel_stats.rebuild()
+        return jsonify({'success': True, 'stats': stats}), 200
+    except Exception as e:
+        log_error(str(e), 'rebuild_stats')
+        return jsonify({'error': 'Internal server error'}), 500
+
 @app.route('/api/update-appointment/<int:appointment_id>', methods=['PUT'])
 def update_appointment(appointment_id):
     """API endpoint to update appointment"""
@@ -206,13 +667,38 @@ def update_appointment(appointment_id):
         }
         
         # Update appointment
-        result = db_manager.update_appointment(appointment_id, sanitized_data)
+        previous = appointment_schedule(appointment_id)
+        if calendar_outbox:
+            result = calendar_outbox.update_appointment(appointment_id, sanitized_data)
+        else:
+            result = db_manager.update_appointment(appointment_id, sanitized_data)
         
         if result['success']:
+            # A rescheduled appointment needs a reminder for its new time (the outbox resets it itself)
+            rescheduled = previous and (
+                (previous['appointment_date'], previous['appointment_time'])
+                != (sanitized_data['appointment_date'], sanitized_data['appointment_time'])
+            )
+            if rescheduled and not calendar_outbox:
+                reminder_dispatcher.rearm(appointment_id)
+            # Both the old and the new date of the appointment change availability
+            slot_cache.invalidate(date=sanitized_data['appointment_date'])
+            if previous and previous['appointment_date'] != sanitized_data['appointment_date']:
+                slot_cache.invalidate(date=previous['appointment_date'])
+            if calendar_mirror:
+                calendar_mirror.request_sync()
+            if reminder_scheduler:
+                reminder_scheduler.schedule(
+                    appointment_id,
+                    sanitized_data['appointment_date'],
+                    sanitized_data['appointment_time'],
+                    sanitized_data['timezone']
+                )
             return jsonify({
                 'success': True,
                 'message': 'Appointment updated successfully',
-                'calendar_result': result.get('calendar_result')
+                'calendar_result': result.get('calendar_result'),
+                'calendar_sync_status': result.get('calendar_sync_status', 'synced')
             }), 200
         else:
             return jsonify({'error': result['error']}), 400
@@ -225,13 +711,24 @@ def update_appointment(appointment_id):
 def delete_appointment(appointment_id):
     """API endpoint to delete appointment"""
     try:
-        result = db_manager.delete_appointment(appointment_id)
+        previous = appointment_schedule(appointment_id)
+        if calendar_outbox:
+            result = calendar_outbox.delete_appointment(appointment_id)
+        else:
+            result = db_manager.delete_appointment(appointment_id)
         
         if result['success']:
+            if previous:
+                slot_cache.invalidate(date=previous['appointment_date'])
+            if calendar_mirror:
+                calendar_mirror.request_sync()
+            if reminder_scheduler:
+                reminder_scheduler.cancel(appointment_id)
             return jsonify({
                 'success': True,
                 'message': 'Appointment deleted successfully',
-                'calendar_result': result.get('calendar_result')
+                'calendar_result': result.get('calendar_result'),
+                'calendar_sync_status': result.get('calendar_sync_status', 'synced')
             }), 200
         else:
             return jsonify({'error': result['error']}), 400
@@ -240,7 +737,87 @@ def delete_appointment(appointment_id):
         log_error(str(e), 'delete_appointment')
         return jsonify({'error': 'Internal server error'}), 500
 
+@app.route('/api/calendar-outbox')
+def get_calendar_outbox():
+    """API endpoint to get Google Calendar sync queue state"""
+    if not calendar_outbox:
+        return jsonify({'enabled': False}), 200
+    try:
+        return jsonify(dict(calendar_outbox.stats(), enabled=True)), 200
+    except Exception as e:
+        log_error(str(e), 'get_calendar_outbox')
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/calendar-outbox/retry', methods=['POST'])
+@admin_required
+def retry_calendar_outbox():
+    """API endpoint to requeue failed Google Calendar operations"""
+    if not calendar_outbox:
+        return jsonify({'error': 'Calendar outbox is disabled'}), 400
+    try:
+        return jsonify({'success': True, 'requeued': calendar_outbox.retry_failed()}), 200
+    except Exception as e:
+        log_error(str(e), 'retry_calendar_outbox')
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/calendar/bulk', methods=['POST'])
+@admin_required
+def calendar_bulk():
+    """API endpoint for admin bulk Google Calendar operations (create, patch, delete)"""
+    try:
+        data = request.get_json() or {}
+        operation = data.get('operation')
+        items = data.get('items') or []
+        if not isinstance(items, list) or not items:
+            return jsonify({'error': 'items must be a non-empty list'}), 400
+        
+        if operation not in ('create', 'patch', 'delete'):
+            return jsonify({'error': 'operation must be one of: create, patch, delete'}), 400
+        
+        # Dates the operation touches: new event times from the bodies, old ones from the mirror
+        if operation == 'create':
+            dates = event_dates(items)
+        elif operation == 'patch':
+            dates = event_dates(item['event'] for item in items)
+        else:
+            dates = set()
+        known_old_dates = operation == 'create' or (calendar_mirror and calendar_mirror.is_ready())
+        if operation != 'create' and known_old_dates:
+            event_ids = items if operation == 'delete' else [item['event_id'] for item in items]
+            dates.update(calendar_mirror.dates_of_events(event_ids))
+        
+        if operation == 'create':
+            # A retried request with the same Idempotency-Key maps to the same event ids
+            results = calendar_auth.create_events(items, nonce=request.headers.get('Idempotency-Key'))
+        elif operation == 'patch':
+            results = calendar_auth.patch_events([(item['event_id'], item['event']) for item in items])
+        else:
+            results = calendar_auth.delete_events(items)
+        
+        if known_old_dates:
+            invalidate_slot_dates(dates)
+        else:
+            # Without the mirror the previous dates of patched or deleted events are unknown
+            slot_cache.invalidate()
+        if calendar_mirror:
+            calendar_mirror.request_sync()
+        
+        succeeded = sum(1 for result in results if result['success'])
+        return jsonify({
+            'success': succeeded == len(results),
+            'succeeded': succeeded,
+            'failed': len(results) - succeeded,
+            'results': results
+        }), 200
+        
+    except (KeyError, TypeError):
+        return jsonify({'error': 'patch items must contain event_id and event'}), 400
+    except Exception as e:
+        log_error(str(e), 'calendar_bulk')
+        return jsonify({'error': 'Internal server error'}), 500
+
 @app.route('/api/send-video-email', methods=['POST'])
+@idempotency.idempotent
 def send_video_email():
     """API endpoint to send video email"""
     try:
@@ -261,185 +838,107 @@ def send_video_email():
         # Generate video URL (you can customize this)
         video_url = f"http://127.0.0.1:8000/?page=2&firstName={first_name}&email={email}"
         
-        # Send email with video
-        from utils.email_manager import EmailManager
-        email_manager = EmailManager()
-        email_manager.send_video_email(email, first_name, video_url)
+        # Queue email with video for background delivery
+        try:
+            message_id = mail_queue.enqueue(build_video_email(email, first_name, video_url))
+        except MailQueueFull:
+            return jsonify({'error': 'Email queue is full, please retry later'}), 503, {'Retry-After': '5'}
         
-        log_lead_creation(email, first_name, 'video_email_sent')
+        log_lead_creation(email, first_name, 'video_email_queued')
         
         return jsonify({
             'success': True,
-            'message': 'Video email sent successfully'
-        }), 200
+            'message': 'Video email queued',
+            'message_id': message_id
+        }), 202
         
     except Exception as e:
         log_error(str(e), 'send_video_email')
         return jsonify({'error': 'Internal server error'}), 500
 
+@app.route('/api/email-status/<message_id>')
+def get_email_status(message_id):
+    """API endpoint to get delivery status of a queued email"""
+    status = mail_queue.status(message_id)
+    if not status:
+        return jsonify({'error': 'Unknown message id'}), 404
+    return jsonify(status), 200
+
+@app.route('/api/email-queue/stats')
+def get_email_queue_stats():
+    """API endpoint to get email delivery queue counters"""
+    return jsonify(mail_queue.stats()), 200
+
 @app.route('/api/send-reminders', methods=['POST'])
 def send_reminder_emails():
     """API endpoint to send reminder emails for tomorrow's appointments"""
     try:
-        result = db_manager.send_reminder_emails()
+        data = request.get_json(silent=True) or {}
+        result = reminder_dispatcher.dispatch(data.get('date'))
         
         if result['success']:
             return jsonify({
                 'success': True,
-                'message': f"Reminder emails sent: {result['reminders_sent']}"
+                'message': f"Reminder emails sent: {result['reminders_sent']}",
+                'target_date': result['target_date'],
+                'reminders_sent': result['reminders_sent'],
+                'failed': result['failed'],
+                'resumed': result['resumed'],
+                'elapsed_seconds': result['elapsed_seconds'],
+                'messages_per_second': result['messages_per_second'],
+                'failures': result['failures']
             }), 200
         else:
-            return jsonify({'error': result['error']}), 500
+            return jsonify({'error': result['error']}), 409 if result.get('busy') else 500
         
     except Exception as e:
         log_error(str(e), 'send_reminder_emails')
         return jsonify({'error': 'Internal server error'}), 500
 
+@app.route('/api/reminder-scheduler')
+def get_reminder_scheduler():
+    """API endpoint to get reminder scheduler state"""
+    if not reminder_scheduler:
+        return jsonify({'enabled': False}), 200
+    return jsonify(dict(reminder_scheduler.stats(), enabled=True)), 200
+
 @app.route('/admin')
+@admin_required
 def admin():
-    """Admin panel page"""
+    """Admin panel page, streamed one page of leads at a time"""
     try:
-        leads = db_manager.get_leads()
-        stats = db_manager.get_stats()
-        
-        html = '''
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <title>Funnel Admin</title>
-            <style>
-                body { font-family: Arial, sans-serif; margin: 20px; background: #f5f5f5; }
-                .container { max-width: 1200px; margin: 0 auto; background: white; padding: 20px; border-radius: 8px; box-shadow: 0 2px 10px rgba(0,0,0,0.1); }
-                table { border-collapse: collapse; width: 100%; margin-top: 20px; }
-                th, td { border: 1px solid #ddd; padding: 12px; text-align: left; }
-                th { background-color: #f8f9fa; font-weight: 600; }
-                .stats { display: grid; grid-template-columns: repeat(auto-fit, minmax(200px, 1fr)); gap: 20px; margin-bottom: 30px; }
-                .stat-card { background: #e8f5e8; padding: 20px; border-radius: 8px; text-align: center; }
-                .stat-number { font-size: 2em; font-weight: bold; color: #2d5a2d; }
-                .stat-label { color: #666; margin-top: 5px; }
-                .nav { margin-bottom: 30px; padding: 15px; background: #f8f9fa; border-radius: 8px; }
-                .nav a { margin-right: 20px; color: #3b82f6; text-decoration: none; padding: 8px 16px; border-radius: 4px; }
-                .nav a:hover { background: #e0e7ff; }
-                h1 { color: #2d5a2d; margin-bottom: 10px; }
-                .subtitle { color: #666; margin-bottom: 30px; }
-                .google-calendar { background: #e3f2fd; padding: 10px; border-radius: 4px; margin: 5px 0; }
-                .email-status { font-size: 12px; color: #666; }
-                .email-sent { color: #4caf50; }
-                .email-not-sent { color: #f44336; }
-                .status-indicator { display: inline-block; width: 12px; height: 12px; border-radius: 50%; margin-right: 8px; }
-                .status-available { background: #4caf50; }
-                .status-unavailable { background: #f44336; }
-                .integration-status { background: #f8f9fa; padding: 15px; border-radius: 8px; margin-bottom: 20px; }
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <h1>🎯 Funnel Admin Panel</h1>
-                <p class="subtitle">Управление воронкой продаж и аналитика</p>
-                
-                <div class="nav">
-                    <a href="/">🌐 Воронка</a>
-                    <a href="/admin/test-api.html">🧪 Тест API</a>
-                    <a href="/admin/test-calendar.html">📅 Тест календаря</a>
-                    <a href="/api/stats" target="_blank">📊 API Статистика</a>
-                    <a href="/api/send-reminders" target="_blank">📧 Отправить напоминания</a>
-                </div>
-                
-                <div class="integration-status">
-                    <h3>🔧 Статус интеграций</h3>
-                    <p>
-                        <span class="status-indicator ''' + ('status-available' if stats['google_calendar_available'] else 'status-unavailable') + '''"></span>
-                        <strong>Google Calendar:</strong> ''' + ('✅ Доступен' if stats['google_calendar_available'] else '❌ Не настроен') + '''
-                        ''' + (f'<br><small>Событий в календаре: {stats["google_calendar_appointments"]}' if stats['google_calendar_available'] else '<br><small>Для настройки следуйте инструкциям в admin/google-calendar-setup.md') + '''</small>
-                    </p>
-                    <p>
-                        <span class="status-indicator status-available"></span>
-                        <strong>Email уведомления:</strong> ✅ Настроены
-                        <br><small>Подтверждения: ''' + ('Включены' if Config.CONFIRMATION_EMAIL_ENABLED else 'Отключены') + ''', Напоминания: ''' + ('Включены' if Config.REMINDER_EMAIL_ENABLED else 'Отключены') + '''</small>
-                    </p>
-                </div>
-                
-                <div class="stats">
-                    <div class="stat-card">
-                        <div class="stat-number">''' + str(stats['total_leads']) + '''</div>
-                        <div class="stat-label">Всего лидов</div>
-                    </div>
-                    <div class="stat-card">
-                        <div class="stat-number">''' + str(stats['total_appointments']) + '''</div>
-                        <div class="stat-label">Записанных встреч</div>
-                    </div>
-                    <div class="stat-card">
-                        <div class="stat-number">''' + str(stats['today_leads']) + '''</div>
-                        <div class="stat-label">Лидов сегодня</div>
-                    </div>
-                    <div class="stat-card">
-                        <div class="stat-number">''' + str(stats['google_calendar_appointments']) + '''</div>
-                        <div class="stat-label">В Google Calendar</div>
-                    </div>
-                </div>
-                
-                <h2>📋 Все лиды</h2>
-                <table>
-                    <tr>
-                        <th>ID</th>
-                        <th>Имя</th>
-                        <th>Email</th>
-                        <th>Телефон</th>
-                        <th>Сайт</th>
-                        <th>Доход</th>
-                        <th>Дата встречи</th>
-                        <th>Время встречи</th>
-                        <th>Статус</th>
-                        <th>Google Calendar</th>
-                        <th>Email статус</th>
-                        <th>Создан</th>
-                    </tr>
-        '''
-        
-        for lead in leads:
-            google_calendar_status = "✅" if lead['google_event_id'] else "❌"
-            confirmation_status = "✅" if lead['confirmation_sent'] else "❌"
-            reminder_status = "✅" if lead['reminder_sent'] else "❌"
-            
-            html += f'''
-                    <tr>
-                        <td>{lead['id']}</td>
-                        <td>{lead['first_name']}</td>
-                        <td>{lead['email']}</td>
-                        <td>{lead['phone'] or '-'}</td>
-                        <td>{lead['website'] or '-'}</td>
-                        <td>{lead['revenue'] or '-'}</td>
-                        <td>{lead['appointment_date'] or '-'}</td>
-                        <td>{lead['appointment_time'] or '-'}</td>
-                        <td>{lead['status'] or '-'}</td>
-                        <td class="google-calendar">{google_calendar_status}</td>
-                        <td>
-                            <div class="email-status">
-                                <div class="{'email-sent' if lead['confirmation_sent'] else 'email-not-sent'}">
-                                    Подтверждение: {confirmation_status}
-                                </div>
-                                <div class="{'email-sent' if lead['reminder_sent'] else 'email-not-sent'}">
-                                    Напоминание: {reminder_status}
-                                </div>
-                            </div>
-                        </td>
-                        <td>{lead['created_at']}</td>
-                    </tr>
-            '''
-        
-        html += '''
-                </table>
-            </div>
-        </body>
-        </html>
-        '''
-        
-        return html
-        
+        filters = parse_filters(request.args)
+        sort, direction = LeadQuery.normalize_sort(request.args.get('sort'), request.args.get('direction'))
+        cursor = request.args.get('cursor')
+        if cursor:
+            decode_cursor(cursor, sort, direction)
+        
+        html = render_admin_panel(
+            request.args,
+            sort,
+            direction,
+            load_stats=load_stats,
+            load_page=lambda: lead_query.page(
+                filters,
+                cursor=cursor,
+                limit=request.args.get('limit', type=int),
+                sort=sort,
+                direction=direction
+            ),
+            outbox_stats=calendar_outbox.stats() if calendar_outbox else None,
+            confirmation_enabled=Config.CONFIRMATION_EMAIL_ENABLED,
+            reminder_enabled=Config.REMINDER_EMAIL_ENABLED,
+            max_limit=Config.LEADS_MAX_PAGE_SIZE
+        )
+        return Response(stream_with_context(html), mimetype='text/html')
+        
+    except InvalidLeadQuery as e:
+        return f"Invalid admin panel query: {str(e)}", 400
     except Exception as e:
         log_error(str(e), 'admin_panel')
         return f"Error loading admin panel: {str(e)}", 500
 
 if __name__ == '__main__':
     logger.info("Starting Funnel application...")
+    # Development server only; production runs under gunicorn (see wsgi.py)
     app.run(debug=Config.DEBUG, host='0.0.0.0', port=8000) 
\ No newline at end of file
@@ -0,0 +1,254 @@
+"""
+ASGI entry point: asyncio handlers for the booking API
+
+Run from the funnel directory:
+    uvicorn asgi:app --host 0.0.0.0 --port 8000 --workers 4
+
+/api/save-lead, /api/save-appointment and /api/available-slots/<date> are
+served by coroutines. Blocking calls (SQLite, Google Calendar, SMTP) run in
+a thread pool of Config.ASYNC_IO_THREADS threads, so a request waiting on
+them does not hold a worker. Appointments are saved by the same code as the
+Flask handler (app.booking); the database/Calendar save and queueing of the
+confirmation email are awaited concurrently, and the email is released to
+the mail queue once the save succeeds. Every other route is passed to the
+Flask app through a WSGI adapter.
+
+With several workers set RATE_LIMIT_BACKEND=sqlite so that rate limit
+buckets are shared between them. BACKGROUND_SERVICES_AUTOSTART may stay on:
+uvicorn starts each worker as a fresh process, the calendar mirror, calendar
+outbox and reminder scheduler run only in the process holding
+LEADER_LOCK_PATH, and the mail queue claims each message in funnel.db, so
+nothing is sent or synced twice.
+"""
+
+import asyncio
+import functools
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import datetime
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Mount, Route
+
+import app as funnel
+from config import Config
+from utils.helpers import validate_email, validate_required_fields, sanitize_input
+from utils.logger import log_lead_creation, log_error
+from utils.metrics import metrics
+from utils.rate_limit import client_ip
+from utils.slot_cache import SlotCache
+
+def instrumented(route):
+    """Record metrics and the request log like the Flask before/after_request hooks"""
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(request):
+            start_time = time.perf_counter()
+            if Config.METRICS_ENABLED:
+                metrics.inc('funnel_http_requests_in_flight')
+            try:
+                response = await handler(request)
+            finally:
+                if Config.METRICS_ENABLED:
+                    metrics.inc('funnel_http_requests_in_flight', value=-1)
+            response_time = (time.perf_counter() - start_time) * 1000
+            if Config.METRICS_ENABLED:
+                labels = (request.method, route, str(response.status_code))
+                metrics.inc('funnel_http_requests_total', labels)
+                metrics.observe('funnel_http_request_duration_seconds', labels, response_time / 1000)
+            funnel.request_logger.log_request(
+                request.method,
+                request.url.path,
+                response.status_code,
+                response_time,
+                remote_addr=request.client.host if request.client else None
+            )
+            return response
+        return wrapper
+    return decorator
+
+def rate_limited(handler):
+    """Reject requests over the rate limit before the JSON body is parsed"""
+    @functools.wraps(handler)
+    async def wrapper(request):
+        if Config.RATE_LIMIT_ENABLED and funnel.rate_limiter.applies(request.url.path):
+            body = await request.body()
+            args = (
+                request.url.path,
+                client_ip(request.client.host if request.client else None, request.headers),
+                lambda: body
+            )
+            if funnel.rate_limiter.shared:
+                retry_after = await asyncio.to_thread(funnel.rate_limiter.check, *args)
+            else:
+                retry_after = funnel.rate_limiter.check(*args)
+            if retry_after is not None:
+                return JSONResponse(
+                    {'error': 'Too many requests, please retry later'},
+                    status_code=429,
+                    headers={'Retry-After': str(retry_after)}
+                )
+        return await handler(request)
+    return wrapper
+
+def idempotent(handler):
+    """Async counterpart of IdempotencyStore.idempotent"""
+    @functools.wraps(handler)
+    async def wrapper(request):
+        body = await request.body()
+
+        async def execute():
+            response = await handler(request)
+            return {'status_code': response.status_code, 'headers': response.headers, 'body': response.body}
+
+        result = await funnel.idempotency.handle_async(
+            request.headers.get('Idempotency-Key'), request.method, request.url.path, body, execute
+        )
+        return Response(result['body'], status_code=result['status_code'], headers=dict(result['headers']))
+    return wrapper
+
+async def read_json(request):
+    """Parsed JSON object of the request body, or None if the body is not one"""
+    try:
+        data = json.loads(await request.body())
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+@instrumented('/api/save-lead')
+@rate_limited
+@idempotent
+async def save_lead(request):
+    """API endpoint to save lead"""
+    try:
+        data = await read_json(request)
+        if data is None:
+            return JSONResponse({'error': 'Request body must be a JSON object'}, status_code=400)
+
+        # Validate required fields
+        missing_fields = validate_required_fields(data, 'lead')
+        if missing_fields:
+            return JSONResponse({'error': f'Missing required fields: {", ".join(missing_fields)}'}, status_code=400)
+
+        # Sanitize input
+        first_name = sanitize_input(data.get('firstName', ''))
+        email = sanitize_input(data.get('email', ''))
+
+        # Validate email format
+        if not validate_email(email):
+            return JSONResponse({'error': 'Invalid email format'}, status_code=400)
+
+        # Save lead to database
+        result = await asyncio.to_thread(funnel.db_manager.save_lead, first_name, email)
+
+        if result['success']:
+            log_lead_creation(email, first_name)
+            return JSONResponse({
+                'success': True,
+                'message': 'Lead saved successfully',
+                'lead_id': result['lead_id']
+            })
+        else:
+            return JSONResponse({'error': result['error']}, status_code=409)
+
+    except Exception as e:
+        log_error(str(e), 'save_lead')
+        return JSONResponse({'error': 'Internal server error'}, status_code=500)
+
+@instrumented('/api/save-appointment')
+@rate_limited
+@idempotent
+async def save_appointment(request):
+    """API endpoint to save appointment with Google Calendar integration"""
+    try:
+        data = await read_json(request)
+        if data is None:
+            return JSONResponse({'error': 'Request body must be a JSON object'}, status_code=400)
+
+        # Validate required fields
+        missing_fields = validate_required_fields(data, 'appointment')
+        if missing_fields:
+            return JSONResponse({'error': f'Missing required fields: {", ".join(missing_fields)}'}, status_code=400)
+
+        # Sanitize input
+        sanitized_data = funnel.sanitize_appointment_data(data)
+
+        # Validate email format
+        if not validate_email(sanitized_data['email']):
+            return JSONResponse({'error': 'Invalid email format'}, status_code=400)
+
+        result = await funnel.booking.save_appointment(sanitized_data)
+
+        if result['success']:
+            await asyncio.to_thread(funnel.after_appointment_saved, sanitized_data, result['appointment_id'])
+            return JSONResponse({
+                'success': True,
+                'message': 'Appointment saved successfully',
+                'appointment_id': result['appointment_id'],
+                'google_event_id': result.get('google_event_id'),
+                'google_event_link': result.get('google_event_link'),
+                'calendar_message': result.get('calendar_message'),
+                'calendar_sync_status': result.get('calendar_sync_status', 'synced'),
+                'confirmation_sent': result['confirmation_sent'],
+                'confirmation_message_id': result.get('confirmation_message_id')
+            })
+        else:
+            return JSONResponse({'error': result['error']}, status_code=500)
+
+    except Exception as e:
+        log_error(str(e), 'save_appointment')
+        return JSONResponse({'error': 'Internal server error'}, status_code=500)
+
+def load_slots_response(date):
+    """Slots for a date from the slot cache (blocking on a miss)"""
+    cache_key = SlotCache.make_key(Config.GOOGLE_CALENDAR_ID, date, Config.APPOINTMENT_DURATION_MINUTES)
+    return {
+        'success': True,
+        'date': date,
+        'available_slots': funnel.slot_cache.get_or_load(cache_key, lambda: funnel.load_available_slots(date)),
+        'google_calendar_available': funnel.db_manager.calendar_manager.is_google_calendar_available()
+    }
+
+@instrumented('/api/available-slots/<date>')
+async def get_available_slots(request):
+    """API endpoint to get available time slots for a specific date"""
+    try:
+        date = request.path_params['date']
+
+        # Validate date format
+        try:
+            datetime.strptime(date, '%Y-%m-%d')
+        except ValueError:
+            return JSONResponse({'error': 'Invalid date format. Use YYYY-MM-DD'}, status_code=400)
+
+        return JSONResponse(await asyncio.to_thread(load_slots_response, date))
+
+    except Exception as e:
+        log_error(str(e), 'get_available_slots')
+        return JSONResponse({'error': 'Internal server error'}, status_code=500)
+
+@asynccontextmanager
+async def lifespan(starlette_app):
+    """Size the thread pool used for blocking calls; stop background threads on shutdown"""
+    executor = ThreadPoolExecutor(max_workers=Config.ASYNC_IO_THREADS, thread_name_prefix='asgi-io')
+    asyncio.get_running_loop().set_default_executor(executor)
+    try:
+        yield
+    finally:
+        funnel.stop_background_services()
+        executor.shutdown(wait=False)
+
+app = Starlette(
+    routes=[
+        Route('/api/save-lead', save_lead, methods=['POST']),
+        Route('/api/save-appointment', save_appointment, methods=['POST']),
+        Route('/api/available-slots/{date}', get_available_slots),
+        # Everything else is served by the Flask app
+        Mount('/', WSGIMiddleware(funnel.app, workers=Config.ASYNC_WSGI_THREADS))
+    ],
+    lifespan=lifespan
+)
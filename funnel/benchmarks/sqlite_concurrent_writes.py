@@ -0,0 +1,130 @@
+"""
+Бенчмарк конкурентной записи лидов в SQLite
+
+Сравнивает исходный способ работы с базой (новое соединение на каждую
+операцию, журнал по умолчанию, таймаут 5 секунд) со слоем database.connection
+(WAL, busy_timeout, соединение на поток, кэш подготовленных выражений).
+
+Запуск из каталога funnel:
+    python benchmarks/sqlite_concurrent_writes.py --threads 16 --writes 200
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database.connection import Database  # noqa: E402
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS leads (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    first_name TEXT NOT NULL,
+    email TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+'''
+
+
+def save_lead_per_call_connection(db_path: str, first_name: str, email: str) -> None:
+    """Запись лида так, как это делает DatabaseManager: соединение на операцию"""
+    conn = sqlite3.connect(db_path)
+    try:
+        with conn:
+            # Проверка дубликата, затем вставка - типичный путь save_lead
+            conn.execute('SELECT id FROM leads WHERE email = ?', (email,)).fetchone()
+            conn.execute('INSERT INTO leads (first_name, email) VALUES (?, ?)', (first_name, email))
+    finally:
+        conn.close()
+
+
+def make_pooled_writer(db_path: str):
+    database = Database(db_path)
+
+    def save_lead(db_path: str, first_name: str, email: str) -> None:
+        with database.transaction(immediate=True) as conn:
+            conn.execute('SELECT id FROM leads WHERE email = ?', (email,)).fetchone()
+            conn.execute('INSERT INTO leads (first_name, email) VALUES (?, ?)', (first_name, email))
+
+    return save_lead
+
+
+def run(name: str, writer, db_path: str, threads: int, writes: int) -> dict:
+    errors = []
+    latencies = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(threads)
+
+    def worker(index: int) -> None:
+        barrier.wait()
+        local_latencies = []
+        for number in range(writes):
+            started = time.perf_counter()
+            try:
+                writer(db_path, f'Lead {index}-{number}', f'lead-{index}-{number}@example.com')
+            except sqlite3.OperationalError as e:
+                with lock:
+                    errors.append(str(e))
+            local_latencies.append(time.perf_counter() - started)
+        with lock:
+            latencies.extend(local_latencies)
+
+    pool = [threading.Thread(target=worker, args=(index,)) for index in range(threads)]
+    started = time.perf_counter()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    conn = sqlite3.connect(db_path)
+    saved = conn.execute('SELECT COUNT(*) FROM leads').fetchone()[0]
+    conn.close()
+
+    latencies.sort()
+    return {
+        'name': name,
+        'saved': saved,
+        'errors': len(errors),
+        'locked_errors': sum('locked' in error for error in errors),
+        'writes_per_second': saved / elapsed if elapsed else 0.0,
+        'p50_ms': latencies[len(latencies) // 2] * 1000,
+        'p99_ms': latencies[int(len(latencies) * 0.99) - 1] * 1000
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--writes', type=int, default=200, help='Записей на поток')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        results = []
+        for name, factory in (
+            ('connection per call', lambda path: save_lead_per_call_connection),
+            ('WAL + per-thread connection', make_pooled_writer)
+        ):
+            db_path = os.path.join(directory, name.replace(' ', '_') + '.db')
+            conn = sqlite3.connect(db_path)
+            conn.executescript(SCHEMA)
+            conn.close()
+            results.append(run(name, factory(db_path), db_path, args.threads, args.writes))
+
+    print(f"{args.threads} потоков x {args.writes} записей")
+    print(f"{'режим':<30}{'записано':>10}{'ошибок':>8}{'locked':>8}{'зап/с':>10}{'p50 мс':>9}{'p99 мс':>9}")
+    for result in results:
+        print(
+            f"{result['name']:<30}{result['saved']:>10}{result['errors']:>8}{result['locked_errors']:>8}"
+            f"{result['writes_per_second']:>10.0f}{result['p50_ms']:>9.2f}{result['p99_ms']:>9.2f}"
+        )
+
+
+if __name__ == '__main__':
+    main()
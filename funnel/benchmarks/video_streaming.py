@@ -0,0 +1,165 @@
+"""
+Бенчмарк отдачи видео зрителям, которые перематывают ролик
+
+Сравнивает send_from_directory (как раньше отдавался /static) с
+utils.video_stream.VideoStreamer на наборе локальных файлов. Каждый
+зритель запрашивает случайный файл с случайной позиции (Range: bytes=N-) и
+читает --read-mb мегабайт, после чего закрывает соединение - так браузер
+ведет себя при перемотке.
+
+Сервер - многопоточный werkzeug, у него нет wsgi.file_wrapper, поэтому
+здесь измеряется путь без sendfile; под gunicorn диапазоны до конца файла
+отдаются через sendfile.
+
+Запуск из каталога funnel:
+    python benchmarks/video_streaming.py --viewers 32 --requests 20
+"""
+
+import argparse
+import http.client
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, send_from_directory  # noqa: E402
+from werkzeug.serving import make_server  # noqa: E402
+
+from utils.static_assets import StaticAssets  # noqa: E402
+from utils.video_stream import VideoStreamer  # noqa: E402
+
+
+def make_files(directory: str, count: int, size_mb: int) -> list:
+    names = []
+    block = os.urandom(1024 * 1024)
+    for index in range(count):
+        name = f'vsl-{index}.mp4'
+        with open(os.path.join(directory, name), 'wb') as stream:
+            for _ in range(size_mb):
+                stream.write(block)
+        names.append(name)
+    return names
+
+
+def make_app(directory: str, max_bytes_per_second: int) -> Flask:
+    app = Flask(__name__, static_folder=None)
+    streamer = VideoStreamer(
+        StaticAssets(directory, precompress_on_scan=False),
+        max_bytes_per_second=max_bytes_per_second
+    )
+
+    @app.route('/old/<path:filename>')
+    def old(filename):
+        return send_from_directory(directory, filename)
+
+    @app.route('/new/<path:filename>')
+    def new(filename):
+        return streamer.serve(filename)
+
+    return app
+
+
+def run(name: str, port: int, prefix: str, names: list, size: int, viewers: int, requests: int,
+        read_bytes: int) -> dict:
+    latencies = []
+    received = []
+    errors = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(viewers)
+
+    def viewer(seed: int) -> None:
+        rng = random.Random(seed)
+        barrier.wait()
+        local_latencies = []
+        local_received = 0
+        for _ in range(requests):
+            offset = rng.randrange(0, size - read_bytes)
+            started = time.perf_counter()
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+            try:
+                conn.request('GET', f'{prefix}/{rng.choice(names)}', headers={'Range': f'bytes={offset}-'})
+                response = conn.getresponse()
+                first_byte = None
+                remaining = read_bytes
+                while remaining > 0:
+                    chunk = response.read(min(remaining, 256 * 1024))
+                    if first_byte is None:
+                        first_byte = time.perf_counter() - started
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    local_received += len(chunk)
+                if response.status != 206:
+                    raise RuntimeError(f'status {response.status}')
+                local_latencies.append((first_byte, time.perf_counter() - started))
+            except Exception as e:
+                with lock:
+                    errors.append(str(e))
+            finally:
+                conn.close()
+        with lock:
+            latencies.extend(local_latencies)
+            received.append(local_received)
+
+    threads = [threading.Thread(target=viewer, args=(index,)) for index in range(viewers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    first_bytes = sorted(latency[0] for latency in latencies)
+    totals = sorted(latency[1] for latency in latencies)
+    return {
+        'name': name,
+        'requests': len(latencies),
+        'errors': len(errors),
+        'mb_per_second': sum(received) / elapsed / 1024 / 1024,
+        'ttfb_p50_ms': first_bytes[len(first_bytes) // 2] * 1000 if first_bytes else 0.0,
+        'p50_ms': totals[len(totals) // 2] * 1000 if totals else 0.0,
+        'p99_ms': totals[max(int(len(totals) * 0.99) - 1, 0)] * 1000 if totals else 0.0
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=4)
+    parser.add_argument('--size-mb', type=int, default=64)
+    parser.add_argument('--viewers', type=int, default=32)
+    parser.add_argument('--requests', type=int, default=20, help='Перемоток на зрителя')
+    parser.add_argument('--read-mb', type=float, default=2, help='Сколько читается после перемотки')
+    parser.add_argument('--max-bytes-per-second', type=int, default=0, help='Ограничение VideoStreamer')
+    args = parser.parse_args()
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    with tempfile.TemporaryDirectory() as directory:
+        names = make_files(directory, args.files, args.size_mb)
+        server = make_server('127.0.0.1', 0, make_app(directory, args.max_bytes_per_second), threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            size = args.size_mb * 1024 * 1024
+            read_bytes = int(args.read_mb * 1024 * 1024)
+            results = [
+                run(name, server.port, prefix, names, size, args.viewers, args.requests, read_bytes)
+                for name, prefix in (('send_from_directory', '/old'), ('VideoStreamer', '/new'))
+            ]
+        finally:
+            server.shutdown()
+
+    print(f"{args.viewers} зрителей x {args.requests} перемоток, {args.files} файлов по {args.size_mb} МБ")
+    print(f"{'режим':<22}{'запросов':>10}{'ошибок':>8}{'МБ/с':>9}{'TTFB p50':>10}{'p50 мс':>9}{'p99 мс':>9}")
+    for result in results:
+        print(
+            f"{result['name']:<22}{result['requests']:>10}{result['errors']:>8}{result['mb_per_second']:>9.1f}"
+            f"{result['ttfb_p50_ms']:>10.2f}{result['p50_ms']:>9.2f}{result['p99_ms']:>9.2f}"
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -3,16 +3,25 @@ import os
 class Config:
     # Flask settings
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev-secret-key-change-in-production'
-    DEBUG = True
+    DEBUG = os.environ.get('DEBUG', 'False').lower() == 'true'
     
     # Database settings
     DATABASE_PATH = 'database/funnel.db'
+    SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS') or 5000)
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS') or 'NORMAL'  # NORMAL is durable enough with WAL
+    SQLITE_CACHE_SIZE_KB = int(os.environ.get('SQLITE_CACHE_SIZE_KB') or 16384)
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE') or 64 * 1024 * 1024)
+    SQLITE_STATEMENT_CACHE_SIZE = 256  # Prepared statements cached per connection
     
     # File paths
     STATIC_FOLDER = 'static'
     TEMPLATES_FOLDER = 'templates'
     PAGES_FOLDER = 'pages'
     ADMIN_FOLDER = 'admin'
+
+    # Admin panel and admin APIs (HTTP Basic); they answer 503 until ADMIN_PASSWORD is set
+    ADMIN_USERNAME = os.environ.get('ADMIN_USERNAME') or 'admin'
+    ADMIN_PASSWORD = os.environ.get('ADMIN_PASSWORD') or ''
     
     # Available dates for calendar (August 2025)
     AVAILABLE_DATES = [21, 22, 23, 24]
@@ -44,15 +53,152 @@ class Config:
     SENDER_PASSWORD = os.environ.get('SENDER_PASSWORD') or 'your-app-password'
     USE_TLS = os.environ.get('USE_TLS', 'True').lower() == 'true'
     ADMIN_EMAIL = os.environ.get('ADMIN_EMAIL') or 'admin@example.com'
+    SENDER_NAME = os.environ.get('SENDER_NAME') or 'Anna Raight'
+    SMTP_TIMEOUT_SECONDS = int(os.environ.get('SMTP_TIMEOUT_SECONDS') or 30)
+
+    # Pooled SMTP delivery queue
+    SMTP_POOL_SIZE = int(os.environ.get('SMTP_POOL_SIZE') or 3)
+    SMTP_POOL_IDLE_SECONDS = 30  # Idle connections are checked with NOOP before reuse
+    MAIL_QUEUE_MAX_SIZE = int(os.environ.get('MAIL_QUEUE_MAX_SIZE') or 1000)
+    MAIL_QUEUE_POLL_SECONDS = 1  # How soon a worker picks up mail queued by another process
+    MAIL_QUEUE_LEASE_SECONDS = 120  # A 'sending' row is reclaimed after this long (worker died mid-send)
+    MAIL_QUEUE_RETENTION_SECONDS = 7 * 24 * 3600  # Delivered and failed rows are kept this long for status lookups
+    MAIL_QUEUE_MAX_ATTEMPTS = 5
+    MAIL_QUEUE_RETRY_BASE_SECONDS = 10
     
     # Google Calendar settings
     GOOGLE_CALENDAR_ID = os.environ.get('GOOGLE_CALENDAR_ID') or 'primary'
     GOOGLE_CREDENTIALS_FILE = 'database/credentials.json'
     GOOGLE_TOKEN_FILE = 'database/token.json'
+    # Override the Calendar API base URL (e.g. a local fake server for testing)
+    GOOGLE_CALENDAR_API_ENDPOINT = os.environ.get('GOOGLE_CALENDAR_API_ENDPOINT')
+    GOOGLE_HTTP_TIMEOUT_SECONDS = int(os.environ.get('GOOGLE_HTTP_TIMEOUT_SECONDS') or 30)
+    GOOGLE_TOKEN_REFRESH_MARGIN_SECONDS = 300  # Refresh the access token this long before expiry
+    GOOGLE_TOKEN_REFRESH_RETRY_SECONDS = 60
+    GOOGLE_BATCH_MAX_SIZE = 50  # Calendar API limit of calls per batch request
+    GOOGLE_BATCH_MAX_RETRIES = 3
+    GOOGLE_BATCH_RETRY_BASE_SECONDS = 1
+
+    # Local mirror of Google Calendar events (incremental syncToken sync)
+    CALENDAR_SYNC_ENABLED = os.environ.get('CALENDAR_SYNC_ENABLED', 'True').lower() == 'true'
+    CALENDAR_MIRROR_PATH = 'database/calendar_mirror.db'
+    CALENDAR_SYNC_INTERVAL_SECONDS = int(os.environ.get('CALENDAR_SYNC_INTERVAL_SECONDS') or 60)
+    CALENDAR_SYNC_STALE_FACTOR = 3  # Mirror is stale after this many missed sync intervals
+    CALENDAR_SYNC_LOOKBACK_DAYS = 7  # A full sync skips events that ended before this
+    CALENDAR_SYNC_REQUEST_POLL_SECONDS = 2  # How often the sync thread checks for requests from other workers
+
+    # Asynchronous Google Calendar writes through the calendar_outbox table
+    CALENDAR_OUTBOX_ENABLED = os.environ.get('CALENDAR_OUTBOX_ENABLED', 'False').lower() == 'true'
+    CALENDAR_OUTBOX_WORKERS = int(os.environ.get('CALENDAR_OUTBOX_WORKERS') or 2)
+    CALENDAR_OUTBOX_POLL_SECONDS = 2
+    CALENDAR_OUTBOX_LEASE_SECONDS = 120  # In-progress rows are reclaimed after this long
+    CALENDAR_OUTBOX_MAX_ATTEMPTS = 8
+    CALENDAR_OUTBOX_RETRY_BASE_SECONDS = 5
     
     # Appointment settings
     APPOINTMENT_DURATION_MINUTES = 60
     REMINDER_EMAIL_HOURS_BEFORE = 24  # Send reminder 24 hours before
+    REMINDER_CONCURRENCY = int(os.environ.get('REMINDER_CONCURRENCY') or 3)
+    REMINDER_PAGE_SIZE = 200
+    REMINDER_CLAIM_LEASE_SECONDS = 600  # A crashed sender's claimed reminders become sendable again after this
+    REMINDER_SCHEDULER_ENABLED = os.environ.get('REMINDER_SCHEDULER_ENABLED', 'True').lower() == 'true'
+    REMINDER_SCHEDULER_MAX_SLEEP_SECONDS = 300  # Re-check the wall clock at least this often
+    REMINDER_SCHEDULER_POLL_SECONDS = 5  # Read schedule changes written by other workers this often
+    REMINDER_SCHEDULER_CHANGES_RETENTION_SECONDS = 24 * 60 * 60  # Unread changes (no leader running) are dropped after this
     CONFIRMATION_EMAIL_ENABLED = True
     REMINDER_EMAIL_ENABLED = True
-    ADMIN_NOTIFICATION_ENABLED = True 
\ No newline at end of file
+    ADMIN_NOTIFICATION_ENABLED = True
+
+    # Working hours for Google Calendar slots (in DEFAULT_TIMEZONE)
+    WORKING_HOURS_START = os.environ.get('WORKING_HOURS_START') or '09:00'
+    WORKING_HOURS_END = os.environ.get('WORKING_HOURS_END') or '18:00'
+    SLOT_GRANULARITY_MINUTES = int(os.environ.get('SLOT_GRANULARITY_MINUTES') or 15)
+
+    # Maximum number of days for /api/available-slots?from=&to=
+    AVAILABILITY_MAX_RANGE_DAYS = int(os.environ.get('AVAILABILITY_MAX_RANGE_DAYS') or 31)
+
+    # Available slots cache
+    SLOT_CACHE_TTL_SECONDS = int(os.environ.get('SLOT_CACHE_TTL_SECONDS') or 60)
+    SLOT_CACHE_MAX_ENTRIES = int(os.environ.get('SLOT_CACHE_MAX_ENTRIES') or 512) 
+    # Invalidations are shared between worker processes through funnel.db
+    SLOT_CACHE_SHARED_INVALIDATION = os.environ.get('SLOT_CACHE_SHARED_INVALIDATION', 'True').lower() == 'true'
+    SLOT_CACHE_INVALIDATION_POLL_SECONDS = 1.0  # Staleness bound for invalidations made by other workers
+    SLOT_CACHE_INVALIDATION_RETENTION_SECONDS = 3600
+
+    # /api/leads pagination and NDJSON streaming
+    LEADS_PAGE_SIZE = 50
+    LEADS_MAX_PAGE_SIZE = 500
+    LEADS_STREAM_BATCH_SIZE = 500  # Rows fetched per keyset query while streaming
+    LEAD_IMPORT_BATCH_SIZE = int(os.environ.get('LEAD_IMPORT_BATCH_SIZE') or 5000)  # Rows per import transaction
+    LEAD_IMPORT_MAX_REPORTED_ERRORS = 100
+
+    # Materialized funnel statistics (funnel_counters / funnel_daily)
+    STATS_DAILY_MAX_DAYS = 366
+
+    # Idempotency-Key response store for POST endpoints
+    IDEMPOTENCY_TTL_SECONDS = int(os.environ.get('IDEMPOTENCY_TTL_SECONDS') or 24 * 3600)
+    IDEMPOTENCY_WAIT_SECONDS = 30  # How long a duplicate waits for the original request
+    IDEMPOTENCY_LOCK_SECONDS = 120  # In-progress keys are taken over after this long
+    IDEMPOTENCY_POLL_SECONDS = 0.2
+    IDEMPOTENCY_PURGE_INTERVAL_SECONDS = 300
+
+    # Non-blocking request log (JSON lines written in batches by a background thread)
+    REQUEST_LOG_PATH = os.environ.get('REQUEST_LOG_PATH') or 'logs/requests.log'
+    REQUEST_LOG_QUEUE_SIZE = 10000  # Records beyond this are dropped instead of blocking requests
+    REQUEST_LOG_BATCH_SIZE = 500
+    REQUEST_LOG_FLUSH_SECONDS = 1.0
+    REQUEST_LOG_SLOW_MS = 1000  # Slow requests and errors are never sampled out
+    # Path prefix -> share of successful requests that are logged
+    REQUEST_LOG_SAMPLE_RATES = {
+        '/static/': 0.01,
+        '/api/available-slots': 0.1
+    }
+
+    # Metrics (Prometheus text format at /metrics, summed across worker processes)
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'True').lower() == 'true'
+    METRICS_FLUSH_SECONDS = int(os.environ.get('METRICS_FLUSH_SECONDS') or 5)
+    METRICS_STALE_SECONDS = 30  # In-flight gauges of workers silent for longer are ignored
+    METRICS_RETENTION_SECONDS = 86400  # Snapshots of exited workers are folded into one aggregate row after this long
+    METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    # Static assets (fingerprinted URLs, precompressed gzip/brotli variants, cache of small files)
+    STATIC_MAX_AGE_SECONDS = int(os.environ.get('STATIC_MAX_AGE_SECONDS') or 300)  # URLs without a fingerprint
+    STATIC_IMMUTABLE_MAX_AGE_SECONDS = 31536000  # Fingerprinted URLs change with the content
+    # Build .gz/.br variants at deploy time (python -m utils.static_assets); runtime building writes into the source tree
+    STATIC_PRECOMPRESS = os.environ.get('STATIC_PRECOMPRESS', 'False').lower() == 'true'
+    STATIC_PRECOMPRESS_MIN_BYTES = 1024
+    STATIC_HASH_MAX_BYTES = 16 * 1024 * 1024  # Larger files (videos) get a size/mtime ETag
+    STATIC_CACHE_MAX_BYTES = 32 * 1024 * 1024
+    STATIC_CACHE_MAX_FILE_BYTES = 512 * 1024
+
+    # Video streaming (Range requests, sendfile, per-response bandwidth limit)
+    VIDEO_MAX_BYTES_PER_SECOND = int(os.environ.get('VIDEO_MAX_BYTES_PER_SECOND') or 0)  # 0 - unlimited, uses sendfile
+    VIDEO_BURST_BYTES = 4 * 1024 * 1024  # Sent at full speed before the limit applies
+    VIDEO_CHUNK_SIZE = 256 * 1024
+    VIDEO_MAX_RANGES = 16  # Requests with more ranges get the whole file
+
+    # Process model (gunicorn.conf.py starts background threads per worker after fork)
+    BACKGROUND_SERVICES_AUTOSTART = os.environ.get('BACKGROUND_SERVICES_AUTOSTART', 'True').lower() == 'true'
+    # Calendar sync, outbox and reminder scheduler run only in the process holding this lock
+    LEADER_LOCK_PATH = os.environ.get('LEADER_LOCK_PATH') or 'database/leader.lock'
+    LEADER_POLL_SECONDS = 5  # How soon another worker takes over after the leader exits
+
+    # ASGI entry point (asgi.py): thread pools for blocking calls and for routes served by Flask
+    ASYNC_IO_THREADS = int(os.environ.get('ASYNC_IO_THREADS') or 64)
+    ASYNC_WSGI_THREADS = int(os.environ.get('ASYNC_WSGI_THREADS') or 10)
+
+    # Token-bucket rate limiting of form endpoints, checked before the JSON body is parsed
+    RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'True').lower() == 'true'
+    RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND') or 'memory'  # 'sqlite' shares buckets between workers
+    # Header set by the reverse proxy, e.g. X-Forwarded-For behind nginx; without it
+    # requests from a loopback peer (a local proxy) are not limited by IP
+    RATE_LIMIT_PROXY_HEADER = os.environ.get('RATE_LIMIT_PROXY_HEADER') or None
+    RATE_LIMIT_MAX_KEYS = 100000  # Least recently used in-memory buckets beyond this are dropped
+    RATE_LIMIT_MAX_BODY_BYTES = 16 * 1024  # Larger bodies are parsed as JSON instead of scanned for the email
+    RATE_LIMIT_PURGE_INTERVAL_SECONDS = 300
+    # Path -> key -> (burst, requests per minute)
+    RATE_LIMITS = {
+        '/api/save-lead': {'ip': (10, 20), 'email': (3, 2)},
+        '/api/save-appointment': {'ip': (5, 10), 'email': (3, 2)},
+        '/api/send-video-email': {'ip': (5, 10), 'email': (2, 1)}
+    }
@@ -0,0 +1,165 @@
+"""
+Database Connection Module
+Слой соединений SQLite: WAL, busy_timeout, соединение на поток и кэш подготовленных выражений
+"""
+
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator
+
+from config import Config
+
+
+class Database:
+    """Соединения с одним файлом SQLite, по одному на поток
+
+    Соединение открывается при первом обращении из потока и дальше
+    переиспользуется, поэтому PRAGMA выполняются один раз, а кэш
+    подготовленных выражений sqlite3 (cached_statements) реально работает.
+    Соединения работают в autocommit режиме; транзакции открываются явно
+    через transaction(). После fork дочерний процесс открывает свои соединения.
+    """
+
+    def __init__(self, db_path: str = None):
+        """
+        Инициализация слоя соединений
+
+        Args:
+            db_path: Путь к файлу базы данных
+        """
+        self.db_path = db_path or Config.DATABASE_PATH
+        self._local = threading.local()
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self.connections_opened = 0
+
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=Config.SQLITE_BUSY_TIMEOUT_MS / 1000,
+            isolation_level=None,
+            cached_statements=Config.SQLITE_STATEMENT_CACHE_SIZE
+        )
+        conn.row_factory = sqlite3.Row
+        # journal_mode=WAL сохраняется в файле базы и действует для всех соединений,
+        # в том числе открытых не через этот слой
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute(f'PRAGMA busy_timeout = {int(Config.SQLITE_BUSY_TIMEOUT_MS)}')
+        conn.execute(f'PRAGMA synchronous = {Config.SQLITE_SYNCHRONOUS}')
+        conn.execute(f'PRAGMA cache_size = -{int(Config.SQLITE_CACHE_SIZE_KB)}')
+        conn.execute(f'PRAGMA mmap_size = {int(Config.SQLITE_MMAP_SIZE)}')
+        conn.execute('PRAGMA temp_store = MEMORY')
+        with self._lock:
+            self.connections_opened += 1
+        return conn
+
+    def connection(self) -> sqlite3.Connection:
+        """
+        Соединение текущего потока
+
+        Returns:
+            sqlite3.Connection в autocommit режиме
+        """
+        if os.getpid() != self._pid:
+            # Соединения, унаследованные от родителя, использовать после fork нельзя
+            self._local = threading.local()
+            self._pid = os.getpid()
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._open()
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self, immediate: bool = False) -> Iterator[sqlite3.Connection]:
+        """
+        Транзакция на соединении текущего потока: COMMIT при успехе, ROLLBACK при ошибке
+
+        Вложенный вызов внутри уже открытой транзакции использует SAVEPOINT.
+
+        Args:
+            immediate: Взять блокировку записи сразу (BEGIN IMMEDIATE). Нужно для
+                транзакций, которые сначала читают, а потом пишут - иначе в WAL
+                повышение блокировки может завершиться SQLITE_BUSY без ожидания.
+        """
+        conn = self.connection()
+        if conn.in_transaction:
+            savepoint = f'sp_{id(conn)}_{threading.get_ident()}'
+            conn.execute(f'SAVEPOINT {savepoint}')
+            try:
+                yield conn
+            except BaseException:
+                conn.execute(f'ROLLBACK TO {savepoint}')
+                conn.execute(f'RELEASE {savepoint}')
+                raise
+            conn.execute(f'RELEASE {savepoint}')
+            return
+
+        conn.execute('BEGIN IMMEDIATE' if immediate else 'BEGIN')
+        try:
+            yield conn
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def executescript(self, script: str) -> None:
+        """
+        Выполнение SQL скрипта (создание схемы) вне транзакции
+
+        Args:
+            script: SQL скрипт
+        """
+        self.connection().executescript(script)
+
+    def close(self) -> None:
+        """Закрытие соединения текущего потока"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            self._local.conn = None
+            conn.close()
+
+    def stats(self) -> Dict[str, Any]:
+        """Параметры и счетчики слоя соединений"""
+        conn = self.connection()
+        return {
+            'db_path': self.db_path,
+            'journal_mode': conn.execute('PRAGMA journal_mode').fetchone()[0],
+            'busy_timeout_ms': conn.execute('PRAGMA busy_timeout').fetchone()[0],
+            'synchronous': conn.execute('PRAGMA synchronous').fetchone()[0],
+            'cache_size': conn.execute('PRAGMA cache_size').fetchone()[0],
+            'mmap_size': conn.execute('PRAGMA mmap_size').fetchone()[0],
+            'statement_cache_size': Config.SQLITE_STATEMENT_CACHE_SIZE,
+            'connections_opened': self.connections_opened
+        }
+
+
+_databases: Dict[str, Database] = {}
+_databases_lock = threading.Lock()
+
+
+def get_database(db_path: str = None) -> Database:
+    """
+    Общий для процесса слой соединений для файла базы
+
+    Args:
+        db_path: Путь к файлу базы данных (по умолчанию Config.DATABASE_PATH)
+
+    Returns:
+        Database
+    """
+    db_path = db_path or Config.DATABASE_PATH
+    path = os.path.abspath(db_path)
+    with _databases_lock:
+        database = _databases.get(path)
+        if database is None:
+            database = Database(db_path)
+            _databases[path] = database
+        return database
@@ -0,0 +1,255 @@
+"""
+Database Migrations Module
+Нумерованные миграции funnel.db и проверка планов горячих запросов
+
+Запуск из каталога funnel:
+    python -m database.migrations                  # применить миграции
+    python -m database.migrations --check          # проверить EXPLAIN QUERY PLAN
+    python -m database.migrations --dedupe-leads   # перенести дубликаты лидов в leads_duplicates
+"""
+
+import re
+import sqlite3
+import sys
+from typing import Any, Callable, Dict, List, Tuple, Union
+
+from config import Config
+from database.connection import Database, get_database
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+'''
+
+
+
+class MigrationError(RuntimeError):
+    """Миграцию нельзя применить без ручного шага"""
+
+
+# Группы лидов с одинаковым email без учета регистра и пробелов
+DUPLICATE_LEADS_SQL = '''
+SELECT lower(trim(email)) AS email, COUNT(*) AS count FROM leads
+GROUP BY lower(trim(email)) HAVING COUNT(*) > 1
+'''
+
+
+def require_unique_lead_emails(conn: sqlite3.Connection) -> None:
+    """
+    Проверка перед уникальным индексом по email лида
+
+    Raises:
+        MigrationError: в leads есть дубликаты; удалять их молча миграция не должна
+    """
+    groups = conn.execute(DUPLICATE_LEADS_SQL).fetchall()
+    if groups:
+        extra = sum(row['count'] - 1 for row in groups)
+        examples = ', '.join(row['email'] for row in groups[:5])
+        raise MigrationError(
+            f'В leads {extra} дубликатов email ({len(groups)} адресов, например: {examples}). '
+            'Проверьте их и выполните "python -m database.migrations --dedupe-leads" - '
+            'он оставит самый ранний лид, а остальные перенесет в leads_duplicates'
+        )
+
+
+def add_reminder_claim_column(conn: sqlite3.Connection) -> None:
+    """Аренда захвата напоминания: после падения отправителя встреча снова доступна для отправки"""
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(appointments)')]
+    if 'reminder_claimed_until' not in columns:
+        conn.execute('ALTER TABLE appointments ADD COLUMN reminder_claimed_until REAL')
+
+
+# (версия, имя, выражения или функции(conn)). Применённые миграции не меняются - только новые версии.
+MIGRATIONS: List[Tuple[int, str, List[Union[str, Callable[[sqlite3.Connection], None]]]]] = [
+    (1, 'leads_created_at_index', [
+        # Сортировка админки и today_leads; rowid (id) входит в индекс неявно
+        'CREATE INDEX IF NOT EXISTS idx_leads_created_at ON leads (created_at)',
+    ]),
+    (2, 'appointments_date_indexes', [
+        # Занятые слоты на дату
+        '''CREATE INDEX IF NOT EXISTS idx_appointments_date_time
+           ON appointments (appointment_date, appointment_time, status)''',
+        # Страницы напоминаний: appointment_date = ? AND reminder_sent = 0 AND id > ? ORDER BY id
+        '''CREATE INDEX IF NOT EXISTS idx_appointments_reminder
+           ON appointments (appointment_date, reminder_sent)''',
+    ]),
+    (3, 'appointments_email_index', [
+        # Последняя встреча лида (MAX(id) по email) в выборке лидов
+        'CREATE INDEX IF NOT EXISTS idx_appointments_email ON appointments (email)',
+    ]),
+    (4, 'leads_unique_normalized_email', [
+        # При дубликатах (без учета регистра и пробелов) миграция останавливается;
+        # удаляются они только явной командой --dedupe-leads
+        require_unique_lead_emails,
+        'CREATE UNIQUE INDEX IF NOT EXISTS ux_leads_email_normalized ON leads (lower(trim(email)))',
+    ]),
+    (5, 'leads_created_at_keyset_index', [
+        # Keyset-страницы по created_at: ORDER BY COALESCE(l.created_at, ''), l.id (как в SORT_COLUMNS)
+        "CREATE INDEX IF NOT EXISTS idx_leads_created_at_keyset ON leads (COALESCE(created_at, ''))",
+    ]),
+    (6, 'appointments_reminder_claim_lease', [
+        add_reminder_claim_column,
+        # Страницы напоминаний с условием reminder_sent = 0 OR reminder_claimed_until < ?:
+        # appointment_date = ? AND id > ? ORDER BY id без сортировки
+        'CREATE INDEX IF NOT EXISTS idx_appointments_date_id ON appointments (appointment_date, id)',
+    ]),
+]
+
+# Запрос дубликата лида, использующий ux_leads_email_normalized
+LEAD_BY_EMAIL_SQL = 'SELECT id FROM leads WHERE lower(trim(email)) = lower(trim(?))'
+
+# Горячие запросы и параметры для EXPLAIN QUERY PLAN
+HOT_QUERIES: Dict[str, Tuple[str, Tuple[Any, ...]]] = {
+    'lead_by_email': (LEAD_BY_EMAIL_SQL, ('Lead@Example.com',)),
+    'today_leads': (
+        'SELECT COUNT(*) FROM leads WHERE created_at >= ? AND created_at < ?',
+        ('2025-08-21', '2025-08-22')
+    ),
+    'admin_leads_page': (
+        '''SELECT l.id, l.email, a.status, l.created_at FROM leads l
+           LEFT JOIN appointments a ON a.id = (SELECT MAX(id) FROM appointments WHERE email = l.email)
+           ORDER BY COALESCE(l.created_at, '') DESC, l.id DESC LIMIT 50''',
+        ()
+    ),
+    'booked_slots': (
+        '''SELECT appointment_time FROM appointments
+           WHERE appointment_date = ? AND COALESCE(status, '') != 'cancelled' ''',
+        ('2025-08-21',)
+    ),
+    'reminder_page': (
+        '''SELECT id, name, email, appointment_date, appointment_time, timezone FROM appointments
+           WHERE appointment_date = ? AND (reminder_sent = 0 OR reminder_claimed_until < ?)
+             AND COALESCE(status, '') != 'cancelled' AND id > ?
+           ORDER BY id LIMIT ?''',
+        ('2025-08-21', 1755734400.0, 0, 200)
+    ),
+    'reminder_schedule': (
+        '''SELECT id, appointment_date, appointment_time, timezone FROM appointments
+           WHERE reminder_sent = 0 AND appointment_date >= ?''',
+        ('2025-08-21',)
+    ),
+}
+
+# Полный проход по таблице или сортировка во временном B-дереве
+_BAD_PLAN = re.compile(r'^SCAN (leads|appointments|l|a)$|USE TEMP B-TREE')
+
+
+def applied_versions(conn: sqlite3.Connection) -> List[int]:
+    """Версии уже примененных миграций"""
+    return [row[0] for row in conn.execute('SELECT version FROM schema_migrations ORDER BY version')]
+
+
+def migrate(database: Database = None) -> List[int]:
+    """
+    Применение недостающих миграций
+
+    Каждая миграция выполняется в своей транзакции BEGIN IMMEDIATE, версия
+    перепроверяется под блокировкой, поэтому одновременный старт нескольких
+    воркеров применяет миграцию ровно один раз.
+
+    Args:
+        database: Слой соединений (по умолчанию - Config.DATABASE_PATH)
+
+    Returns:
+        Список примененных сейчас версий
+    """
+    database = database or get_database()
+    database.executescript(SCHEMA)
+
+    applied = []
+    for version, name, statements in MIGRATIONS:
+        with database.transaction(immediate=True) as conn:
+            if conn.execute('SELECT 1 FROM schema_migrations WHERE version = ?', (version,)).fetchone():
+                continue
+            for statement in statements:
+                if callable(statement):
+                    statement(conn)
+                else:
+                    conn.execute(statement)
+            conn.execute('INSERT INTO schema_migrations (version, name) VALUES (?, ?)', (version, name))
+        applied.append(version)
+        print(f"Миграция {version:03d} ({name}) применена")
+    return applied
+
+
+def dedupe_leads(database: Database = None) -> int:
+    """
+    Перенос дубликатов лидов в leads_duplicates (ручной шаг перед миграцией 4)
+
+    Из каждой группы лидов с одинаковым email (без учета регистра и пробелов)
+    в leads остается самый ранний.
+
+    Returns:
+        Количество перенесенных лидов
+    """
+    database = database or get_database()
+    with database.transaction(immediate=True) as conn:
+        conn.execute('CREATE TABLE IF NOT EXISTS leads_duplicates AS SELECT * FROM leads WHERE 0')
+        conn.execute(
+            '''INSERT INTO leads_duplicates SELECT * FROM leads
+               WHERE id NOT IN (SELECT MIN(id) FROM leads GROUP BY lower(trim(email)))'''
+        )
+        return conn.execute(
+            '''DELETE FROM leads
+               WHERE id NOT IN (SELECT MIN(id) FROM leads GROUP BY lower(trim(email)))'''
+        ).rowcount
+
+
+def explain(conn: sqlite3.Connection, sql: str, params: Tuple[Any, ...] = ()) -> List[str]:
+    """
+    План выполнения запроса
+
+    Returns:
+        Строки detail из EXPLAIN QUERY PLAN
+    """
+    return [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params)]
+
+
+def check_query_plans(database: Database = None) -> List[Dict[str, Any]]:
+    """
+    Проверка, что горячие запросы используют индексы
+
+    Returns:
+        Список {'query', 'plan', 'ok'} для каждого запроса из HOT_QUERIES
+    """
+    database = database or get_database()
+    conn = database.connection()
+    results = []
+    for name, (sql, params) in HOT_QUERIES.items():
+        plan = explain(conn, sql, params)
+        results.append({
+            'query': name,
+            'plan': plan,
+            'ok': not any(_BAD_PLAN.search(line) for line in plan)
+        })
+    return results
+
+
+def main(argv: List[str]) -> int:
+    database = get_database(Config.DATABASE_PATH)
+    if '--dedupe-leads' in argv:
+        print(f"Перенесено дубликатов лидов в leads_duplicates: {dedupe_leads(database)}")
+    try:
+        migrate(database)
+    except MigrationError as e:
+        print(f"Миграция не применена: {e}")
+        return 1
+    if '--check' not in argv:
+        return 0
+
+    failed = 0
+    for result in check_query_plans(database):
+        status = 'OK  ' if result['ok'] else 'FAIL'
+        print(f"{status} {result['query']}")
+        for line in result['plan']:
+            print(f"       {line}")
+        failed += not result['ok']
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,56 @@
+"""
+Gunicorn configuration for the funnel app
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Pre-forked workers with threads (gthread). Every setting can be overridden
+from the environment.
+"""
+
+import multiprocessing
+import os
+
+# Background threads must not be started in the master before fork:
+# each worker starts its own in post_worker_init, and the calendar sync,
+# outbox and reminder scheduler run only in the worker holding the leader lock
+os.environ.setdefault('BACKGROUND_SERVICES_AUTOSTART', 'false')
+# Rate limit buckets are shared by all workers through funnel.db
+os.environ.setdefault('RATE_LIMIT_BACKEND', 'sqlite')
+
+bind = os.environ.get('GUNICORN_BIND') or '0.0.0.0:8000'
+workers = int(os.environ.get('GUNICORN_WORKERS') or min(multiprocessing.cpu_count() * 2 + 1, 8))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS') or 4)
+timeout = int(os.environ.get('GUNICORN_TIMEOUT') or 60)
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT') or 30)
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE') or 5)
+# Periodic worker restart caps slow memory growth; jitter avoids restarting all workers at once
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS') or 5000)
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER') or 500)
+# Config, migrations, asset index and Google credentials are loaded once in the master
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'True').lower() == 'true'
+
+# Requests are logged by the app (utils/request_log.py)
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG') or None
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL') or 'info'
+proc_name = 'funnel'
+
+
+def when_ready(server):
+    if preload_app:
+        from wsgi import preload_google_client
+        try:
+            preload_google_client()
+        except Exception as e:
+            server.log.warning(f"Google credentials were not preloaded: {e}")
+
+
+def post_worker_init(worker):
+    from wsgi import init_worker
+    init_worker()
+
+
+def worker_exit(server, worker):
+    from wsgi import stop_background_services
+    stop_background_services()
@@ -0,0 +1,51 @@
+"""
+Admin Auth Module
+HTTP Basic авторизация для админ-панели и административных API
+"""
+
+import functools
+import hmac
+from typing import Callable
+
+from flask import jsonify, request
+
+from config import Config
+
+
+def check_credentials(username: str, password: str) -> bool:
+    """
+    Проверка логина и пароля администратора
+
+    Args:
+        username: Логин из запроса
+        password: Пароль из запроса
+
+    Returns:
+        True, если они совпадают с Config.ADMIN_USERNAME и Config.ADMIN_PASSWORD
+    """
+    # compare_digest не выдает по времени ответа, сколько символов совпало
+    username_ok = hmac.compare_digest((username or '').encode('utf-8'), Config.ADMIN_USERNAME.encode('utf-8'))
+    password_ok = hmac.compare_digest((password or '').encode('utf-8'), Config.ADMIN_PASSWORD.encode('utf-8'))
+    return username_ok and password_ok
+
+
+def admin_required(view: Callable) -> Callable:
+    """
+    Декоратор Flask view: доступ только с логином и паролем администратора
+
+    Пока ADMIN_PASSWORD не задан, маршрут отвечает 503, а не открывается всем.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not Config.ADMIN_PASSWORD:
+            return jsonify({'error': 'Admin access is not configured'}), 503
+        auth = request.authorization
+        if not auth or auth.type != 'basic' or not check_credentials(auth.username, auth.password):
+            return (
+                jsonify({'error': 'Authentication required'}),
+                401,
+                {'WWW-Authenticate': 'Basic realm="admin", charset="UTF-8"'}
+            )
+        return view(*args, **kwargs)
+
+    return wrapper
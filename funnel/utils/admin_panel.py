@@ -0,0 +1,261 @@
+"""
+Admin Panel Module
+Потоковый рендеринг админ-панели из заранее скомпилированного шаблона
+"""
+
+from typing import Any, Callable, Dict, Iterable, Iterator
+from urllib.parse import urlencode
+
+from jinja2 import Environment
+
+from utils.lead_query import STATUS_NONE
+
+
+ADMIN_TEMPLATE = '''<!DOCTYPE html>
+<html>
+<head>
+    <title>Funnel Admin</title>
+    <style>
+        body { font-family: Arial, sans-serif; margin: 20px; background: #f5f5f5; }
+        .container { max-width: 1200px; margin: 0 auto; background: white; padding: 20px; border-radius: 8px; box-shadow: 0 2px 10px rgba(0,0,0,0.1); }
+        table { border-collapse: collapse; width: 100%; margin-top: 20px; }
+        th, td { border: 1px solid #ddd; padding: 12px; text-align: left; }
+        th { background-color: #f8f9fa; font-weight: 600; }
+        th a { color: inherit; text-decoration: none; }
+        .stats { display: grid; grid-template-columns: repeat(auto-fit, minmax(200px, 1fr)); gap: 20px; margin-bottom: 30px; }
+        .stat-card { background: #e8f5e8; padding: 20px; border-radius: 8px; text-align: center; }
+        .stat-number { font-size: 2em; font-weight: bold; color: #2d5a2d; }
+        .stat-label { color: #666; margin-top: 5px; }
+        .nav { margin-bottom: 30px; padding: 15px; background: #f8f9fa; border-radius: 8px; }
+        .nav a { margin-right: 20px; color: #3b82f6; text-decoration: none; padding: 8px 16px; border-radius: 4px; }
+        .nav a:hover { background: #e0e7ff; }
+        h1 { color: #2d5a2d; margin-bottom: 10px; }
+        .subtitle { color: #666; margin-bottom: 30px; }
+        .google-calendar { background: #e3f2fd; padding: 10px; border-radius: 4px; margin: 5px 0; }
+        .email-status { font-size: 12px; color: #666; }
+        .email-sent { color: #4caf50; }
+        .email-not-sent { color: #f44336; }
+        .status-indicator { display: inline-block; width: 12px; height: 12px; border-radius: 50%; margin-right: 8px; }
+        .status-available { background: #4caf50; }
+        .status-unavailable { background: #f44336; }
+        .integration-status { background: #f8f9fa; padding: 15px; border-radius: 8px; margin-bottom: 20px; }
+        .filters { display: flex; flex-wrap: wrap; gap: 10px; align-items: end; }
+        .filters label { display: flex; flex-direction: column; font-size: 12px; color: #666; }
+        .pager { margin-top: 20px; display: flex; gap: 20px; }
+        .pager a { color: #3b82f6; text-decoration: none; }
+    </style>
+</head>
+<body>
+    <div class="container">
+        <h1>🎯 Funnel Admin Panel</h1>
+        <p class="subtitle">Управление воронкой продаж и аналитика</p>
+
+        <div class="nav">
+            <a href="/">🌐 Воронка</a>
+            <a href="/admin/test-api.html">🧪 Тест API</a>
+            <a href="/admin/test-calendar.html">📅 Тест календаря</a>
+            <a href="/api/stats" target="_blank">📊 API Статистика</a>
+            <a href="/api/send-reminders" target="_blank">📧 Отправить напоминания</a>
+        </div>
+<!--flush-->
+{% set stats = load_stats() %}
+        <div class="integration-status">
+            <h3>🔧 Статус интеграций</h3>
+            <p>
+                <span class="status-indicator {{ 'status-available' if stats.google_calendar_available else 'status-unavailable' }}"></span>
+                <strong>Google Calendar:</strong> {{ '✅ Доступен' if stats.google_calendar_available else '❌ Не настроен' }}
+                {% if stats.google_calendar_available %}<br><small>Событий в календаре: {{ stats.google_calendar_appointments }}</small>
+                {% else %}<br><small>Для настройки следуйте инструкциям в admin/google-calendar-setup.md</small>{% endif %}
+            </p>
+            {% if outbox_stats %}
+            <p>
+                <span class="status-indicator {{ 'status-unavailable' if outbox_stats.failed else 'status-available' }}"></span>
+                <strong>Синхронизация с календарем:</strong> в очереди {{ outbox_stats.pending + outbox_stats.in_progress }}, ошибок {{ outbox_stats.failed }}
+                <br><small><a href="/api/calendar-outbox" target="_blank">Подробнее</a></small>
+            </p>
+            {% endif %}
+            <p>
+                <span class="status-indicator status-available"></span>
+                <strong>Email уведомления:</strong> ✅ Настроены
+                <br><small>Подтверждения: {{ 'Включены' if confirmation_enabled else 'Отключены' }}, Напоминания: {{ 'Включены' if reminder_enabled else 'Отключены' }}</small>
+            </p>
+        </div>
+
+        <div class="stats">
+            <div class="stat-card">
+                <div class="stat-number">{{ stats.total_leads }}</div>
+                <div class="stat-label">Всего лидов</div>
+            </div>
+            <div class="stat-card">
+                <div class="stat-number">{{ stats.total_appointments }}</div>
+                <div class="stat-label">Записанных встреч</div>
+            </div>
+            <div class="stat-card">
+                <div class="stat-number">{{ stats.today_leads }}</div>
+                <div class="stat-label">Лидов сегодня</div>
+            </div>
+            <div class="stat-card">
+                <div class="stat-number">{{ stats.google_calendar_appointments }}</div>
+                <div class="stat-label">В Google Calendar</div>
+            </div>
+        </div>
+
+        <h2>📋 Лиды</h2>
+        <form class="filters" method="get" action="/admin">
+            <label>Создан с<input type="date" name="created_from" value="{{ args.created_from }}"></label>
+            <label>по<input type="date" name="created_to" value="{{ args.created_to }}"></label>
+            <label>Статус<input type="text" name="status" value="{{ args.status }}" placeholder="{{ status_none }} - без встречи"></label>
+            <label>Поиск<input type="text" name="q" value="{{ args.q }}" placeholder="Имя или email"></label>
+            <label>На странице<input type="number" name="limit" min="1" max="{{ max_limit }}" value="{{ args.limit }}"></label>
+            <input type="hidden" name="sort" value="{{ sort }}">
+            <input type="hidden" name="direction" value="{{ direction }}">
+            <button type="submit">Применить</button>
+            <a href="/admin">Сбросить</a>
+        </form>
+        <table>
+            <tr>
+{% for field, title in columns %}
+                <th>{% if field %}<a href="{{ sort_url(field) }}">{{ title }}{% if field == sort %} {{ '▼' if direction == 'desc' else '▲' }}{% endif %}</a>{% else %}{{ title }}{% endif %}</th>
+{% endfor %}
+            </tr>
+<!--flush-->
+{% set page = load_page() %}
+{% for lead in page.leads %}
+            <tr>
+                <td>{{ lead.id }}</td>
+                <td>{{ lead.first_name }}</td>
+                <td>{{ lead.email }}</td>
+                <td>{{ lead.phone or '-' }}</td>
+                <td>{{ lead.website or '-' }}</td>
+                <td>{{ lead.revenue or '-' }}</td>
+                <td>{{ lead.appointment_date or '-' }}</td>
+                <td>{{ lead.appointment_time or '-' }}</td>
+                <td>{{ lead.status or '-' }}</td>
+                <td class="google-calendar">{{ '✅' if lead.google_event_id else '❌' }}</td>
+                <td>
+                    <div class="email-status">
+                        <div class="{{ 'email-sent' if lead.confirmation_sent else 'email-not-sent' }}">Подтверждение: {{ '✅' if lead.confirmation_sent else '❌' }}</div>
+                        <div class="{{ 'email-sent' if lead.reminder_sent else 'email-not-sent' }}">Напоминание: {{ '✅' if lead.reminder_sent else '❌' }}</div>
+                    </div>
+                </td>
+                <td>{{ lead.created_at }}</td>
+            </tr>
+{% else %}
+            <tr><td colspan="{{ columns|length }}">Лиды не найдены</td></tr>
+{% endfor %}
+        </table>
+        <div class="pager">
+            {% if args.cursor %}<a href="{{ page_url(None) }}">⏮ В начало</a>{% endif %}
+            {% if page.next_cursor %}<a href="{{ page_url(page.next_cursor) }}">Следующая страница ▶</a>{% endif %}
+        </div>
+    </div>
+</body>
+</html>
+'''
+
+# Колонки таблицы: (поле сортировки или None, заголовок)
+COLUMNS = [
+    ('id', 'ID'),
+    ('first_name', 'Имя'),
+    ('email', 'Email'),
+    (None, 'Телефон'),
+    (None, 'Сайт'),
+    (None, 'Доход'),
+    ('appointment_date', 'Дата встречи'),
+    (None, 'Время встречи'),
+    ('status', 'Статус'),
+    (None, 'Google Calendar'),
+    (None, 'Email статус'),
+    ('created_at', 'Создан')
+]
+
+# Шаблон компилируется один раз при импорте модуля
+_environment = Environment(autoescape=True, trim_blocks=True, lstrip_blocks=True)
+_template = _environment.from_string(ADMIN_TEMPLATE)
+
+FILTER_ARGS = ('created_from', 'created_to', 'status', 'q', 'limit')
+
+# Метка в шаблоне перед медленным запросом к базе: накопленный блок отправляется сразу
+FLUSH_MARKER = '<!--flush-->\n'
+
+
+def _buffered(chunks: Iterable[str], size: int) -> Iterator[str]:
+    """Склейка мелких фрагментов шаблона в блоки около size символов с отправкой по FLUSH_MARKER"""
+    buffer = []
+    length = 0
+    for chunk in chunks:
+        if FLUSH_MARKER in chunk:
+            head, _, chunk = chunk.rpartition(FLUSH_MARKER)
+            buffer.append(head.replace(FLUSH_MARKER, ''))
+            yield ''.join(buffer)
+            buffer = []
+            length = 0
+        buffer.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            yield ''.join(buffer)
+            buffer = []
+            length = 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+def render_admin_panel(args: Dict[str, str], sort: str, direction: str,
+                       load_stats: Callable[[], Dict[str, Any]],
+                       load_page: Callable[[], Dict[str, Any]],
+                       outbox_stats: Dict[str, Any] = None,
+                       confirmation_enabled: bool = True,
+                       reminder_enabled: bool = True,
+                       max_limit: int = 500,
+                       chunk_size: int = 16384) -> Iterator[str]:
+    """
+    Потоковый рендеринг админ-панели
+
+    Статистика и страница лидов загружаются внутри шаблона. Перед каждой
+    загрузкой накопленный HTML отправляется клиенту (FLUSH_MARKER), поэтому
+    начало страницы уходит до выполнения запросов к базе.
+
+    Args:
+        args: Параметры запроса (фильтры, limit, cursor)
+        sort: Поле сортировки
+        direction: asc или desc
+        load_stats: Функция загрузки статистики
+        load_page: Функция загрузки страницы лидов (LeadQuery.page)
+        outbox_stats: Состояние outbox Google Calendar
+        confirmation_enabled: Включены ли письма-подтверждения
+        reminder_enabled: Включены ли напоминания
+        max_limit: Максимальный размер страницы
+        chunk_size: Размер отправляемого блока в символах
+
+    Returns:
+        Итератор HTML фрагментов
+    """
+    base = {name: args[name] for name in FILTER_ARGS if args.get(name)}
+
+    def url(**overrides) -> str:
+        params = dict(base, sort=sort, direction=direction)
+        params.update({name: value for name, value in overrides.items() if value is not None})
+        return '/admin?' + urlencode(params)
+
+    def sort_url(field: str) -> str:
+        # Повторный клик по текущей колонке меняет направление
+        if field == sort:
+            return url(sort=field, direction='asc' if direction == 'desc' else 'desc')
+        return url(sort=field, direction='desc')
+
+    context = {
+        'args': dict(base, cursor=args.get('cursor')),
+        'sort': sort,
+        'direction': direction,
+        'columns': COLUMNS,
+        'status_none': STATUS_NONE,
+        'max_limit': max_limit,
+        'load_stats': load_stats,
+        'load_page': load_page,
+        'outbox_stats': outbox_stats,
+        'confirmation_enabled': confirmation_enabled,
+        'reminder_enabled': reminder_enabled,
+        'sort_url': sort_url,
+        'page_url': lambda cursor: url(cursor=cursor)
+    }
+    return _buffered(_template.generate(**context), chunk_size)
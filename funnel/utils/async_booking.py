@@ -0,0 +1,146 @@
+"""
+Async Booking Module
+Запись встреч: общий для Flask (app.py) и asyncio-обработчиков (asgi.py) путь сохранения и письмо-подтверждение
+"""
+
+import asyncio
+from typing import Any, Callable, ContextManager, Dict, Optional
+
+from config import Config
+from database.connection import get_database
+from utils.email_messages import build_confirmation_email
+from utils.mail_queue import MailQueue, MailQueueFull
+
+
+class AsyncBooking:
+    """Сохранение встречи и постановка подтверждения в очередь писем
+
+    Встреча сохраняется функцией save - той же, что использует Flask
+    обработчик (CalendarOutbox или db_manager.save_appointment), поэтому
+    событие в календаре и все записи в базе не зависят от того, через какой
+    сервер пришел запрос. Подтверждение доставляет MailQueue (с арендой и
+    повторами): письмо ставится в очередь отложенным (held) и отпускается
+    только после успешного сохранения; при ошибке сохранения оно удаляется.
+    Встреча атомарно помечается confirmation_sent = 1 перед release(), так
+    что повтор не поставит письмо второй раз. Корутина save_appointment()
+    выполняет сохранение и постановку письма одновременно в пуле потоков.
+    """
+
+    def __init__(self, save: Callable[[Dict[str, Any]], Dict[str, Any]], mail_queue: MailQueue,
+                 db_path: str = None):
+        """
+        Инициализация
+
+        Args:
+            save: Сохранение встречи (результат в формате db_manager.save_appointment)
+            mail_queue: Очередь доставки писем
+            db_path: Путь к funnel.db
+        """
+        self.save = save
+        self.mail_queue = mail_queue
+        self.database = get_database(db_path or Config.DATABASE_PATH)
+
+    def connect(self) -> ContextManager:
+        """Транзакция на соединении потока с funnel.db"""
+        return self.database.transaction()
+
+    def queue_confirmation(self, data: Dict[str, Any]) -> Optional[str]:
+        """
+        Постановка подтверждения в очередь без отправки (held)
+
+        Args:
+            data: Очищенные данные встречи
+
+        Returns:
+            ID письма или None, если подтверждения выключены или очередь заполнена
+        """
+        if not Config.CONFIRMATION_EMAIL_ENABLED:
+            return None
+        message = build_confirmation_email(
+            data['email'], data['name'], data['appointment_date'], data['appointment_time'], data['timezone']
+        )
+        try:
+            return self.mail_queue.enqueue(message, held=True)
+        except MailQueueFull:
+            print(f"Подтверждение для {data['email']} не поставлено: очередь писем заполнена")
+            return None
+
+    def confirm(self, appointment_id: int, message_id: Optional[str]) -> bool:
+        """
+        Отметка confirmation_sent и разрешение отправки подтверждения
+
+        Args:
+            appointment_id: ID сохраненной встречи
+            message_id: Результат queue_confirmation()
+
+        Returns:
+            True, если подтверждение передано в очередь этим вызовом
+        """
+        if message_id is None:
+            return False
+        with self.connect() as conn:
+            claimed = conn.execute(
+                'UPDATE appointments SET confirmation_sent = 1 WHERE id = ? AND confirmation_sent = 0',
+                (appointment_id,)
+            ).rowcount
+        if not claimed:
+            self.mail_queue.discard(message_id)
+            return False
+        try:
+            return self.mail_queue.release(message_id)
+        except Exception as e:
+            print(f"Ошибка постановки подтверждения для встречи {appointment_id}: {e}")
+            with self.connect() as conn:
+                conn.execute('UPDATE appointments SET confirmation_sent = 0 WHERE id = ?', (appointment_id,))
+            return False
+
+    def save_appointment_sync(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Сохранение встречи и постановка подтверждения (блокирующий вызов)
+
+        Args:
+            data: Очищенные данные встречи
+
+        Returns:
+            Словарь с результатом save (плюс confirmation_sent и confirmation_message_id)
+        """
+        result = self.save(data)
+        message_id = self.queue_confirmation(data) if result['success'] else None
+        return self._finish(result, message_id)
+
+    async def save_appointment(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Сохранение встречи и постановка подтверждения без блокировки event loop
+
+        Сохранение (с вызовом Google Calendar без outbox) и постановка письма
+        выполняются одновременно; письмо отпускается после успешного сохранения.
+
+        Args:
+            data: Очищенные данные встречи
+
+        Returns:
+            Словарь с результатом save (плюс confirmation_sent и confirmation_message_id)
+        """
+        result, message_id = await asyncio.gather(
+            asyncio.to_thread(self.save, data),
+            asyncio.to_thread(self.queue_confirmation, data),
+            return_exceptions=True
+        )
+        if isinstance(message_id, BaseException):
+            print(f"Ошибка постановки подтверждения для {data['email']}: {message_id}")
+            message_id = None
+        if isinstance(result, BaseException):
+            if message_id is not None:
+                await asyncio.to_thread(self.mail_queue.discard, message_id)
+            raise result
+        return await asyncio.to_thread(self._finish, result, message_id)
+
+    def _finish(self, result: Dict[str, Any], message_id: Optional[str]) -> Dict[str, Any]:
+        if not result['success']:
+            if message_id is not None:
+                self.mail_queue.discard(message_id)
+            result['confirmation_sent'] = False
+            return result
+        result['confirmation_sent'] = self.confirm(result['appointment_id'], message_id)
+        result['confirmation_message_id'] = message_id if result['confirmation_sent'] else None
+        return result
@@ -0,0 +1,435 @@
+"""
+Calendar Outbox Module
+Асинхронная запись встреч в Google Calendar через outbox-таблицу в funnel.db
+"""
+
+import base64
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Callable, ContextManager, Dict, List, Optional
+
+from config import Config
+from database.connection import get_database
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS calendar_outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    appointment_id INTEGER NOT NULL,
+    operation TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    idempotency_key TEXT NOT NULL UNIQUE,
+    google_event_id TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL DEFAULT 0,
+    locked_until REAL,
+    last_error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_calendar_outbox_status
+    ON calendar_outbox (status, next_attempt_at);
+CREATE INDEX IF NOT EXISTS idx_calendar_outbox_appointment
+    ON calendar_outbox (appointment_id, id);
+'''
+
+APPOINTMENT_FIELDS = [
+    'name', 'email', 'phone', 'website', 'revenue',
+    'appointment_date', 'appointment_time', 'timezone'
+]
+
+
+def google_event_id_for(idempotency_key: str) -> str:
+    """
+    Детерминированный ID события Google Calendar для ключа идемпотентности
+
+    Google допускает в ID события только символы base32hex (a-v, 0-9). Повторная
+    вставка с тем же ID возвращает 409, поэтому ретрай не создает дубликат.
+    """
+    digest = hashlib.sha256(idempotency_key.encode('utf-8')).digest()
+    return base64.b32hexencode(digest).decode('ascii').lower().rstrip('=')
+
+
+def build_event_body(data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Тело события Google Calendar для встречи
+
+    Args:
+        data: Очищенные данные встречи (как в /api/save-appointment)
+
+    Returns:
+        Словарь события для events().insert / events().patch
+    """
+    start = datetime.strptime(f"{data['appointment_date']} {data['appointment_time']}", '%Y-%m-%d %H:%M')
+    end = start + timedelta(minutes=Config.APPOINTMENT_DURATION_MINUTES)
+    timezone = data.get('timezone') or Config.DEFAULT_TIMEZONE
+    return {
+        'summary': f"Консультация: {data['name']}",
+        'description': (
+            f"Имя: {data['name']}\n"
+            f"Email: {data['email']}\n"
+            f"Телефон: {data['phone']}\n"
+            f"Сайт: {data['website']}\n"
+            f"Доход: {data['revenue']}"
+        ),
+        'start': {'dateTime': start.isoformat(), 'timeZone': timezone},
+        'end': {'dateTime': end.isoformat(), 'timeZone': timezone},
+        'attendees': [{'email': data['email']}]
+    }
+
+
+def enqueue(conn: sqlite3.Connection, appointment_id: int, operation: str,
+            payload: Dict[str, Any], google_event_id: str = None) -> str:
+    """
+    Добавление операции в outbox в транзакции вызывающего кода (без commit)
+
+    Args:
+        conn: Открытое соединение, в котором выполнена запись встречи
+        appointment_id: ID встречи
+        operation: 'create', 'update' или 'delete'
+        payload: Тело события
+        google_event_id: ID события в Google (для update/delete)
+
+    Returns:
+        Ключ идемпотентности операции
+    """
+    idempotency_key = f'{operation}:{appointment_id}:{uuid.uuid4().hex}'
+    if operation == 'create':
+        google_event_id = google_event_id_for(idempotency_key)
+    elif not google_event_id:
+        google_event_id = _known_event_id(conn, appointment_id)
+
+    conn.execute(
+        '''INSERT INTO calendar_outbox
+           (appointment_id, operation, payload, idempotency_key, google_event_id)
+           VALUES (?, ?, ?, ?, ?)''',
+        (appointment_id, operation, json.dumps(payload, ensure_ascii=False), idempotency_key, google_event_id)
+    )
+    return idempotency_key
+
+
+def _known_event_id(conn: sqlite3.Connection, appointment_id: int) -> Optional[str]:
+    """ID события из встречи или из последней операции create, если она еще в очереди"""
+    row = conn.execute(
+        'SELECT google_event_id FROM appointments WHERE id = ?', (appointment_id,)
+    ).fetchone()
+    if row and row[0]:
+        return row[0]
+    row = conn.execute(
+        '''SELECT google_event_id FROM calendar_outbox
+           WHERE appointment_id = ? AND operation = 'create'
+           ORDER BY id DESC LIMIT 1''',
+        (appointment_id,)
+    ).fetchone()
+    return row[0] if row else None
+
+
+class CalendarOutbox:
+    """Outbox для операций с Google Calendar
+
+    Эндпоинты записывают встречу и строку outbox в одной транзакции и сразу
+    отвечают клиенту. Пул воркеров забирает строки, отправляет их в Google с
+    повторами (экспоненциальная пауза) и записывает google_event_id и
+    google_event_link обратно во встречу. Операции одной встречи выполняются
+    строго по порядку.
+    """
+
+    def __init__(self, calendar_auth, db_path: str = None, workers: int = None,
+                 on_complete: Callable[[sqlite3.Row], None] = None):
+        """
+        Инициализация outbox
+
+        Args:
+            calendar_auth: GoogleCalendarAuth
+            db_path: Путь к funnel.db
+            workers: Количество потоков-воркеров
+            on_complete: Callback после успешной записи операции в Google
+        """
+        self.calendar_auth = calendar_auth
+        self.on_complete = on_complete
+        self.db_path = db_path or Config.DATABASE_PATH
+        self.workers = workers or Config.CALENDAR_OUTBOX_WORKERS
+        self._wake_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+        self.database = get_database(self.db_path)
+        self.database.executescript(SCHEMA)
+
+    def connect(self, immediate: bool = False) -> ContextManager[sqlite3.Connection]:
+        """Транзакция на соединении потока с funnel.db: commit при успехе, rollback при ошибке"""
+        return self.database.transaction(immediate)
+
+    # ------------------------------------------------------------------
+    # Запись встреч вместе с outbox
+    # ------------------------------------------------------------------
+
+    def save_appointment(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Сохранение встречи и операции create в одной транзакции
+
+        Args:
+            data: Очищенные данные встречи
+
+        Returns:
+            Словарь с результатом и appointment_id
+        """
+        try:
+            with self.connect() as conn:
+                cursor = conn.execute(
+                    f'''INSERT INTO appointments ({', '.join(APPOINTMENT_FIELDS)}, status)
+                        VALUES ({', '.join('?' for _ in APPOINTMENT_FIELDS)}, 'scheduled')''',
+                    [data[field] for field in APPOINTMENT_FIELDS]
+                )
+                appointment_id = cursor.lastrowid
+                enqueue(conn, appointment_id, 'create', build_event_body(data))
+            self._wake_event.set()
+            return {'success': True, 'appointment_id': appointment_id, 'calendar_sync_status': 'pending'}
+        except Exception as e:
+            return {'success': False, 'error': f'Ошибка сохранения встречи: {e}'}
+
+    def update_appointment(self, appointment_id: int, data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Обновление встречи и операции update в одной транзакции
+
+        Args:
+            appointment_id: ID встречи
+            data: Очищенные данные встречи
+
+        Returns:
+            Словарь с результатом
+        """
+        try:
+            with self.connect() as conn:
+                # Перенесенной встрече снова нужно напоминание; в SET видны старые значения строки
+                cursor = conn.execute(
+                    f'''UPDATE appointments SET {', '.join(f'{field} = ?' for field in APPOINTMENT_FIELDS)},
+                            reminder_sent = CASE
+                                WHEN appointment_date IS NOT ? OR appointment_time IS NOT ? THEN 0
+                                ELSE reminder_sent
+                            END
+                        WHERE id = ?''',
+                    [data[field] for field in APPOINTMENT_FIELDS]
+                    + [data['appointment_date'], data['appointment_time'], appointment_id]
+                )
+                if cursor.rowcount == 0:
+                    return {'success': False, 'error': 'Appointment not found'}
+                enqueue(conn, appointment_id, 'update', build_event_body(data))
+            self._wake_event.set()
+            return {'success': True, 'calendar_sync_status': 'pending'}
+        except Exception as e:
+            return {'success': False, 'error': f'Ошибка обновления встречи: {e}'}
+
+    def delete_appointment(self, appointment_id: int) -> Dict[str, Any]:
+        """
+        Удаление встречи и операции delete в одной транзакции
+
+        Args:
+            appointment_id: ID встречи
+
+        Returns:
+            Словарь с результатом
+        """
+        try:
+            with self.connect(immediate=True) as conn:
+                google_event_id = _known_event_id(conn, appointment_id)
+                cursor = conn.execute('DELETE FROM appointments WHERE id = ?', (appointment_id,))
+                if cursor.rowcount == 0:
+                    return {'success': False, 'error': 'Appointment not found'}
+                enqueue(conn, appointment_id, 'delete', {}, google_event_id=google_event_id)
+            self._wake_event.set()
+            return {'success': True, 'calendar_sync_status': 'pending'}
+        except Exception as e:
+            return {'success': False, 'error': f'Ошибка удаления встречи: {e}'}
+
+    # ------------------------------------------------------------------
+    # Воркеры
+    # ------------------------------------------------------------------
+
+    def start(self) -> None:
+        """Запуск пула воркеров"""
+        if any(thread.is_alive() for thread in self._threads):
+            return
+        self._stop_event.clear()
+        self._threads = [
+            threading.Thread(target=self._run, name=f'calendar-outbox-{index}', daemon=True)
+            for index in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout: float = 5) -> None:
+        """Остановка пула воркеров"""
+        self._stop_event.set()
+        self._wake_event.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _run(self) -> None:
+        while not self._stop_event.is_set():
+            try:
+                row = self._claim()
+            except sqlite3.Error as e:
+                print(f"Ошибка чтения calendar outbox: {e}")
+                row = None
+
+            if row is None:
+                self._wake_event.wait(Config.CALENDAR_OUTBOX_POLL_SECONDS)
+                self._wake_event.clear()
+                continue
+
+            self.process(row)
+
+    def _claim(self) -> Optional[sqlite3.Row]:
+        """Атомарный захват следующей готовой операции"""
+        now = time.time()
+        with self.connect(immediate=True) as conn:
+            row = conn.execute(
+                '''SELECT * FROM calendar_outbox AS o
+                   WHERE ((o.status = 'pending' AND o.next_attempt_at <= ?)
+                          OR (o.status = 'in_progress' AND o.locked_until < ?))
+                     AND NOT EXISTS (
+                         SELECT 1 FROM calendar_outbox AS prev
+                         WHERE prev.appointment_id = o.appointment_id
+                           AND prev.id < o.id
+                           AND prev.status IN ('pending', 'in_progress')
+                     )
+                   ORDER BY o.id LIMIT 1''',
+                (now, now)
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    '''UPDATE calendar_outbox
+                       SET status = 'in_progress', locked_until = ?, attempts = attempts + 1,
+                           updated_at = CURRENT_TIMESTAMP
+                       WHERE id = ?''',
+                    (now + Config.CALENDAR_OUTBOX_LEASE_SECONDS, row['id'])
+                )
+            return row
+
+    def process(self, row: sqlite3.Row) -> Dict[str, Any]:
+        """
+        Выполнение одной операции outbox
+
+        Args:
+            row: Строка calendar_outbox
+
+        Returns:
+            Результат вызова Google Calendar
+        """
+        operation = row['operation']
+        event_id = row['google_event_id']
+        payload = json.loads(row['payload'])
+
+        if operation == 'delete' and not event_id:
+            result = {'success': True, 'message': 'Событие не создавалось'}
+        elif operation == 'delete':
+            result = self.calendar_auth.delete_event(event_id)
+            if result.get('status_code') in (404, 410):
+                result = {'success': True, 'message': 'Событие уже удалено'}
+        elif operation == 'update' and event_id:
+            result = self.calendar_auth.update_event(event_id, payload)
+        else:
+            # create, либо update встречи, событие которой так и не было создано
+            event_id = event_id or google_event_id_for(row['idempotency_key'])
+            result = self.calendar_auth.create_event(dict(payload, id=event_id))
+            if result.get('status_code') == 409:
+                # Событие уже создано предыдущей попыткой
+                result = self.calendar_auth.get_event(event_id)
+
+        if result['success']:
+            self._complete(row, event_id, result.get('event_link'))
+            if self.on_complete:
+                self.on_complete(row)
+        else:
+            self._fail(row, result)
+        return result
+
+    def _complete(self, row: sqlite3.Row, event_id: str, event_link: str) -> None:
+        with self.connect() as conn:
+            conn.execute(
+                '''UPDATE calendar_outbox
+                   SET status = 'done', google_event_id = ?, last_error = NULL, locked_until = NULL,
+                       updated_at = CURRENT_TIMESTAMP
+                   WHERE id = ?''',
+                (event_id, row['id'])
+            )
+            if row['operation'] != 'delete':
+                conn.execute(
+                    '''UPDATE appointments
+                       SET google_event_id = ?, google_event_link = COALESCE(?, google_event_link)
+                       WHERE id = ?''',
+                    (event_id, event_link, row['appointment_id'])
+                )
+
+    def _fail(self, row: sqlite3.Row, result: Dict[str, Any]) -> None:
+        attempts = row['attempts'] + 1
+        # GoogleCalendarAuth решает по is_retryable_error(): 403 без причины rate limit не повторяется
+        retryable = result.get('retryable', True)
+        if retryable and attempts < Config.CALENDAR_OUTBOX_MAX_ATTEMPTS:
+            status = 'pending'
+            delay = Config.CALENDAR_OUTBOX_RETRY_BASE_SECONDS * (2 ** (attempts - 1))
+        else:
+            status = 'failed'
+            delay = 0
+
+        with self.connect() as conn:
+            conn.execute(
+                '''UPDATE calendar_outbox
+                   SET status = ?, next_attempt_at = ?, last_error = ?, locked_until = NULL,
+                       updated_at = CURRENT_TIMESTAMP
+                   WHERE id = ?''',
+                (status, time.time() + delay, result.get('message'), row['id'])
+            )
+        print(f"Calendar outbox #{row['id']} ({row['operation']}): {result.get('message')}")
+
+    # ------------------------------------------------------------------
+    # Состояние для админки
+    # ------------------------------------------------------------------
+
+    def retry_failed(self) -> int:
+        """Повторная постановка в очередь всех операций со статусом failed"""
+        with self.connect() as conn:
+            cursor = conn.execute(
+                '''UPDATE calendar_outbox
+                   SET status = 'pending', attempts = 0, next_attempt_at = 0, updated_at = CURRENT_TIMESTAMP
+                   WHERE status = 'failed' '''
+            )
+        self._wake_event.set()
+        return cursor.rowcount
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Состояние очереди синхронизации
+
+        Returns:
+            Количество операций по статусам и последние проблемные операции
+        """
+        with self.connect() as conn:
+            counts = {
+                row['status']: row['count']
+                for row in conn.execute(
+                    'SELECT status, COUNT(*) AS count FROM calendar_outbox GROUP BY status'
+                )
+            }
+            problems = [
+                dict(row) for row in conn.execute(
+                    '''SELECT id, appointment_id, operation, status, attempts, last_error, updated_at
+                       FROM calendar_outbox
+                       WHERE status = 'failed' OR (status = 'pending' AND attempts > 0)
+                       ORDER BY id DESC LIMIT 50'''
+                )
+            ]
+        return {
+            'pending': counts.get('pending', 0),
+            'in_progress': counts.get('in_progress', 0),
+            'done': counts.get('done', 0),
+            'failed': counts.get('failed', 0),
+            'problems': problems
+        }
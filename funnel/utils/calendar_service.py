@@ -0,0 +1,107 @@
+"""
+Calendar Service Module
+Общая фабрика клиентов Google Calendar API с keep-alive транспортом
+"""
+
+import threading
+import time
+from typing import Any, Dict
+
+import httplib2
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.discovery import build
+
+from config import Config
+from utils.metrics import metrics
+
+
+class TimedHttp(httplib2.Http):
+    """httplib2.Http, который записывает длительность каждого запроса к Google API"""
+
+    def request(self, uri, method='GET', *args, **kwargs):
+        started = time.perf_counter()
+        outcome = 'error'
+        try:
+            response, content = super().request(uri, method, *args, **kwargs)
+            outcome = f'{response.status // 100}xx'
+            return response, content
+        finally:
+            operation = 'batch' if '/batch' in uri else method
+            metrics.observe_outbound('google_calendar', operation, outcome, time.perf_counter() - started)
+
+
+class CalendarServiceFactory:
+    """Потокобезопасная фабрика Google Calendar service
+
+    build() выполняется один раз на поток: используется встроенный в
+    google-api-python-client discovery-документ (static_discovery), а
+    httplib2.Http держит keep-alive соединение с API между вызовами.
+    httplib2.Http не потокобезопасен, поэтому у каждого потока свой клиент.
+    """
+
+    def __init__(self, timeout: int = None):
+        """
+        Инициализация фабрики
+
+        Args:
+            timeout: Таймаут HTTP запросов к Google API в секундах
+        """
+        self.timeout = timeout or Config.GOOGLE_HTTP_TIMEOUT_SECONDS
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.builds = 0
+        self.reuses = 0
+
+    def get(self, credentials) -> Any:
+        """
+        Получение Calendar service для текущего потока
+
+        Args:
+            credentials: google.oauth2 Credentials
+
+        Returns:
+            Google Calendar service объект
+        """
+        local = self._local
+        if (getattr(local, 'service', None) is not None
+                and local.credentials is credentials
+                and local.generation == self._generation):
+            with self._lock:
+                self.reuses += 1
+            return local.service
+
+        client_options = None
+        if Config.GOOGLE_CALENDAR_API_ENDPOINT:
+            client_options = {'api_endpoint': Config.GOOGLE_CALENDAR_API_ENDPOINT}
+
+        http = AuthorizedHttp(credentials, http=TimedHttp(timeout=self.timeout))
+        service = build(
+            'calendar', 'v3',
+            http=http,
+            static_discovery=True,
+            cache_discovery=False,
+            client_options=client_options
+        )
+
+        local.service = service
+        local.credentials = credentials
+        local.generation = self._generation
+        with self._lock:
+            self.builds += 1
+        print(f"Google Calendar service создан для потока {threading.current_thread().name}")
+        return service
+
+    def reset(self) -> None:
+        """Сброс клиентов всех потоков (смена credentials, fork процесса)"""
+        with self._lock:
+            self._generation += 1
+
+    def stats(self) -> Dict[str, int]:
+        """Счетчики создания и повторного использования клиентов"""
+        with self._lock:
+            return {'builds': self.builds, 'reuses': self.reuses, 'generation': self._generation}
+
+
+# Общая фабрика процесса
+service_factory = CalendarServiceFactory()
@@ -0,0 +1,445 @@
+"""
+Calendar Sync Module
+Локальное SQLite-зеркало Google Calendar с инкрементальной синхронизацией по syncToken
+"""
+
+import sqlite3
+import threading
+import time
+from datetime import date as date_cls, datetime, timedelta, timezone
+from typing import Any, Callable, ContextManager, Dict, Iterable, List, Optional, Set
+from zoneinfo import ZoneInfo
+
+from googleapiclient.errors import HttpError
+
+from config import Config
+from database.connection import get_database
+from utils.slot_engine import Interval, day_bounds, event_to_interval, free_slots, interval_dates, merge_intervals
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS calendar_events (
+    calendar_id TEXT NOT NULL,
+    event_id TEXT NOT NULL,
+    start_utc TEXT NOT NULL,
+    end_utc TEXT NOT NULL,
+    summary TEXT,
+    updated TEXT,
+    PRIMARY KEY (calendar_id, event_id)
+);
+CREATE INDEX IF NOT EXISTS idx_calendar_events_range
+    ON calendar_events (calendar_id, start_utc, end_utc);
+CREATE TABLE IF NOT EXISTS calendar_sync_state (
+    calendar_id TEXT PRIMARY KEY,
+    sync_token TEXT,
+    last_full_sync TEXT,
+    last_sync TEXT,
+    last_error TEXT
+);
+CREATE TABLE IF NOT EXISTS calendar_sync_requests (
+    calendar_id TEXT PRIMARY KEY,
+    requested_at REAL NOT NULL
+);
+'''
+
+
+def _to_utc(value: datetime) -> str:
+    """Нормализация datetime в строку UTC, сравнимую лексикографически"""
+    return value.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S+00:00')
+
+
+def _utc_now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class CalendarMirror:
+    """Зеркало событий Google Calendar в локальной SQLite базе
+
+    Первая синхронизация загружает события начиная с
+    Config.CALENDAR_SYNC_LOOKBACK_DAYS дней назад, последующие запрашивают
+    только изменения по nextSyncToken. Если Google отвечает 410 Gone, токен
+    сбрасывается и выполняется полная синхронизация.
+
+    Фоновый поток работает в одном процессе (лидере). Другие процессы
+    просят внеочередную синхронизацию через таблицу calendar_sync_requests.
+    """
+
+    def __init__(self,
+                 service_provider: Callable[[], Any],
+                 db_path: str = None,
+                 calendar_id: str = None,
+                 interval_seconds: int = None,
+                 on_change: Callable[[Set[str]], None] = None):
+        """
+        Инициализация зеркала
+
+        Args:
+            service_provider: Функция, возвращающая Google Calendar service
+                (например GoogleCalendarAuth.get_service)
+            db_path: Путь к SQLite базе зеркала
+            calendar_id: ID календаря
+            interval_seconds: Интервал фоновой синхронизации
+            on_change: Callback, получающий множество затронутых дат YYYY-MM-DD
+        """
+        self.service_provider = service_provider
+        self.db_path = db_path or Config.CALENDAR_MIRROR_PATH
+        self.calendar_id = calendar_id or Config.GOOGLE_CALENDAR_ID
+        self.interval_seconds = interval_seconds or Config.CALENDAR_SYNC_INTERVAL_SECONDS
+        self.on_change = on_change
+        self.tz = ZoneInfo(Config.DEFAULT_TIMEZONE)
+
+        self._sync_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._wake_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        # Даты из синхронизации, которая упала после применения части страниц
+        self._pending_dates: Set[str] = set()
+
+        self.database = get_database(self.db_path)
+        self.database.executescript(SCHEMA)
+
+    def _connect(self, immediate: bool = False) -> ContextManager[sqlite3.Connection]:
+        """Транзакция на соединении потока с базой зеркала: commit при успехе, rollback при ошибке"""
+        return self.database.transaction(immediate)
+
+    # ------------------------------------------------------------------
+    # Синхронизация
+    # ------------------------------------------------------------------
+
+    def sync(self) -> Dict[str, Any]:
+        """
+        Синхронизация зеркала с Google Calendar
+
+        Returns:
+            Словарь с результатами синхронизации
+        """
+        result = {
+            'success': False,
+            'message': '',
+            'full_sync': False,
+            'changed_events': 0
+        }
+
+        with self._sync_lock:
+            try:
+                service = self.service_provider()
+                if not service:
+                    result['message'] = 'Не удалось создать service'
+                    return result
+
+                sync_token = self._get_state().get('sync_token')
+                # Примененные до ошибки страницы уже в зеркале: их даты накапливаются до успешного прогона
+                changed_dates = self._pending_dates
+                if sync_token:
+                    try:
+                        result['changed_events'] = self._fetch(service, changed_dates, sync_token=sync_token)
+                    except HttpError as e:
+                        if e.resp.status != 410:
+                            raise
+                        # Токен устарел - Google требует полную синхронизацию
+                        print("syncToken устарел (410), выполняется полная синхронизация")
+                        sync_token = None
+
+                if not sync_token:
+                    result['full_sync'] = True
+                    result['changed_events'] = self._full_sync(service, changed_dates)
+
+                self._update_state(last_error=None)
+                result['success'] = True
+                result['message'] = f"Синхронизировано событий: {result['changed_events']}"
+
+                self._pending_dates = set()
+                if changed_dates and self.on_change:
+                    self.on_change(changed_dates)
+
+            except Exception as e:
+                result['message'] = f'Ошибка синхронизации календаря: {e}'
+                self._update_state(last_error=str(e))
+
+        return result
+
+    def _full_sync(self, service, changed_dates: Set[str]) -> int:
+        with self._connect(immediate=True) as conn:
+            changed_dates.update(self._dates_of_rows(conn.execute(
+                'SELECT start_utc, end_utc FROM calendar_events WHERE calendar_id = ?',
+                (self.calendar_id,)
+            )))
+            conn.execute('DELETE FROM calendar_events WHERE calendar_id = ?', (self.calendar_id,))
+            conn.execute(
+                'UPDATE calendar_sync_state SET sync_token = NULL WHERE calendar_id = ?',
+                (self.calendar_id,)
+            )
+        # Прошедшие события не влияют на свободные слоты: историю календаря не загружаем
+        time_min = _utc_now() - timedelta(days=Config.CALENDAR_SYNC_LOOKBACK_DAYS)
+        count = self._fetch(service, changed_dates, time_min=time_min)
+        self._update_state(last_full_sync=_to_utc(_utc_now()))
+        return count
+
+    def _fetch(self, service, changed_dates: Set[str], sync_token: str = None,
+               time_min: datetime = None) -> int:
+        """Загрузка всех страниц events().list и применение их к зеркалу"""
+        count = 0
+        page_token = None
+        while True:
+            params = {
+                'calendarId': self.calendar_id,
+                'singleEvents': True,
+                'maxResults': 2500,
+                'pageToken': page_token
+            }
+            if sync_token:
+                params['syncToken'] = sync_token
+            elif time_min:
+                # timeMin допустим только в полной синхронизации, не вместе с syncToken
+                params['timeMin'] = time_min.isoformat()
+            response = service.events().list(**params).execute()
+
+            items = response.get('items', [])
+            count += len(items)
+            self._apply(items, changed_dates)
+
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                self._update_state(sync_token=response.get('nextSyncToken'), last_sync=_to_utc(_utc_now()))
+                return count
+
+    def _apply(self, items: Iterable[Dict[str, Any]], changed_dates: Set[str]) -> None:
+        """Применение страницы событий в одной транзакции"""
+        with self._connect(immediate=True) as conn:
+            for event in items:
+                event_id = event.get('id')
+                if not event_id:
+                    continue
+
+                # Старые даты события тоже затронуты (перенос или удаление)
+                changed_dates.update(self._dates_of_rows(conn.execute(
+                    'SELECT start_utc, end_utc FROM calendar_events WHERE calendar_id = ? AND event_id = ?',
+                    (self.calendar_id, event_id)
+                )))
+
+                interval = event_to_interval(event, self.tz)
+                if interval is None:
+                    conn.execute(
+                        'DELETE FROM calendar_events WHERE calendar_id = ? AND event_id = ?',
+                        (self.calendar_id, event_id)
+                    )
+                    continue
+
+                conn.execute(
+                    '''INSERT OR REPLACE INTO calendar_events
+                       (calendar_id, event_id, start_utc, end_utc, summary, updated)
+                       VALUES (?, ?, ?, ?, ?, ?)''',
+                    (self.calendar_id, event_id, _to_utc(interval[0]), _to_utc(interval[1]),
+                     event.get('summary'), event.get('updated'))
+                )
+                changed_dates.update(self._dates_of_interval(*interval))
+
+    def _dates_of_interval(self, start: datetime, end: datetime) -> Set[str]:
+        return interval_dates(start, end, self.tz)
+
+    def _dates_of_rows(self, rows: Iterable[sqlite3.Row]) -> Set[str]:
+        dates = set()
+        for row in rows:
+            dates.update(self._dates_of_interval(
+                datetime.fromisoformat(row['start_utc']),
+                datetime.fromisoformat(row['end_utc'])
+            ))
+        return dates
+
+    def _get_state(self) -> Dict[str, Any]:
+        with self._connect() as conn:
+            row = conn.execute(
+                'SELECT * FROM calendar_sync_state WHERE calendar_id = ?',
+                (self.calendar_id,)
+            ).fetchone()
+        return dict(row) if row else {}
+
+    def _update_state(self, **fields) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR IGNORE INTO calendar_sync_state (calendar_id) VALUES (?)',
+                (self.calendar_id,)
+            )
+            for column, value in fields.items():
+                conn.execute(
+                    f'UPDATE calendar_sync_state SET {column} = ? WHERE calendar_id = ?',
+                    (value, self.calendar_id)
+                )
+
+    # ------------------------------------------------------------------
+    # Фоновый поток
+    # ------------------------------------------------------------------
+
+    def start(self) -> None:
+        """Запуск фоновой синхронизации"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='calendar-sync', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5) -> None:
+        """Остановка фоновой синхронизации"""
+        self._stop_event.set()
+        self._wake_event.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def request_sync(self) -> None:
+        """Внеочередная синхронизация (например, после записи события в календарь)"""
+        if self._thread and self._thread.is_alive():
+            self._wake_event.set()
+            return
+        # Поток синхронизации работает в другом процессе
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    'INSERT OR REPLACE INTO calendar_sync_requests (calendar_id, requested_at) VALUES (?, ?)',
+                    (self.calendar_id, time.time())
+                )
+        except Exception as e:
+            print(f"Не удалось запросить синхронизацию календаря: {e}")
+
+    def _sync_requested_since(self, since: float) -> bool:
+        with self._connect() as conn:
+            row = conn.execute(
+                'SELECT requested_at FROM calendar_sync_requests WHERE calendar_id = ?', (self.calendar_id,)
+            ).fetchone()
+        return bool(row) and row[0] >= since
+
+    def _run(self) -> None:
+        while not self._stop_event.is_set():
+            self._wake_event.clear()
+            started = time.time()
+            result = self.sync()
+            if not result['success']:
+                print(result['message'])
+            deadline = time.monotonic() + self.interval_seconds
+            while not self._stop_event.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                if self._wake_event.wait(min(remaining, Config.CALENDAR_SYNC_REQUEST_POLL_SECONDS)):
+                    break
+                try:
+                    if self._sync_requested_since(started):
+                        break
+                except Exception as e:
+                    print(f"Ошибка проверки запросов синхронизации: {e}")
+
+    # ------------------------------------------------------------------
+    # Чтение
+    # ------------------------------------------------------------------
+
+    def is_ready(self) -> bool:
+        """
+        Готово ли зеркало для чтения
+
+        Returns:
+            True, если полная синхронизация выполнена и данные не устарели
+        """
+        state = self._get_state()
+        if not state.get('sync_token') or not state.get('last_sync'):
+            return False
+        age = _utc_now() - datetime.fromisoformat(state['last_sync'])
+        return age <= timedelta(seconds=self.interval_seconds * Config.CALENDAR_SYNC_STALE_FACTOR)
+
+    def busy_intervals(self, time_min: datetime, time_max: datetime) -> List[Interval]:
+        """
+        Слитые интервалы занятости из зеркала
+
+        Args:
+            time_min: Начало окна (с часовым поясом)
+            time_max: Конец окна (с часовым поясом)
+
+        Returns:
+            Отсортированные непересекающиеся интервалы
+        """
+        with self._connect() as conn:
+            rows = conn.execute(
+                '''SELECT start_utc, end_utc FROM calendar_events
+                   WHERE calendar_id = ? AND start_utc < ? AND end_utc > ?
+                   ORDER BY start_utc''',
+                (self.calendar_id, _to_utc(time_max), _to_utc(time_min))
+            ).fetchall()
+        return merge_intervals(
+            (datetime.fromisoformat(row['start_utc']), datetime.fromisoformat(row['end_utc']))
+            for row in rows
+        )
+
+    def get_available_slots(self, date: str, duration_minutes: int = 60) -> List[str]:
+        """
+        Свободные слоты на дату по данным зеркала
+
+        Args:
+            date: Дата в формате YYYY-MM-DD
+            duration_minutes: Длительность встречи в минутах
+
+        Returns:
+            Список слотов в формате HH:MM
+        """
+        day = date_cls.fromisoformat(date)
+        busy = self.busy_intervals(*day_bounds(day, self.tz))
+        return free_slots(day, busy, self.tz, duration_minutes=duration_minutes)
+
+    def get_available_slots_range(self, date_from: str, date_to: str,
+                                  duration_minutes: int = 60) -> Dict[str, List[str]]:
+        """
+        Свободные слоты для диапазона дат по данным зеркала
+
+        Args:
+            date_from: Первая дата YYYY-MM-DD (включительно)
+            date_to: Последняя дата YYYY-MM-DD (включительно)
+            duration_minutes: Длительность встречи в минутах
+
+        Returns:
+            Словарь {дата: [слоты]}
+        """
+        first_day = date_cls.fromisoformat(date_from)
+        last_day = date_cls.fromisoformat(date_to)
+        busy = self.busy_intervals(day_bounds(first_day, self.tz)[0], day_bounds(last_day, self.tz)[1])
+
+        slots = {}
+        day = first_day
+        while day <= last_day:
+            slots[day.isoformat()] = free_slots(day, busy, self.tz, duration_minutes=duration_minutes)
+            day += timedelta(days=1)
+        return slots
+
+    def dates_of_events(self, event_ids: Iterable[str]) -> Set[str]:
+        """
+        Даты, на которые приходятся события зеркала
+
+        Args:
+            event_ids: ID событий Google Calendar
+
+        Returns:
+            Множество дат YYYY-MM-DD (события, которых нет в зеркале, пропускаются)
+        """
+        dates: Set[str] = set()
+        with self._connect() as conn:
+            for event_id in event_ids:
+                dates.update(self._dates_of_rows(conn.execute(
+                    'SELECT start_utc, end_utc FROM calendar_events WHERE calendar_id = ? AND event_id = ?',
+                    (self.calendar_id, event_id)
+                )))
+        return dates
+
+    def count_upcoming_events(self) -> int:
+        """Количество событий в зеркале, которые еще не закончились"""
+        with self._connect() as conn:
+            row = conn.execute(
+                'SELECT COUNT(*) FROM calendar_events WHERE calendar_id = ? AND end_utc > ?',
+                (self.calendar_id, _to_utc(_utc_now()))
+            ).fetchone()
+        return row[0]
+
+    def status(self) -> Dict[str, Any]:
+        """Состояние синхронизации для диагностики"""
+        state = self._get_state()
+        return {
+            'ready': self.is_ready(),
+            'last_sync': state.get('last_sync'),
+            'last_full_sync': state.get('last_full_sync'),
+            'last_error': state.get('last_error')
+        }
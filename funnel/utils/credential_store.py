@@ -0,0 +1,251 @@
+"""
+Credential Store Module
+Кэш Google credentials в памяти с фоновым обновлением токена
+"""
+
+import os
+import pickle
+import random
+import tempfile
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, Optional
+
+from google.auth.transport.requests import Request
+
+from config import Config
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+@contextmanager
+def file_lock(path: str) -> Iterator[None]:
+    """
+    Межпроцессная эксклюзивная блокировка на lock-файле
+
+    Args:
+        path: Путь к lock-файлу
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'a+b') as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def atomic_pickle_dump(obj, path: str) -> None:
+    """
+    Атомарная запись pickle-файла: временный файл + os.replace
+
+    Args:
+        obj: Объект для сохранения
+        path: Путь к итоговому файлу
+    """
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix='.token-', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as tmp_file:
+            pickle.dump(obj, tmp_file)
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class CredentialStore:
+    """Хранилище credentials одного token-файла
+
+    Credentials читаются с диска один раз и дальше отдаются из памяти.
+    Фоновый таймер обновляет токен за Config.GOOGLE_TOKEN_REFRESH_MARGIN_SECONDS
+    до истечения. Обновление выполняется под межпроцессной блокировкой:
+    если другой воркер уже обновил токен, свежий токен берется с диска.
+    """
+
+    def __init__(self, token_file: str, refresh_margin_seconds: int = None):
+        """
+        Инициализация хранилища
+
+        Args:
+            token_file: Путь к pickle-файлу с токеном
+            refresh_margin_seconds: За сколько секунд до истечения обновлять токен
+        """
+        self.token_file = token_file
+        self.lock_file = token_file + '.lock'
+        self.refresh_margin = timedelta(
+            seconds=refresh_margin_seconds if refresh_margin_seconds is not None
+            else Config.GOOGLE_TOKEN_REFRESH_MARGIN_SECONDS
+        )
+        self.credentials = None
+        self.refresh_count = 0
+        self._lock = threading.RLock()
+        self._timer: Optional[threading.Timer] = None
+
+    def get(self):
+        """
+        Получение credentials из памяти (при первом вызове - с диска)
+
+        Returns:
+            Credentials объект или None
+        """
+        credentials = self.credentials
+        if credentials is not None:
+            return credentials
+
+        with self._lock:
+            if self.credentials is None:
+                self.credentials = self._load()
+                self._schedule_refresh()
+            return self.credentials
+
+    def save(self, credentials) -> None:
+        """
+        Сохранение новых credentials (например, после OAuth flow)
+
+        Args:
+            credentials: Credentials объект
+        """
+        with self._lock:
+            with file_lock(self.lock_file):
+                atomic_pickle_dump(credentials, self.token_file)
+            self.credentials = credentials
+            print(f"Credentials сохранены в {self.token_file}")
+            self._schedule_refresh()
+
+    def refresh(self):
+        """
+        Обновление токена с защитой от одновременного обновления несколькими воркерами
+
+        Returns:
+            Актуальные credentials или None, если обновить не удалось
+        """
+        with self._lock:
+            with file_lock(self.lock_file):
+                # Другой процесс мог уже обновить токен, пока мы ждали блокировку
+                disk_credentials = self._load()
+                if disk_credentials and not self._needs_refresh(disk_credentials):
+                    self.credentials = disk_credentials
+                elif self.credentials or disk_credentials:
+                    credentials = self.credentials or disk_credentials
+                    if not credentials.refresh_token:
+                        return None
+                    try:
+                        credentials.refresh(Request())
+                    except Exception as e:
+                        print(f"Ошибка обновления токена: {e}")
+                        self._schedule_refresh(retry=True)
+                        return None
+                    atomic_pickle_dump(credentials, self.token_file)
+                    self.credentials = credentials
+                    self.refresh_count += 1
+                    print("Токен успешно обновлен")
+
+            self._schedule_refresh()
+            return self.credentials
+
+    def stop(self) -> None:
+        """Остановка фонового таймера"""
+        with self._lock:
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
+
+    def _load(self):
+        if not os.path.exists(self.token_file):
+            return None
+        try:
+            with open(self.token_file, 'rb') as token:
+                return pickle.load(token)
+        except Exception as e:
+            print(f"Ошибка загрузки токена: {e}")
+            return None
+
+    def _needs_refresh(self, credentials) -> bool:
+        if not credentials.token:
+            return True
+        if credentials.expiry is None:
+            return False
+        # google-auth хранит expiry как naive UTC
+        return credentials.expiry - self.refresh_margin <= datetime.utcnow()
+
+    def _schedule_refresh(self, retry: bool = False) -> None:
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+
+        credentials = self.credentials
+        if not credentials or not credentials.refresh_token:
+            return
+
+        if retry:
+            delay = Config.GOOGLE_TOKEN_REFRESH_RETRY_SECONDS
+        elif credentials.expiry is None:
+            return
+        else:
+            refresh_at = credentials.expiry - self.refresh_margin
+            delay = max((refresh_at - datetime.utcnow()).total_seconds(), 0)
+        # Небольшой разброс, чтобы воркеры не просыпались одновременно
+        delay += random.uniform(0, min(30, self.refresh_margin.total_seconds() / 4))
+
+        self._timer = threading.Timer(delay, self.refresh)
+        self._timer.daemon = True
+        self._timer.start()
+
+
+_stores: Dict[str, CredentialStore] = {}
+_stores_lock = threading.Lock()
+
+
+def reset_credential_stores() -> None:
+    """
+    Сброс состояния хранилищ после fork
+
+    Таймер обновления родителя в дочернем процессе не работает, а блокировка
+    могла быть захвачена потоком родителя. Credentials в памяти сохраняются.
+    """
+    global _stores_lock
+    _stores_lock = threading.Lock()
+    for store in list(_stores.values()):
+        store._lock = threading.RLock()
+        store._timer = None
+        if store.credentials is not None:
+            store._schedule_refresh()
+
+
+def get_credential_store(token_file: str) -> CredentialStore:
+    """
+    Общее для процесса хранилище credentials для token-файла
+
+    Args:
+        token_file: Путь к pickle-файлу с токеном
+
+    Returns:
+        CredentialStore
+    """
+    path = os.path.abspath(token_file)
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            store = CredentialStore(token_file)
+            _stores[path] = store
+        return store
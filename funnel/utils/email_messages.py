@@ -0,0 +1,136 @@
+"""
+Email Messages Module
+Сборка писем воронки для отправки через очередь доставки
+"""
+
+import html as html_lib
+from email.message import EmailMessage
+from email.utils import formataddr, make_msgid
+
+from config import Config
+
+
+def build_message(to_email: str, subject: str, text: str, html: str = None) -> EmailMessage:
+    """
+    Сборка письма с текстовой и (опционально) HTML версией
+
+    Args:
+        to_email: Адрес получателя
+        subject: Тема письма
+        text: Текстовая версия
+        html: HTML версия
+
+    Returns:
+        EmailMessage
+    """
+    message = EmailMessage()
+    message['From'] = formataddr((Config.SENDER_NAME, Config.SENDER_EMAIL))
+    message['To'] = to_email
+    message['Subject'] = subject
+    message['Message-ID'] = make_msgid()
+    message.set_content(text)
+    if html:
+        message.add_alternative(html, subtype='html')
+    return message
+
+
+def build_video_email(to_email: str, first_name: str, video_url: str) -> EmailMessage:
+    """
+    Письмо со ссылкой на видео
+
+    Args:
+        to_email: Адрес получателя
+        first_name: Имя получателя
+        video_url: Ссылка на страницу с видео
+
+    Returns:
+        EmailMessage
+    """
+    text = (
+        f"Здравствуйте, {first_name}!\n\n"
+        f"Ваше видео готово к просмотру:\n{video_url}\n\n"
+        f"До встречи!"
+    )
+    safe_name = html_lib.escape(first_name)
+    safe_url = html_lib.escape(video_url, quote=True)
+    html = f'''
+    <div style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto;">
+        <h2 style="color: #2d5a2d;">Здравствуйте, {safe_name}!</h2>
+        <p>Ваше видео готово к просмотру.</p>
+        <p style="text-align: center; margin: 30px 0;">
+            <a href="{safe_url}" style="background: #3b82f6; color: white; padding: 14px 28px; border-radius: 6px; text-decoration: none;">
+                Смотреть видео
+            </a>
+        </p>
+        <p style="color: #666; font-size: 12px;">Если кнопка не работает, откройте ссылку: {safe_url}</p>
+    </div>
+    '''
+    return build_message(to_email, f'{first_name}, ваше видео готово', text, html)
+
+
+def build_reminder_email(to_email: str, name: str, appointment_date: str,
+                         appointment_time: str, timezone: str = None) -> EmailMessage:
+    """
+    Напоминание о предстоящей встрече
+
+    Args:
+        to_email: Адрес получателя
+        name: Имя получателя
+        appointment_date: Дата встречи YYYY-MM-DD
+        appointment_time: Время встречи HH:MM
+        timezone: Часовой пояс встречи
+
+    Returns:
+        EmailMessage
+    """
+    timezone = timezone or Config.DEFAULT_TIMEZONE
+    text = (
+        f"Здравствуйте, {name}!\n\n"
+        f"Напоминаем о нашей встрече {appointment_date} в {appointment_time} ({timezone}).\n\n"
+        f"До встречи!"
+    )
+    html = f'''
+    <div style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto;">
+        <h2 style="color: #2d5a2d;">Здравствуйте, {html_lib.escape(name)}!</h2>
+        <p>Напоминаем о нашей встрече:</p>
+        <p style="font-size: 18px;"><strong>{html_lib.escape(appointment_date)} в {html_lib.escape(appointment_time)}</strong>
+            <span style="color: #666;">({html_lib.escape(timezone)})</span></p>
+        <p>До встречи!</p>
+    </div>
+    '''
+    return build_message(to_email, 'Напоминание о встрече', text, html)
+
+
+def build_confirmation_email(to_email: str, name: str, appointment_date: str,
+                             appointment_time: str, timezone: str = None) -> EmailMessage:
+    """
+    Подтверждение записи на встречу
+
+    Args:
+        to_email: Адрес получателя
+        name: Имя получателя
+        appointment_date: Дата встречи YYYY-MM-DD
+        appointment_time: Время встречи HH:MM
+        timezone: Часовой пояс встречи
+
+    Returns:
+        EmailMessage
+    """
+    timezone = timezone or Config.DEFAULT_TIMEZONE
+    text = (
+        f"Здравствуйте, {name}!\n\n"
+        f"Вы записаны на встречу {appointment_date} в {appointment_time} ({timezone}).\n"
+        f"Мы пришлем напоминание накануне.\n\n"
+        f"До встречи!"
+    )
+    html = f'''
+    <div style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto;">
+        <h2 style="color: #2d5a2d;">Здравствуйте, {html_lib.escape(name)}!</h2>
+        <p>Вы записаны на встречу:</p>
+        <p style="font-size: 18px;"><strong>{html_lib.escape(appointment_date)} в {html_lib.escape(appointment_time)}</strong>
+            <span style="color: #666;">({html_lib.escape(timezone)})</span></p>
+        <p>Мы пришлем напоминание накануне.</p>
+        <p>До встречи!</p>
+    </div>
+    '''
+    return build_message(to_email, 'Встреча подтверждена', text, html)
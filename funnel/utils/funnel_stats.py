@@ -0,0 +1,229 @@
+"""
+Funnel Stats Module
+Материализованные счетчики воронки с дневными срезами
+"""
+
+import sqlite3
+from datetime import datetime, timedelta, timezone
+from typing import Any, ContextManager, Dict, List
+
+from config import Config
+from database.connection import get_database
+
+
+# Счетчики обновляются триггерами в той же транзакции, что и INSERT/DELETE
+# в leads и appointments, поэтому не расходятся с таблицами при откате.
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS funnel_counters (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID''',
+    '''CREATE TABLE IF NOT EXISTS funnel_daily (
+        day TEXT NOT NULL,
+        metric TEXT NOT NULL,
+        value INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, metric)
+    ) WITHOUT ROWID''',
+    '''CREATE TABLE IF NOT EXISTS funnel_stats_suspended (
+        reason TEXT PRIMARY KEY
+    ) WITHOUT ROWID''',
+    # Триггеры пересоздаются при каждом install(), чтобы изменения определений применялись
+    'DROP TRIGGER IF EXISTS funnel_stats_lead_insert',
+    '''CREATE TRIGGER funnel_stats_lead_insert AFTER INSERT ON leads
+        WHEN NOT EXISTS (SELECT 1 FROM funnel_stats_suspended) BEGIN
+        INSERT INTO funnel_counters (name, value) VALUES ('leads', 1)
+            ON CONFLICT (name) DO UPDATE SET value = value + 1;
+        INSERT INTO funnel_daily (day, metric, value) VALUES (date(COALESCE(NEW.created_at, 'now')), 'leads', 1)
+            ON CONFLICT (day, metric) DO UPDATE SET value = value + 1;
+    END''',
+    'DROP TRIGGER IF EXISTS funnel_stats_lead_delete',
+    '''CREATE TRIGGER funnel_stats_lead_delete AFTER DELETE ON leads BEGIN
+        UPDATE funnel_counters SET value = value - 1 WHERE name = 'leads';
+        UPDATE funnel_daily SET value = value - 1
+            WHERE day = date(COALESCE(OLD.created_at, 'now')) AND metric = 'leads';
+    END''',
+    'DROP TRIGGER IF EXISTS funnel_stats_appointment_insert',
+    '''CREATE TRIGGER funnel_stats_appointment_insert AFTER INSERT ON appointments BEGIN
+        INSERT INTO funnel_counters (name, value) VALUES ('appointments', 1)
+            ON CONFLICT (name) DO UPDATE SET value = value + 1;
+        INSERT INTO funnel_daily (day, metric, value) VALUES (date(COALESCE(NEW.created_at, 'now')), 'appointments', 1)
+            ON CONFLICT (day, metric) DO UPDATE SET value = value + 1;
+        INSERT INTO funnel_counters (name, value)
+            SELECT 'calendar_events', 1 WHERE NEW.google_event_id IS NOT NULL
+            ON CONFLICT (name) DO UPDATE SET value = value + 1;
+    END''',
+    'DROP TRIGGER IF EXISTS funnel_stats_appointment_delete',
+    '''CREATE TRIGGER funnel_stats_appointment_delete AFTER DELETE ON appointments BEGIN
+        UPDATE funnel_counters SET value = value - 1 WHERE name = 'appointments';
+        UPDATE funnel_daily SET value = value - 1
+            WHERE day = date(COALESCE(OLD.created_at, 'now')) AND metric = 'appointments';
+        UPDATE funnel_counters SET value = value - 1
+            WHERE name = 'calendar_events' AND OLD.google_event_id IS NOT NULL;
+    END''',
+    'DROP TRIGGER IF EXISTS funnel_stats_appointment_event',
+    '''CREATE TRIGGER funnel_stats_appointment_event AFTER UPDATE OF google_event_id ON appointments
+        WHEN (OLD.google_event_id IS NULL) != (NEW.google_event_id IS NULL) BEGIN
+        INSERT INTO funnel_counters (name, value)
+            VALUES ('calendar_events', CASE WHEN NEW.google_event_id IS NULL THEN -1 ELSE 1 END)
+            ON CONFLICT (name) DO UPDATE SET value = value + excluded.value;
+    END'''
+]
+
+METRICS = ('leads', 'appointments')
+
+
+def suspend_lead_counters(conn: sqlite3.Connection) -> None:
+    """
+    Отключение построчного триггера вставки лидов для пакетного импорта
+
+    Флаг виден только внутри текущей транзакции записи (другие соединения
+    не могут писать до ее завершения), поэтому остальные вставки не затрагивает.
+    Вызывается внутри transaction(immediate=True) вместе с resume_lead_counters().
+    """
+    conn.execute("INSERT OR IGNORE INTO funnel_stats_suspended (reason) VALUES ('bulk_import')")
+
+
+def resume_lead_counters(conn: sqlite3.Connection, after_id: int) -> None:
+    """
+    Учет лидов, вставленных после suspend_lead_counters(), одним запросом и снятие флага
+
+    Args:
+        conn: Соединение с открытой транзакцией записи
+        after_id: Максимальный id лида до начала вставки
+    """
+    conn.execute('''
+        INSERT INTO funnel_counters (name, value)
+        SELECT 'leads', COUNT(*) FROM leads WHERE id > ?
+        ON CONFLICT (name) DO UPDATE SET value = value + excluded.value
+    ''', (after_id,))
+    conn.execute('''
+        INSERT INTO funnel_daily (day, metric, value)
+        SELECT date(COALESCE(created_at, 'now')), 'leads', COUNT(*) FROM leads WHERE id > ?
+        GROUP BY 1
+        ON CONFLICT (day, metric) DO UPDATE SET value = value + excluded.value
+    ''', (after_id,))
+    conn.execute("DELETE FROM funnel_stats_suspended WHERE reason = 'bulk_import'")
+
+
+class FunnelStats:
+    """Статистика воронки за O(1) из материализованных счетчиков
+
+    funnel_counters хранит итоговые значения, funnel_daily - количество лидов
+    и встреч по дням (по created_at, UTC). Обе таблицы обновляются триггерами
+    на leads и appointments; rebuild() пересчитывает их с нуля.
+    """
+
+    def __init__(self, db_path: str = None):
+        """
+        Инициализация счетчиков: создание таблиц и триггеров, первичный пересчет
+
+        Args:
+            db_path: Путь к funnel.db
+        """
+        self.db_path = db_path or Config.DATABASE_PATH
+        self.database = get_database(self.db_path)
+        self.install()
+
+    def connect(self, immediate: bool = False) -> ContextManager[sqlite3.Connection]:
+        """Транзакция на соединении потока с funnel.db: commit при успехе, rollback при ошибке"""
+        return self.database.transaction(immediate)
+
+    def install(self) -> None:
+        """Создание таблиц и триггеров; при первой установке счетчики пересчитываются"""
+        with self.connect(immediate=True) as conn:
+            installed = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'funnel_counters'"
+            ).fetchone()
+            for statement in SCHEMA:
+                conn.execute(statement)
+            # Триггеры и пересчет в одной транзакции: вставки между ними не потеряются
+            if not installed:
+                self._rebuild(conn)
+
+    def rebuild(self) -> Dict[str, Any]:
+        """
+        Пересчет счетчиков и дневных срезов по таблицам leads и appointments
+
+        Returns:
+            Пересчитанная статистика
+        """
+        with self.connect(immediate=True) as conn:
+            self._rebuild(conn)
+        return self.get()
+
+    @staticmethod
+    def _rebuild(conn: sqlite3.Connection) -> None:
+        conn.execute('DELETE FROM funnel_counters')
+        conn.execute('DELETE FROM funnel_daily')
+        conn.execute('''
+            INSERT INTO funnel_counters (name, value)
+            SELECT 'leads', COUNT(*) FROM leads
+            UNION ALL SELECT 'appointments', COUNT(*) FROM appointments
+            UNION ALL SELECT 'calendar_events', COUNT(*) FROM appointments WHERE google_event_id IS NOT NULL
+        ''')
+        conn.execute('''
+            INSERT INTO funnel_daily (day, metric, value)
+            SELECT date(created_at), 'leads', COUNT(*) FROM leads
+                WHERE created_at IS NOT NULL GROUP BY date(created_at)
+            UNION ALL
+            SELECT date(created_at), 'appointments', COUNT(*) FROM appointments
+                WHERE created_at IS NOT NULL GROUP BY date(created_at)
+        ''')
+
+    def get(self) -> Dict[str, Any]:
+        """
+        Текущая статистика
+
+        Returns:
+            Словарь total_leads, total_appointments, today_leads, google_calendar_appointments
+        """
+        today = datetime.now(timezone.utc).strftime('%Y-%m-%d')
+        with self.connect() as conn:
+            counters = dict(conn.execute('SELECT name, value FROM funnel_counters').fetchall())
+            row = conn.execute(
+                "SELECT value FROM funnel_daily WHERE day = ? AND metric = 'leads'", (today,)
+            ).fetchone()
+        return {
+            'total_leads': counters.get('leads', 0),
+            'total_appointments': counters.get('appointments', 0),
+            'today_leads': row['value'] if row else 0,
+            'google_calendar_appointments': counters.get('calendar_events', 0)
+        }
+
+    def daily(self, metric: str, date_from: str = None, date_to: str = None) -> List[Dict[str, Any]]:
+        """
+        Дневной ряд метрики (дни без событий заполняются нулями)
+
+        Args:
+            metric: leads или appointments
+            date_from: Начало периода YYYY-MM-DD (по умолчанию - 30 дней назад)
+            date_to: Конец периода YYYY-MM-DD включительно (по умолчанию - сегодня)
+
+        Returns:
+            Список {'date', 'value'}
+
+        Raises:
+            ValueError: неизвестная метрика или неверный формат даты
+        """
+        if metric not in METRICS:
+            raise ValueError(f"Invalid metric. Use one of: {', '.join(METRICS)}")
+        end = datetime.strptime(date_to, '%Y-%m-%d') if date_to else datetime.now(timezone.utc).replace(tzinfo=None)
+        start = datetime.strptime(date_from, '%Y-%m-%d') if date_from else end - timedelta(days=29)
+        if start > end:
+            raise ValueError('date_from must not be after date_to')
+        if (end - start).days >= Config.STATS_DAILY_MAX_DAYS:
+            raise ValueError(f'Date range must not exceed {Config.STATS_DAILY_MAX_DAYS} days')
+
+        with self.connect() as conn:
+            values = dict(conn.execute(
+                'SELECT day, value FROM funnel_daily WHERE metric = ? AND day BETWEEN ? AND ?',
+                (metric, start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d'))
+            ).fetchall())
+
+        series = []
+        day = start
+        while day <= end:
+            key = day.strftime('%Y-%m-%d')
+            series.append({'date': key, 'value': values.get(key, 0)})
+            day += timedelta(days=1)
+        return series
@@ -5,17 +5,71 @@ Google Calendar Authentication Module
 
 import os
 import json
-import pickle
+import time
+import uuid
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Callable, List, Set, Tuple
+from zoneinfo import ZoneInfo
 
-from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
 from config import Config
+from utils.calendar_outbox import google_event_id_for
+from utils.calendar_service import service_factory
+from utils.credential_store import get_credential_store
+from utils.slot_engine import busy_intervals_from_freebusy, day_bounds, free_slots_by_day, free_slots_for_events
+
+
+# Временные ошибки Google API, после которых запрос отправляется повторно
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+# Причины 403, означающие превышение квоты; остальные 403 (нет доступа) не повторяются
+RATE_LIMIT_REASONS = {'rateLimitExceeded', 'userRateLimitExceeded'}
+
+
+def is_retryable_error(exception: Exception) -> bool:
+    """
+    Стоит ли повторять запрос после ошибки
+
+    Args:
+        exception: Ошибка запроса или подзапроса batch
+
+    Returns:
+        True для сетевых ошибок, 408, 429, 5xx и 403 с причиной rate limit
+    """
+    if not isinstance(exception, HttpError):
+        return True
+    status = exception.resp.status
+    if status in RETRYABLE_STATUS_CODES:
+        return True
+    if status != 403:
+        return False
+    try:
+        errors = json.loads(exception.content).get('error', {}).get('errors', [])
+    except (ValueError, AttributeError, TypeError):
+        return False
+    return any(error.get('reason') in RATE_LIMIT_REASONS for error in errors)
+
+
+def bulk_event_ids(events: List[Dict[str, Any]], nonce: str) -> List[str]:
+    """
+    ID для событий пакетного создания
+
+    ID зависит от nonce вызова, содержимого события и номера среди
+    одинаковых событий, поэтому повтор подзапроса внутри вызова получает 409
+    вместо дубликата, а новое создание того же события (например после
+    удаления) - новый ID.
+    """
+    seen: Dict[str, int] = {}
+    event_ids = []
+    for event in events:
+        content = json.dumps(event, sort_keys=True, ensure_ascii=False)
+        occurrence = seen.get(content, 0)
+        seen[content] = occurrence + 1
+        event_ids.append(event.get('id') or google_event_id_for(f'bulk:{nonce}:{content}:{occurrence}'))
+    return event_ids
 
 
 class GoogleCalendarAuth:
@@ -44,6 +98,8 @@ class GoogleCalendarAuth:
         
         self.credentials_file = credentials_file
         self.token_file = token_file or Config.GOOGLE_TOKEN_FILE
+        # Один календарь для freeBusy, чтения и записи событий
+        self.calendar_id = Config.GOOGLE_CALENDAR_ID
         self.credentials = None
         self.service = None
         
@@ -54,25 +110,15 @@ class GoogleCalendarAuth:
         Returns:
             Credentials объект или None если аутентификация не удалась
         """
-        # Проверяем, есть ли уже сохраненный токен
-        if os.path.exists(self.token_file):
-            try:
-                with open(self.token_file, 'rb') as token:
-                    self.credentials = pickle.load(token)
-            except Exception as e:
-                print(f"Ошибка загрузки токена: {e}")
-                self.credentials = None
+        # Credentials хранятся в памяти процесса и обновляются фоновым таймером
+        store = get_credential_store(self.token_file)
+        self.credentials = store.get()
         
         # Если нет валидных credentials, запрашиваем новые
         if not self.credentials or not self.credentials.valid:
             if self.credentials and self.credentials.expired and self.credentials.refresh_token:
-                # Обновляем истекший токен
-                try:
-                    self.credentials.refresh(Request())
-                    print("Токен успешно обновлен")
-                except Exception as e:
-                    print(f"Ошибка обновления токена: {e}")
-                    self.credentials = None
+                # Фоновое обновление не успело - обновляем истекший токен
+                self.credentials = store.refresh()
             
             if not self.credentials:
                 # Запускаем OAuth flow для получения новых credentials
@@ -87,15 +133,12 @@ class GoogleCalendarAuth:
                 except Exception as e:
                     print(f"Ошибка получения credentials: {e}")
                     return None
-            
-            # Сохраняем credentials для будущего использования
-            try:
-                os.makedirs(os.path.dirname(self.token_file), exist_ok=True)
-                with open(self.token_file, 'wb') as token:
-                    pickle.dump(self.credentials, token)
-                print(f"Credentials сохранены в {self.token_file}")
-            except Exception as e:
-                print(f"Ошибка сохранения токена: {e}")
+                
+                # Сохраняем credentials для будущего использования
+                try:
+                    store.save(self.credentials)
+                except Exception as e:
+                    print(f"Ошибка сохранения токена: {e}")
         
         return self.credentials
     
@@ -106,16 +149,16 @@ class GoogleCalendarAuth:
         Returns:
             Google Calendar service объект или None
         """
-        if not self.credentials:
-            self.credentials = self.get_credentials()
+        # Берем актуальные credentials из хранилища: после фонового обновления объект может смениться
+        self.credentials = self.get_credentials()
         
         if not self.credentials:
             print("Не удалось получить credentials")
             return None
         
         try:
-            self.service = build('calendar', 'v3', credentials=self.credentials)
-            print("Google Calendar service создан успешно")
+            # Клиент переиспользуется внутри потока, build() не вызывается на каждый запрос
+            self.service = service_factory.get(self.credentials)
             return self.service
         except Exception as e:
             print(f"Ошибка создания service: {e}")
@@ -159,7 +202,7 @@ class GoogleCalendarAuth:
             # Получаем количество событий
             now = datetime.utcnow().isoformat() + 'Z'
             events_result = service.events().list(
-                calendarId='primary',
+                calendarId=self.calendar_id,
                 timeMin=now,
                 maxResults=10,
                 singleEvents=True,
@@ -192,7 +235,9 @@ class GoogleCalendarAuth:
             'success': False,
             'message': '',
             'event_id': None,
-            'event_link': None
+            'event_link': None,
+            'status_code': None,
+            'retryable': True
         }
         
         try:
@@ -203,7 +248,7 @@ class GoogleCalendarAuth:
             
             # Создаем событие
             event = service.events().insert(
-                calendarId='primary',
+                calendarId=self.calendar_id,
                 body=event_data
             ).execute()
             
@@ -213,19 +258,293 @@ class GoogleCalendarAuth:
             result['message'] = 'Событие создано успешно'
             
         except HttpError as e:
+            result['status_code'] = e.resp.status
+            result['retryable'] = is_retryable_error(e)
             result['message'] = f'HTTP ошибка при создании события: {e}'
         except Exception as e:
             result['message'] = f'Ошибка при создании события: {e}'
         
         return result
     
-    def get_available_slots(self, date: str, duration_minutes: int = 60) -> Dict[str, Any]:
+    def get_event(self, event_id: str) -> Dict[str, Any]:
+        """
+        Получение события из Google Calendar
+        
+        Args:
+            event_id: ID события
+            
+        Returns:
+            Результат с данными события
+        """
+        result = {
+            'success': False,
+            'message': '',
+            'event_id': event_id,
+            'event_link': None,
+            'status_code': None,
+            'retryable': True
+        }
+        
+        try:
+            service = self.get_service()
+            if not service:
+                result['message'] = 'Не удалось создать service'
+                return result
+            
+            event = service.events().get(calendarId=self.calendar_id, eventId=event_id).execute()
+            
+            result['success'] = True
+            result['event_link'] = event.get('htmlLink')
+            result['message'] = 'Событие получено'
+            
+        except HttpError as e:
+            result['status_code'] = e.resp.status
+            result['retryable'] = is_retryable_error(e)
+            result['message'] = f'HTTP ошибка при получении события: {e}'
+        except Exception as e:
+            result['message'] = f'Ошибка при получении события: {e}'
+        
+        return result
+    
+    def update_event(self, event_id: str, event_data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Обновление события в Google Calendar (patch)
+        
+        Args:
+            event_id: ID события
+            event_data: Изменяемые поля события
+            
+        Returns:
+            Результат обновления события
+        """
+        result = {
+            'success': False,
+            'message': '',
+            'event_id': event_id,
+            'event_link': None,
+            'status_code': None,
+            'retryable': True
+        }
+        
+        try:
+            service = self.get_service()
+            if not service:
+                result['message'] = 'Не удалось создать service'
+                return result
+            
+            event = service.events().patch(
+                calendarId=self.calendar_id,
+                eventId=event_id,
+                body=event_data
+            ).execute()
+            
+            result['success'] = True
+            result['event_link'] = event.get('htmlLink')
+            result['message'] = 'Событие обновлено успешно'
+            
+        except HttpError as e:
+            result['status_code'] = e.resp.status
+            result['retryable'] = is_retryable_error(e)
+            result['message'] = f'HTTP ошибка при обновлении события: {e}'
+        except Exception as e:
+            result['message'] = f'Ошибка при обновлении события: {e}'
+        
+        return result
+    
+    def delete_event(self, event_id: str) -> Dict[str, Any]:
+        """
+        Удаление события из Google Calendar
+        
+        Args:
+            event_id: ID события
+            
+        Returns:
+            Результат удаления события
+        """
+        result = {
+            'success': False,
+            'message': '',
+            'event_id': event_id,
+            'status_code': None,
+            'retryable': True
+        }
+        
+        try:
+            service = self.get_service()
+            if not service:
+                result['message'] = 'Не удалось создать service'
+                return result
+            
+            service.events().delete(calendarId=self.calendar_id, eventId=event_id).execute()
+            
+            result['success'] = True
+            result['message'] = 'Событие удалено успешно'
+            
+        except HttpError as e:
+            result['status_code'] = e.resp.status
+            result['retryable'] = is_retryable_error(e)
+            result['message'] = f'HTTP ошибка при удалении события: {e}'
+        except Exception as e:
+            result['message'] = f'Ошибка при удалении события: {e}'
+        
+        return result
+    
+    def create_events(self, events: List[Dict[str, Any]], nonce: str = None) -> List[Dict[str, Any]]:
+        """
+        Пакетное создание событий (Google batch HTTP)
+        
+        Args:
+            events: Список тел событий; события без id получают id из nonce и содержимого,
+                поэтому повторная вставка (409) внутри вызова считается успехом, а не создает дубликат
+            nonce: Ключ операции (например Idempotency-Key запроса); по умолчанию случайный,
+                так что каждый вызов создает новые события
+            
+        Returns:
+            Результаты в порядке входного списка
+        """
+        nonce = nonce or uuid.uuid4().hex
+        events = [dict(event, id=event_id) for event, event_id in zip(events, bulk_event_ids(events, nonce))]
+        
+        def make_request(service, event):
+            return service.events().insert(calendarId=self.calendar_id, body=event)
+        
+        results = self._execute_batch(events, make_request, ok_statuses={409})
+        for event, result in zip(events, results):
+            if result['success'] and not result['event_id']:
+                result['event_id'] = event.get('id')
+        return results
+    
+    def patch_events(self, updates: List[Tuple[str, Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        """
+        Пакетное обновление событий
+        
+        Args:
+            updates: Список пар (event_id, изменяемые поля)
+            
+        Returns:
+            Результаты в порядке входного списка
+        """
+        def make_request(service, update):
+            event_id, body = update
+            return service.events().patch(calendarId=self.calendar_id, eventId=event_id, body=body)
+        
+        results = self._execute_batch(updates, make_request)
+        for (event_id, _), result in zip(updates, results):
+            result['event_id'] = result['event_id'] or event_id
+        return results
+    
+    def delete_events(self, event_ids: List[str]) -> List[Dict[str, Any]]:
+        """
+        Пакетное удаление событий
+        
+        Args:
+            event_ids: Список ID событий; уже удаленные события (404/410) считаются успехом
+            
+        Returns:
+            Результаты в порядке входного списка
+        """
+        def make_request(service, event_id):
+            return service.events().delete(calendarId=self.calendar_id, eventId=event_id)
+        
+        results = self._execute_batch(event_ids, make_request, ok_statuses={404, 410})
+        for event_id, result in zip(event_ids, results):
+            result['event_id'] = event_id
+        return results
+    
+    def _execute_batch(self, items: List[Any], make_request: Callable[[Any, Any], Any],
+                       ok_statuses: Set[int] = frozenset()) -> List[Dict[str, Any]]:
+        """
+        Выполнение операций пакетами до Config.GOOGLE_BATCH_MAX_SIZE запросов
+        
+        Повторно отправляются только подзапросы, завершившиеся временной ошибкой
+        (429, 5xx, 403 rate limit, сетевая ошибка всего пакета).
+        
+        Args:
+            items: Элементы операции
+            make_request: Функция (service, item) -> HttpRequest
+            ok_statuses: HTTP статусы, которые считаются успехом операции
+            
+        Returns:
+            Результаты в порядке входного списка
+        """
+        results = [
+            {'success': False, 'message': '', 'event_id': None, 'event_link': None, 'status_code': None, 'attempts': 0}
+            for _ in items
+        ]
+        if not items:
+            return results
+        
+        service = self.get_service()
+        if not service:
+            for result in results:
+                result['message'] = 'Не удалось создать service'
+            return results
+        
+        pending = list(range(len(items)))
+        for attempt in range(Config.GOOGLE_BATCH_MAX_RETRIES + 1):
+            if attempt:
+                time.sleep(Config.GOOGLE_BATCH_RETRY_BASE_SECONDS * (2 ** (attempt - 1)))
+            retry = []
+            answered = set()  # подзапросы, получившие ответ в этой попытке
+            
+            for chunk_start in range(0, len(pending), Config.GOOGLE_BATCH_MAX_SIZE):
+                chunk = pending[chunk_start:chunk_start + Config.GOOGLE_BATCH_MAX_SIZE]
+                
+                def callback(request_id, response, exception):
+                    index = int(request_id)
+                    result = results[index]
+                    result['attempts'] += 1
+                    answered.add(index)
+                    if exception is None:
+                        result['success'] = True
+                        result['message'] = 'OK'
+                        result['status_code'] = None
+                        if response:
+                            result['event_id'] = response.get('id')
+                            result['event_link'] = response.get('htmlLink')
+                        return
+                    
+                    status = exception.resp.status if isinstance(exception, HttpError) else None
+                    result['status_code'] = status
+                    if status in ok_statuses:
+                        result['success'] = True
+                        result['message'] = f'HTTP {status}: уже выполнено'
+                    else:
+                        result['message'] = f'Ошибка: {exception}'
+                        if is_retryable_error(exception):
+                            retry.append(index)
+                
+                batch = service.new_batch_http_request(callback=callback)
+                for index in chunk:
+                    batch.add(make_request(service, items[index]), request_id=str(index))
+                try:
+                    batch.execute()
+                except Exception as e:
+                    # Пакет не доставлен целиком - повторяем подзапросы, не получившие ответа;
+                    # неповторяемые ошибки (400, 404) остаются ошибками
+                    for index in chunk:
+                        if index not in answered:
+                            results[index]['message'] = f'Ошибка пакетного запроса: {e}'
+                            retry.append(index)
+            
+            pending = sorted(retry)
+            if not pending:
+                break
+        
+        return results
+    
+    def get_available_slots(self, date: str, duration_minutes: int = 60,
+                            granularity_minutes: int = None,
+                            work_start: str = None, work_end: str = None) -> Dict[str, Any]:
         """
         Получение доступных слотов для записи
         
         Args:
             date: Дата в формате YYYY-MM-DD
             duration_minutes: Длительность встречи в минутах
+            granularity_minutes: Шаг сетки слотов (по умолчанию Config.SLOT_GRANULARITY_MINUTES)
+            work_start: Начало рабочего дня HH:MM (по умолчанию Config.WORKING_HOURS_START)
+            work_end: Конец рабочего дня HH:MM (по умолчанию Config.WORKING_HOURS_END)
             
         Returns:
             Список доступных слотов
@@ -242,40 +561,37 @@ class GoogleCalendarAuth:
                 result['message'] = 'Не удалось создать service'
                 return result
             
-            # Время начала и конца дня
-            start_time = f"{date}T00:00:00Z"
-            end_time = f"{date}T23:59:59Z"
+            # Границы дня в часовом поясе рабочих часов
+            tz = ZoneInfo(Config.DEFAULT_TIMEZONE)
+            day_start, day_end = day_bounds(datetime.strptime(date, '%Y-%m-%d').date(), tz)
             
             # Получаем события на указанную дату
-            events_result = service.events().list(
-                calendarId='primary',
-                timeMin=start_time,
-                timeMax=end_time,
-                singleEvents=True,
-                orderBy='startTime'
-            ).execute()
-            
-            events = events_result.get('items', [])
+            events = []
+            page_token = None
+            while True:
+                events_result = service.events().list(
+                    calendarId=self.calendar_id,
+                    timeMin=day_start.isoformat(),
+                    timeMax=day_end.isoformat(),
+                    singleEvents=True,
+                    orderBy='startTime',
+                    pageToken=page_token
+                ).execute()
+                events.extend(events_result.get('items', []))
+                page_token = events_result.get('nextPageToken')
+                if not page_token:
+                    break
             
-            # Генерируем доступные слоты
-            available_slots = []
-            for hour in range(9, 18):  # Рабочие часы 9:00-18:00
-                for minute in [0, 15, 30, 45]:  # Слоты каждые 15 минут
-                    slot_start = f"{date}T{hour:02d}:{minute:02d}:00"
-                    slot_end = f"{date}T{(hour + duration_minutes // 60):02d}:{(minute + duration_minutes % 60):02d}:00"
-                    
-                    # Проверяем, не пересекается ли слот с существующими событиями
-                    is_available = True
-                    for event in events:
-                        event_start = event['start'].get('dateTime', event['start'].get('date'))
-                        event_end = event['end'].get('dateTime', event['end'].get('date'))
-                        
-                        if (slot_start < event_end and slot_end > event_start):
-                            is_available = False
-                            break
-                    
-                    if is_available:
-                        available_slots.append(f"{hour:02d}:{minute:02d}")
+            # Генерируем доступные слоты по слитым интервалам занятости
+            available_slots = free_slots_for_events(
+                date,
+                events,
+                timezone=Config.DEFAULT_TIMEZONE,
+                duration_minutes=duration_minutes,
+                granularity_minutes=granularity_minutes,
+                work_start=work_start,
+                work_end=work_end
+            )
             
             result['success'] = True
             result['available_slots'] = available_slots
@@ -287,6 +603,73 @@ class GoogleCalendarAuth:
         return result
 
 
+    def get_available_slots_range(self, date_from: str, date_to: str, duration_minutes: int = 60,
+                                  granularity_minutes: int = None,
+                                  work_start: str = None, work_end: str = None) -> Dict[str, Any]:
+        """
+        Получение доступных слотов для диапазона дат одним запросом freebusy.query
+        
+        Args:
+            date_from: Первая дата в формате YYYY-MM-DD (включительно)
+            date_to: Последняя дата в формате YYYY-MM-DD (включительно)
+            duration_minutes: Длительность встречи в минутах
+            granularity_minutes: Шаг сетки слотов (по умолчанию Config.SLOT_GRANULARITY_MINUTES)
+            work_start: Начало рабочего дня HH:MM (по умолчанию Config.WORKING_HOURS_START)
+            work_end: Конец рабочего дня HH:MM (по умолчанию Config.WORKING_HOURS_END)
+            
+        Returns:
+            Словарь со слотами по дням
+        """
+        result = {
+            'success': False,
+            'message': '',
+            'slots': {}
+        }
+        
+        try:
+            service = self.get_service()
+            if not service:
+                result['message'] = 'Не удалось создать service'
+                return result
+            
+            tz = ZoneInfo(Config.DEFAULT_TIMEZONE)
+            range_start, _ = day_bounds(datetime.strptime(date_from, '%Y-%m-%d').date(), tz)
+            _, range_end = day_bounds(datetime.strptime(date_to, '%Y-%m-%d').date(), tz)
+            
+            # Один запрос занятости на весь диапазон
+            freebusy_result = service.freebusy().query(body={
+                'timeMin': range_start.isoformat(),
+                'timeMax': range_end.isoformat(),
+                'timeZone': Config.DEFAULT_TIMEZONE,
+                'items': [{'id': self.calendar_id}]
+            }).execute()
+            
+            calendar = freebusy_result.get('calendars', {}).get(self.calendar_id, {})
+            if calendar.get('errors'):
+                result['message'] = f"Ошибка freebusy: {calendar['errors']}"
+                return result
+            
+            busy = busy_intervals_from_freebusy(calendar.get('busy', []), tz)
+            result['slots'] = free_slots_by_day(
+                date_from,
+                date_to,
+                busy,
+                timezone=Config.DEFAULT_TIMEZONE,
+                duration_minutes=duration_minutes,
+                granularity_minutes=granularity_minutes,
+                work_start=work_start,
+                work_end=work_end
+            )
+            result['success'] = True
+            result['message'] = f'Рассчитаны слоты для {len(result["slots"])} дней'
+            
+        except HttpError as e:
+            result['message'] = f'HTTP ошибка получения занятости: {e}'
+        except Exception as e:
+            result['message'] = f'Ошибка получения слотов: {e}'
+        
+        return result
+
 def main():
     """Основная функция для тестирования аутентификации"""
     print("🔐 Тестирование Google Calendar Authentication")
@@ -0,0 +1,312 @@
+"""
+Idempotency Module
+Хранилище ответов по заголовку Idempotency-Key для POST эндпоинтов
+"""
+
+import asyncio
+import functools
+import hashlib
+import json
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Mapping, Optional, Tuple
+
+from flask import Response, jsonify, make_response, request
+
+from config import Config
+from database.connection import get_database
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    key TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    status_code INTEGER,
+    headers TEXT,
+    body BLOB,
+    locked_until REAL,
+    expires_at REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires ON idempotency_keys (expires_at);
+'''
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+# Заголовки ответа, которые сохраняются и отдаются при повторе
+STORED_HEADERS = ('Content-Type', 'Location', 'Retry-After')
+
+
+class IdempotencyStore:
+    """Повтор запроса с тем же Idempotency-Key получает сохраненный ответ
+
+    Ответ хранится в funnel.db (idempotency_keys) Config.IDEMPOTENCY_TTL_SECONDS
+    и виден всем воркерам. Ключ привязан к пути и отпечатку тела запроса:
+    тот же ключ с другим телом отклоняется (422). Одновременные дубликаты
+    в процессе ждут первый запрос на threading.Event; дубликат из другого
+    процесса видит строку in-progress и опрашивает ее до завершения.
+    Ответы 5xx не сохраняются - такой запрос можно повторить.
+    """
+
+    def __init__(self, db_path: str = None, ttl_seconds: int = None, wait_seconds: float = None):
+        """
+        Инициализация хранилища
+
+        Args:
+            db_path: Путь к funnel.db
+            ttl_seconds: Время хранения ответа
+            wait_seconds: Сколько дубликат ждет завершения первого запроса
+        """
+        self.database = get_database(db_path or Config.DATABASE_PATH)
+        self.ttl_seconds = ttl_seconds or Config.IDEMPOTENCY_TTL_SECONDS
+        self.wait_seconds = wait_seconds or Config.IDEMPOTENCY_WAIT_SECONDS
+        self._inflight: Dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+        self._next_purge = 0.0
+        self.counters = {'executed': 0, 'replayed': 0, 'coalesced': 0, 'conflicts': 0, 'mismatches': 0}
+        self.database.executescript(SCHEMA)
+
+    # ------------------------------------------------------------------
+    # Хранилище
+    # ------------------------------------------------------------------
+
+    def _reserve(self, key: str, fingerprint: str) -> Tuple[str, Optional[Dict[str, Any]]]:
+        """
+        Резервирование ключа
+
+        Returns:
+            ('new', None) - ключ наш, запрос нужно выполнить;
+            ('done', ответ) - есть сохраненный ответ;
+            ('busy', None) - запрос выполняется другим воркером;
+            ('mismatch', None) - ключ использован с другим запросом
+        """
+        now = time.time()
+        with self.database.transaction(immediate=True) as conn:
+            row = conn.execute('SELECT * FROM idempotency_keys WHERE key = ?', (key,)).fetchone()
+            if row is not None and row['expires_at'] > now:
+                if row['fingerprint'] != fingerprint:
+                    return 'mismatch', None
+                if row['status_code'] is not None:
+                    return 'done', dict(row)
+                if row['locked_until'] > now:
+                    return 'busy', None
+            # Нового ключа нет, он истек, или воркер, взявший его, не завершил запрос
+            conn.execute(
+                '''INSERT OR REPLACE INTO idempotency_keys (key, fingerprint, locked_until, expires_at)
+                   VALUES (?, ?, ?, ?)''',
+                (key, fingerprint, now + Config.IDEMPOTENCY_LOCK_SECONDS, now + self.ttl_seconds)
+            )
+        return 'new', None
+
+    def _lookup(self, key: str) -> Optional[Dict[str, Any]]:
+        with self.database.transaction() as conn:
+            row = conn.execute(
+                'SELECT * FROM idempotency_keys WHERE key = ? AND expires_at > ?', (key, time.time())
+            ).fetchone()
+        return dict(row) if row else None
+
+    def _complete(self, key: str, status_code: int, headers: Mapping[str, str], body: bytes) -> None:
+        stored_headers = {name: headers[name] for name in STORED_HEADERS if name in headers}
+        with self.database.transaction() as conn:
+            conn.execute(
+                '''UPDATE idempotency_keys
+                   SET status_code = ?, headers = ?, body = ?, locked_until = NULL
+                   WHERE key = ?''',
+                (status_code, json.dumps(stored_headers), body, key)
+            )
+
+    def _release(self, key: str) -> None:
+        with self.database.transaction() as conn:
+            conn.execute('DELETE FROM idempotency_keys WHERE key = ? AND status_code IS NULL', (key,))
+
+    def purge(self) -> int:
+        """
+        Удаление истекших ключей
+
+        Returns:
+            Количество удаленных ключей
+        """
+        with self.database.transaction() as conn:
+            return conn.execute('DELETE FROM idempotency_keys WHERE expires_at <= ?', (time.time(),)).rowcount
+
+    def _maybe_purge(self) -> None:
+        now = time.time()
+        if now < self._next_purge:
+            return
+        self._next_purge = now + Config.IDEMPOTENCY_PURGE_INTERVAL_SECONDS
+        try:
+            self.purge()
+        except Exception as e:
+            print(f"Ошибка очистки idempotency_keys: {e}")
+
+    @staticmethod
+    def _replay(stored: Dict[str, Any]) -> Response:
+        response = Response(stored['body'], status=stored['status_code'])
+        for name, value in json.loads(stored['headers'] or '{}').items():
+            response.headers[name] = value
+        response.headers['Idempotent-Replayed'] = 'true'
+        return response
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self.counters[name] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики хранилища"""
+        with self._lock:
+            return dict(self.counters, inflight=len(self._inflight))
+
+    # ------------------------------------------------------------------
+    # Декоратор
+    # ------------------------------------------------------------------
+
+    def idempotent(self, view: Callable) -> Callable:
+        """
+        Декоратор Flask view: запросы с заголовком Idempotency-Key выполняются один раз
+
+        Запросы без заголовка выполняются как обычно.
+        """
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            client_key = request.headers.get(HEADER)
+            if not client_key:
+                return view(*args, **kwargs)
+            if len(client_key) > MAX_KEY_LENGTH:
+                return jsonify({'error': f'{HEADER} must not exceed {MAX_KEY_LENGTH} characters'}), 400
+
+            key = f'{request.method} {request.path} {client_key}'
+            fingerprint = hashlib.sha256(request.get_data()).hexdigest()
+            return self._handle(key, fingerprint, lambda: view(*args, **kwargs))
+
+        return wrapper
+
+    def _handle(self, key: str, fingerprint: str, execute: Callable[[], Any]) -> Response:
+        # Дубликат в этом же процессе ждет первый запрос без обращения к базе
+        with self._lock:
+            event = self._inflight.get(key)
+            leader = event is None
+            if leader:
+                event = threading.Event()
+                self._inflight[key] = event
+
+        if not leader:
+            self._count('coalesced')
+            event.wait(self.wait_seconds)
+            return self._respond_stored(key, fingerprint)
+
+        try:
+            self._maybe_purge()
+            state, stored = self._reserve(key, fingerprint)
+            deadline = time.monotonic() + self.wait_seconds
+            while state == 'busy' and time.monotonic() < deadline:
+                # Запрос выполняется другим воркером
+                time.sleep(Config.IDEMPOTENCY_POLL_SECONDS)
+                state, stored = self._reserve(key, fingerprint)
+
+            if state == 'done':
+                self._count('replayed')
+                return self._replay(stored)
+            if state == 'mismatch':
+                self._count('mismatches')
+                return make_response(jsonify({'error': f'{HEADER} was already used with a different request'}), 422)
+            if state == 'busy':
+                self._count('conflicts')
+                return make_response(jsonify({'error': 'A request with this Idempotency-Key is still in progress'}), 409)
+
+            try:
+                response = make_response(execute())
+            except Exception:
+                self._release(key)
+                raise
+            self._count('executed')
+            if response.status_code >= 500 or response.is_streamed:
+                self._release(key)
+            else:
+                self._complete(key, response.status_code, response.headers, response.get_data())
+            return response
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            event.set()
+
+    def _respond_stored(self, key: str, fingerprint: str) -> Response:
+        stored = self._lookup(key)
+        if stored is None:
+            # Первый запрос завершился ошибкой 5xx - ответ не сохранен
+            return make_response(jsonify({'error': 'The original request failed, retry it'}), 409)
+        if stored['fingerprint'] != fingerprint:
+            self._count('mismatches')
+            return make_response(jsonify({'error': f'{HEADER} was already used with a different request'}), 422)
+        if stored['status_code'] is None:
+            self._count('conflicts')
+            return make_response(jsonify({'error': 'A request with this Idempotency-Key is still in progress'}), 409)
+        return self._replay(stored)
+
+    # ------------------------------------------------------------------
+    # ASGI
+    # ------------------------------------------------------------------
+
+    async def handle_async(self, client_key: Optional[str], method: str, path: str, body: bytes,
+                           execute: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        """
+        Асинхронный вариант idempotent() для обработчиков asgi.py
+
+        Обращения к базе выполняются в пуле потоков. Дубликаты не
+        объединяются в процессе: второй запрос видит строку in-progress и
+        опрашивает ее через asyncio.sleep, не занимая поток.
+
+        Args:
+            client_key: Значение заголовка Idempotency-Key (None - без идемпотентности)
+            method: HTTP метод
+            path: Путь запроса
+            body: Тело запроса
+            execute: Корутина обработчика, возвращает {'status_code', 'headers', 'body'}
+
+        Returns:
+            {'status_code', 'headers', 'body'}
+        """
+        if not client_key:
+            return await execute()
+        if len(client_key) > MAX_KEY_LENGTH:
+            return _json_result(400, {'error': f'{HEADER} must not exceed {MAX_KEY_LENGTH} characters'})
+
+        key = f'{method} {path} {client_key}'
+        fingerprint = hashlib.sha256(body).hexdigest()
+        await asyncio.to_thread(self._maybe_purge)
+        state, stored = await asyncio.to_thread(self._reserve, key, fingerprint)
+        deadline = time.monotonic() + self.wait_seconds
+        while state == 'busy' and time.monotonic() < deadline:
+            await asyncio.sleep(Config.IDEMPOTENCY_POLL_SECONDS)
+            state, stored = await asyncio.to_thread(self._reserve, key, fingerprint)
+
+        if state == 'done':
+            self._count('replayed')
+            headers = json.loads(stored['headers'] or '{}')
+            headers['Idempotent-Replayed'] = 'true'
+            return {'status_code': stored['status_code'], 'headers': headers, 'body': stored['body']}
+        if state == 'mismatch':
+            self._count('mismatches')
+            return _json_result(422, {'error': f'{HEADER} was already used with a different request'})
+        if state == 'busy':
+            self._count('conflicts')
+            return _json_result(409, {'error': 'A request with this Idempotency-Key is still in progress'})
+
+        try:
+            result = await execute()
+        except BaseException:
+            await asyncio.to_thread(self._release, key)
+            raise
+        self._count('executed')
+        if result['status_code'] >= 500:
+            await asyncio.to_thread(self._release, key)
+        else:
+            await asyncio.to_thread(self._complete, key, result['status_code'], result['headers'], result['body'])
+        return result
+
+
+def _json_result(status_code: int, payload: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        'status_code': status_code,
+        'headers': {'Content-Type': 'application/json'},
+        'body': json.dumps(payload).encode('utf-8')
+    }
@@ -0,0 +1,265 @@
+"""
+Lead Import Module
+Пакетный импорт лидов и потоковая выгрузка в CSV
+
+Запуск из каталога funnel:
+    python -m utils.lead_import import leads.csv --on-conflict update
+    python -m utils.lead_import export leads.csv
+"""
+
+import argparse
+import csv
+import io
+import json
+import sys
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, TextIO
+
+from config import Config
+from database.connection import Database, get_database
+from utils.funnel_stats import FunnelStats, resume_lead_counters, suspend_lead_counters
+from utils.helpers import sanitize_input, validate_email, validate_required_fields
+from utils.lead_query import LeadQuery
+
+
+ON_CONFLICT_SQL = {
+    # Лид с таким email (без учета регистра и пробелов) уже есть - строка пропускается
+    'skip': '''INSERT INTO leads (first_name, email, created_at)
+               VALUES (?, ?, COALESCE(?, CURRENT_TIMESTAMP))
+               ON CONFLICT DO NOTHING''',
+    # Имя существующего лида обновляется
+    'update': '''INSERT INTO leads (first_name, email, created_at)
+                 VALUES (?, ?, COALESCE(?, CURRENT_TIMESTAMP))
+                 ON CONFLICT (lower(trim(email))) DO UPDATE SET first_name = excluded.first_name'''
+}
+
+EXPORT_COLUMNS = [
+    'id', 'first_name', 'email', 'phone', 'website', 'revenue',
+    'appointment_date', 'appointment_time', 'timezone', 'status',
+    'google_event_id', 'confirmation_sent', 'reminder_sent', 'created_at'
+]
+
+# Ячейки, которые табличные редакторы исполняют как формулы
+_FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def read_csv(stream: TextIO) -> Iterator[Dict[str, Any]]:
+    """Строки CSV с заголовком (firstName/first_name, email, created_at)"""
+    return csv.DictReader(stream)
+
+
+def read_ndjson(stream: TextIO) -> Iterator[Dict[str, Any]]:
+    """Строки NDJSON; некорректная строка отдается как пустой словарь и не проходит валидацию"""
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = {}
+        yield row if isinstance(row, dict) else {}
+
+
+def _parse_created_at(value: Any) -> Optional[str]:
+    if not value:
+        return None
+    value = str(value).strip()
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(value, fmt).strftime('%Y-%m-%d %H:%M:%S')
+        except ValueError:
+            continue
+    raise ValueError('Invalid created_at format')
+
+
+class LeadImporter:
+    """Импорт лидов большими транзакциями
+
+    Строки проверяются теми же функциями, что и /api/save-lead, и
+    записываются пачками по batch_size через executemany в одной транзакции
+    на пачку. В памяти держится только текущая пачка, поэтому расход памяти
+    не зависит от размера файла.
+    """
+
+    def __init__(self, database: Database = None, batch_size: int = None, max_errors: int = None):
+        """
+        Инициализация импорта
+
+        Args:
+            database: Слой соединений (по умолчанию - Config.DATABASE_PATH)
+            batch_size: Количество строк в транзакции
+            max_errors: Сколько ошибок валидации возвращать в отчете
+        """
+        self.database = database or get_database()
+        # Таблицы и триггеры счетчиков, которые импорт обновляет пакетно
+        FunnelStats(self.database.db_path)
+        self.batch_size = batch_size or Config.LEAD_IMPORT_BATCH_SIZE
+        self.max_errors = max_errors if max_errors is not None else Config.LEAD_IMPORT_MAX_REPORTED_ERRORS
+
+    @staticmethod
+    def validate(row: Dict[str, Any]) -> List[Any]:
+        """
+        Проверка и очистка строки
+
+        Returns:
+            [first_name, email, created_at]
+
+        Raises:
+            ValueError: строка не прошла проверку
+        """
+        data = row
+        if not row.get('firstName') and row.get('first_name'):
+            data = dict(row, firstName=row['first_name'])
+
+        missing_fields = validate_required_fields(data, 'lead')
+        if missing_fields:
+            raise ValueError(f'Missing required fields: {", ".join(missing_fields)}')
+
+        first_name = sanitize_input(data.get('firstName', ''))
+        email = sanitize_input(data.get('email', ''))
+        if not validate_email(email):
+            raise ValueError('Invalid email format')
+        return [first_name, email, _parse_created_at(data.get('created_at'))]
+
+    def run(self, rows: Iterable[Dict[str, Any]], on_conflict: str = 'skip') -> Dict[str, Any]:
+        """
+        Импорт строк
+
+        Args:
+            rows: Итератор строк (словарей)
+            on_conflict: skip - пропустить существующий email, update - обновить имя
+
+        Returns:
+            Отчет: processed, inserted, updated, skipped, invalid, errors, elapsed_seconds
+        """
+        if on_conflict not in ON_CONFLICT_SQL:
+            raise ValueError(f"Invalid on_conflict policy. Use one of: {', '.join(ON_CONFLICT_SQL)}")
+
+        report = {
+            'processed': 0,
+            'inserted': 0,
+            'updated': 0,
+            'skipped': 0,
+            'invalid': 0,
+            'errors': [],
+            'on_conflict': on_conflict
+        }
+        started = time.monotonic()
+        batch: List[List[Any]] = []
+
+        # Номер строки считается с учетом заголовка CSV
+        for line_number, row in enumerate(rows, start=2):
+            report['processed'] += 1
+            try:
+                batch.append(self.validate(row))
+            except ValueError as e:
+                report['invalid'] += 1
+                if len(report['errors']) < self.max_errors:
+                    report['errors'].append({'row': line_number, 'error': str(e)})
+                continue
+            if len(batch) >= self.batch_size:
+                self._write(batch, on_conflict, report)
+                batch = []
+
+        if batch:
+            self._write(batch, on_conflict, report)
+
+        elapsed = time.monotonic() - started
+        report['elapsed_seconds'] = round(elapsed, 3)
+        report['rows_per_second'] = round(report['processed'] / elapsed) if elapsed > 0 else 0
+        return report
+
+    def _write(self, batch: List[List[Any]], on_conflict: str, report: Dict[str, Any]) -> None:
+        with self.database.transaction(immediate=True) as conn:
+            last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM leads').fetchone()[0]
+            # Счетчики воронки обновляются один раз на пачку, а не триггером на каждую строку
+            suspend_lead_counters(conn)
+            conn.executemany(ON_CONFLICT_SQL[on_conflict], batch)
+            # Новые лиды - это id больше прежнего максимума; остальные строки
+            # пачки либо обновили существующий лид, либо были пропущены
+            inserted = conn.execute('SELECT COUNT(*) FROM leads WHERE id > ?', (last_id,)).fetchone()[0]
+            resume_lead_counters(conn, last_id)
+        report['inserted'] += inserted
+        if on_conflict == 'update':
+            report['updated'] += len(batch) - inserted
+        else:
+            report['skipped'] += len(batch) - inserted
+
+
+def _csv_safe(value: Any) -> Any:
+    if isinstance(value, str) and value.startswith(_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def export_csv(lead_query: LeadQuery, filters: Dict[str, Any] = None,
+               chunk_rows: int = None) -> Iterator[str]:
+    """
+    Потоковая выгрузка лидов в CSV
+
+    Строки читаются порциями по keyset (LeadQuery.iterate) и сразу
+    отдаются блоками по chunk_rows строк.
+
+    Args:
+        lead_query: Выборка лидов
+        filters: Фильтры из parse_filters()
+        chunk_rows: Строк в одном отдаваемом блоке
+
+    Yields:
+        Фрагменты CSV
+    """
+    chunk_rows = chunk_rows or Config.LEADS_STREAM_BATCH_SIZE
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    rows = 0
+    for lead in lead_query.iterate(filters, sort='id', direction='asc'):
+        writer.writerow([_csv_safe(lead[column]) for column in EXPORT_COLUMNS])
+        rows += 1
+        if rows % chunk_rows == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description='Импорт и выгрузка лидов funnel.db')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    import_parser = subparsers.add_parser('import', help='Импорт лидов из CSV или NDJSON')
+    import_parser.add_argument('path', help='Файл (- для stdin)')
+    import_parser.add_argument('--format', choices=('csv', 'ndjson'), default='csv')
+    import_parser.add_argument('--on-conflict', choices=tuple(ON_CONFLICT_SQL), default='skip')
+    import_parser.add_argument('--batch-size', type=int, default=None)
+
+    export_parser = subparsers.add_parser('export', help='Выгрузка лидов в CSV')
+    export_parser.add_argument('path', help='Файл (- для stdout)')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'import':
+        stream = sys.stdin if args.path == '-' else open(args.path, encoding='utf-8-sig', newline='')
+        try:
+            rows = read_csv(stream) if args.format == 'csv' else read_ndjson(stream)
+            report = LeadImporter(batch_size=args.batch_size).run(rows, args.on_conflict)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return 0 if not report['invalid'] else 2
+
+    output = sys.stdout if args.path == '-' else open(args.path, 'w', encoding='utf-8', newline='')
+    try:
+        for chunk in export_csv(LeadQuery()):
+            output.write(chunk)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,254 @@
+"""
+Lead Query Module
+Постраничная (keyset) выборка лидов из funnel.db и потоковая выгрузка
+"""
+
+import base64
+import json
+import sqlite3
+from datetime import datetime, timedelta
+from typing import Any, ContextManager, Dict, Iterator, List, Optional, Tuple
+
+from config import Config
+from database.connection import get_database
+
+
+# Лид с данными последней встречи, записанной на его email
+LEADS_SELECT = '''
+SELECT l.id, l.first_name, l.email,
+       a.phone, a.website, a.revenue,
+       a.appointment_date, a.appointment_time, a.timezone, a.status,
+       a.google_event_id, a.google_event_link,
+       a.confirmation_sent, a.reminder_sent,
+       l.created_at
+FROM leads l
+LEFT JOIN appointments a ON a.id = (
+    SELECT MAX(id) FROM appointments WHERE email = l.email
+)
+'''
+
+# Разрешенные поля сортировки -> SQL выражение (NULL приводится к '' для keyset сравнения)
+SORT_COLUMNS = {
+    'id': 'l.id',
+    'created_at': "COALESCE(l.created_at, '')",
+    'first_name': "COALESCE(l.first_name, '')",
+    'email': "COALESCE(l.email, '')",
+    'appointment_date': "COALESCE(a.appointment_date, '')",
+    'status': "COALESCE(a.status, '')"
+}
+
+# Значение фильтра status для лидов без записи на встречу
+STATUS_NONE = 'none'
+
+
+class InvalidLeadQuery(ValueError):
+    """Некорректные параметры выборки лидов"""
+
+
+def _parse_date(value: str, name: str) -> datetime:
+    try:
+        return datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        raise InvalidLeadQuery(f'Invalid {name} format. Use YYYY-MM-DD')
+
+
+def parse_filters(args) -> Dict[str, Any]:
+    """
+    Разбор фильтров из query string
+
+    Args:
+        args: request.args (created_from, created_to, status, q)
+
+    Returns:
+        Словарь фильтров
+
+    Raises:
+        InvalidLeadQuery: некорректная дата
+    """
+    filters = {}
+    if args.get('created_from'):
+        filters['created_from'] = _parse_date(args['created_from'], 'created_from').strftime('%Y-%m-%d')
+    if args.get('created_to'):
+        # Конец диапазона включительно: created_at < следующий день
+        filters['created_before'] = (
+            _parse_date(args['created_to'], 'created_to') + timedelta(days=1)
+        ).strftime('%Y-%m-%d')
+    if args.get('status'):
+        filters['status'] = args['status'].strip().lower()
+    if args.get('q'):
+        filters['q'] = args['q'].strip()
+    return filters
+
+
+def encode_cursor(sort: str, direction: str, value: Any, lead_id: int) -> str:
+    """Непрозрачный курсор следующей страницы"""
+    raw = json.dumps([sort, direction, value, lead_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str, sort: str, direction: str) -> Tuple[Any, int]:
+    """
+    Разбор курсора
+
+    Raises:
+        InvalidLeadQuery: курсор поврежден или выдан для другой сортировки
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        cursor_sort, cursor_direction, value, lead_id = json.loads(raw)
+    except Exception:
+        raise InvalidLeadQuery('Invalid cursor')
+    if (cursor_sort, cursor_direction) != (sort, direction):
+        raise InvalidLeadQuery('Cursor does not match sort order')
+    return value, int(lead_id)
+
+
+class LeadQuery:
+    """Выборка лидов без загрузки всей таблицы в память
+
+    Страницы выбираются по keyset (значение поля сортировки, id), поэтому
+    стоимость запроса не зависит от номера страницы. iterate() отдает строки
+    порциями по Config.LEADS_STREAM_BATCH_SIZE, открывая короткую транзакцию
+    на каждую порцию, и не держит блокировку чтения, пока клиент читает ответ.
+    """
+
+    def __init__(self, db_path: str = None):
+        """
+        Инициализация выборки
+
+        Args:
+            db_path: Путь к funnel.db
+        """
+        self.db_path = db_path or Config.DATABASE_PATH
+        self.database = get_database(self.db_path)
+
+    def connect(self) -> ContextManager[sqlite3.Connection]:
+        """Транзакция чтения на соединении потока с funnel.db"""
+        return self.database.transaction()
+
+    @staticmethod
+    def normalize_sort(sort: str = None, direction: str = None) -> Tuple[str, str]:
+        """
+        Проверка поля и направления сортировки
+
+        Raises:
+            InvalidLeadQuery: неизвестное поле или направление
+        """
+        sort = sort or 'created_at'
+        direction = (direction or 'desc').lower()
+        if sort not in SORT_COLUMNS:
+            raise InvalidLeadQuery(f"Invalid sort field. Use one of: {', '.join(SORT_COLUMNS)}")
+        if direction not in ('asc', 'desc'):
+            raise InvalidLeadQuery('Invalid sort direction. Use asc or desc')
+        return sort, direction
+
+    def _build(self, filters: Dict[str, Any], sort: str, direction: str,
+               after: Optional[Tuple[Any, int]], limit: int) -> Tuple[str, List[Any]]:
+        where = []
+        params: List[Any] = []
+
+        if 'created_from' in filters:
+            where.append('l.created_at >= ?')
+            params.append(filters['created_from'])
+        if 'created_before' in filters:
+            where.append('l.created_at < ?')
+            params.append(filters['created_before'])
+        if 'status' in filters:
+            if filters['status'] == STATUS_NONE:
+                where.append('a.id IS NULL')
+            else:
+                where.append('LOWER(a.status) = ?')
+                params.append(filters['status'])
+        if 'q' in filters:
+            where.append("(l.email LIKE ? ESCAPE '\\' OR l.first_name LIKE ? ESCAPE '\\')")
+            pattern = '%' + filters['q'].replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            params.extend([pattern, pattern])
+
+        column = SORT_COLUMNS[sort]
+        operator = '<' if direction == 'desc' else '>'
+        if after is not None:
+            where.append(f'({column}, l.id) {operator} (?, ?)')
+            params.extend(after)
+
+        sql = LEADS_SELECT
+        if where:
+            sql += 'WHERE ' + ' AND '.join(where) + '\n'
+        sql += f'ORDER BY {column} {direction.upper()}, l.id {direction.upper()}\nLIMIT ?'
+        params.append(limit)
+        return sql, params
+
+    def _fetch(self, filters: Dict[str, Any], sort: str, direction: str,
+               after: Optional[Tuple[Any, int]], limit: int) -> List[Dict[str, Any]]:
+        sql, params = self._build(filters, sort, direction, after, limit)
+        with self.connect() as conn:
+            cursor = conn.execute(sql, params)
+            return [dict(row) for row in cursor]
+
+    @staticmethod
+    def _sort_value(lead: Dict[str, Any], sort: str) -> Any:
+        # Совпадает с COALESCE(..., '') в SORT_COLUMNS
+        value = lead[sort]
+        return '' if value is None and sort != 'id' else value
+
+    def page(self, filters: Dict[str, Any] = None, cursor: str = None, limit: int = None,
+             sort: str = None, direction: str = None) -> Dict[str, Any]:
+        """
+        Одна страница лидов
+
+        Args:
+            filters: Фильтры из parse_filters()
+            cursor: Курсор из предыдущей страницы
+            limit: Размер страницы (не больше Config.LEADS_MAX_PAGE_SIZE)
+            sort: Поле сортировки (см. SORT_COLUMNS)
+            direction: asc или desc
+
+        Returns:
+            Словарь с лидами и курсором следующей страницы (None на последней)
+
+        Raises:
+            InvalidLeadQuery: некорректные параметры
+        """
+        sort, direction = self.normalize_sort(sort, direction)
+        limit = max(1, min(limit or Config.LEADS_PAGE_SIZE, Config.LEADS_MAX_PAGE_SIZE))
+        after = decode_cursor(cursor, sort, direction) if cursor else None
+
+        # Лишняя строка показывает, есть ли следующая страница
+        leads = self._fetch(filters or {}, sort, direction, after, limit + 1)
+        next_cursor = None
+        if len(leads) > limit:
+            leads = leads[:limit]
+            last = leads[-1]
+            next_cursor = encode_cursor(sort, direction, self._sort_value(last, sort), last['id'])
+
+        return {
+            'leads': leads,
+            'next_cursor': next_cursor,
+            'limit': limit,
+            'sort': sort,
+            'direction': direction
+        }
+
+    def iterate(self, filters: Dict[str, Any] = None, sort: str = None, direction: str = None,
+                batch_size: int = None) -> Iterator[Dict[str, Any]]:
+        """
+        Все лиды по фильтрам, порциями по keyset
+
+        Args:
+            filters: Фильтры из parse_filters()
+            sort: Поле сортировки
+            direction: asc или desc
+            batch_size: Размер порции (по умолчанию Config.LEADS_STREAM_BATCH_SIZE)
+
+        Yields:
+            Лид (словарь)
+        """
+        sort, direction = self.normalize_sort(sort, direction)
+        batch_size = batch_size or Config.LEADS_STREAM_BATCH_SIZE
+        after = None
+        while True:
+            leads = self._fetch(filters or {}, sort, direction, after, batch_size)
+            yield from leads
+            if len(leads) < batch_size:
+                return
+            last = leads[-1]
+            after = (self._sort_value(last, sort), last['id'])
@@ -0,0 +1,107 @@
+"""
+Leader Module
+Выбор одного процесса среди воркеров для фоновых задач, которые должны работать в единственном экземпляре
+"""
+
+import os
+import threading
+from typing import Callable, Optional
+
+from config import Config
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+class LeaderElection:
+    """Лидер - процесс, удерживающий неблокирующий flock на lock-файле
+
+    Блокировка принадлежит открытому файлу, поэтому ОС снимает ее, когда
+    процесс лидера завершается (перезапуск по max_requests, падение, деплой).
+    Остальные процессы раз в Config.LEADER_POLL_SECONDS пытаются взять ее и
+    вызывают on_elected в том процессе, которому это удалось.
+    """
+
+    def __init__(self, on_elected: Callable[[], None], path: str = None, poll_seconds: float = None):
+        """
+        Инициализация
+
+        Args:
+            on_elected: Вызывается один раз, когда процесс становится лидером
+            path: Путь к lock-файлу
+            poll_seconds: Интервал попыток стать лидером
+        """
+        self.on_elected = on_elected
+        self.path = path or Config.LEADER_LOCK_PATH
+        self.poll_seconds = poll_seconds or Config.LEADER_POLL_SECONDS
+        self.is_leader = False
+        self._file = None
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def try_acquire(self) -> bool:
+        """
+        Попытка стать лидером без ожидания
+
+        Returns:
+            True, если процесс является лидером
+        """
+        if self.is_leader:
+            return True
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        lock_file = open(self.path, 'a+b')
+        try:
+            if fcntl:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            lock_file.close()
+            return False
+        # Для диагностики: какой процесс сейчас лидер
+        lock_file.truncate(0)
+        lock_file.write(str(os.getpid()).encode('ascii'))
+        lock_file.flush()
+        self._file = lock_file
+        self.is_leader = True
+        print(f"Процесс {os.getpid()} выбран лидером фоновых задач")
+        return True
+
+    def start(self) -> None:
+        """Попытка стать лидером сейчас и, при неудаче, в фоновом потоке"""
+        if self.try_acquire():
+            self.on_elected()
+            return
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='leader-election', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5) -> None:
+        """Остановка попыток и освобождение блокировки"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout)
+        if self._file:
+            self._file.close()
+            self._file = None
+        self.is_leader = False
+
+    def _run(self) -> None:
+        while not self._stop_event.wait(self.poll_seconds):
+            try:
+                elected = self.try_acquire()
+            except Exception as e:
+                print(f"Ошибка выбора лидера: {e}")
+                continue
+            if elected:
+                if not self._stop_event.is_set():
+                    self.on_elected()
+                return
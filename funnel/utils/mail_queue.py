@@ -0,0 +1,467 @@
+"""
+Mail Queue Module
+Пул SMTP соединений и фоновая очередь доставки писем в таблице funnel.db
+"""
+
+import smtplib
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from email import message_from_bytes, policy
+from email.message import EmailMessage
+from typing import Any, ContextManager, Dict, Iterator, List, Optional
+
+from config import Config
+from database.connection import get_database
+from utils.metrics import metrics
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS mail_queue (
+    id TEXT PRIMARY KEY,
+    recipient TEXT,
+    subject TEXT,
+    message BLOB,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL DEFAULT 0,
+    locked_until REAL,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_mail_queue_status
+    ON mail_queue (status, next_attempt_at);
+'''
+
+# Статусы писем, которые еще ждут отправки
+WAITING_STATUSES = ('queued', 'retrying')
+
+# Письма, которые занимают место в очереди: ждут отправки или release() (held)
+PENDING_STATUSES = WAITING_STATUSES + ('held',)
+
+
+# Ошибки отдельного письма, после которых соединение остается рабочим
+MESSAGE_REJECTED_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError)
+
+
+class MailQueueFull(Exception):
+    """Очередь доставки заполнена - клиенту нужно повторить запрос позже"""
+
+
+class SMTPConnectionPool:
+    """Ограниченный пул авторизованных SMTP соединений
+
+    Соединение открывается (TCP + STARTTLS + AUTH) один раз и переиспользуется.
+    Соединение, простоявшее дольше idle_seconds, проверяется командой NOOP и
+    переоткрывается, если сервер его уже закрыл.
+    """
+
+    def __init__(self, size: int = None, idle_seconds: int = None, timeout: int = None):
+        """
+        Инициализация пула
+
+        Args:
+            size: Максимальное количество одновременно открытых соединений
+            idle_seconds: Время простоя, после которого соединение проверяется
+            timeout: Таймаут сокета SMTP в секундах
+        """
+        self.size = size or Config.SMTP_POOL_SIZE
+        self.idle_seconds = idle_seconds if idle_seconds is not None else Config.SMTP_POOL_IDLE_SECONDS
+        self.timeout = timeout or Config.SMTP_TIMEOUT_SECONDS
+        self._idle: List[Any] = []  # [(smtp, released_at)]
+        self._open = 0
+        self._condition = threading.Condition()
+        self.connects = 0
+        self.reuses = 0
+
+    def _connect(self) -> smtplib.SMTP:
+        with metrics.timed('smtp', 'connect'):
+            smtp = smtplib.SMTP(Config.SMTP_SERVER, Config.SMTP_PORT, timeout=self.timeout)
+            smtp.ehlo()
+            if Config.USE_TLS:
+                smtp.starttls()
+                smtp.ehlo()
+            smtp.login(Config.SENDER_EMAIL, Config.SENDER_PASSWORD)
+        self.connects += 1
+        return smtp
+
+    @staticmethod
+    def _is_alive(smtp: smtplib.SMTP) -> bool:
+        try:
+            return smtp.noop()[0] == 250
+        except smtplib.SMTPException:
+            return False
+        except OSError:
+            return False
+
+    @staticmethod
+    def _close(smtp: smtplib.SMTP) -> None:
+        try:
+            smtp.quit()
+        except Exception:
+            try:
+                smtp.close()
+            except Exception:
+                pass
+
+    @contextmanager
+    def connection(self) -> Iterator[smtplib.SMTP]:
+        """
+        Получение соединения из пула
+
+        Если при работе с соединением возникла ошибка, оно закрывается, а не
+        возвращается в пул. Отказ сервера принять конкретное письмо соединение
+        не ломает (smtplib сам выполняет RSET).
+        """
+        smtp = self._acquire()
+        try:
+            yield smtp
+        except MESSAGE_REJECTED_ERRORS:
+            self._release(smtp)
+            raise
+        except Exception:
+            self._release(smtp, broken=True)
+            raise
+        else:
+            self._release(smtp)
+
+    def _acquire(self) -> smtplib.SMTP:
+        with self._condition:
+            while True:
+                if self._idle:
+                    smtp, released_at = self._idle.pop()
+                    break
+                if self._open < self.size:
+                    self._open += 1
+                    smtp = None
+                    break
+                self._condition.wait()
+
+        if smtp is not None:
+            if time.monotonic() - released_at < self.idle_seconds or self._is_alive(smtp):
+                self.reuses += 1
+                return smtp
+            # Сервер закрыл простаивающее соединение
+            self._close(smtp)
+
+        try:
+            return self._connect()
+        except Exception:
+            with self._condition:
+                self._open -= 1
+                self._condition.notify()
+            raise
+
+    def _release(self, smtp: smtplib.SMTP, broken: bool = False) -> None:
+        if broken:
+            self._close(smtp)
+        with self._condition:
+            if broken:
+                self._open -= 1
+            else:
+                self._idle.append((smtp, time.monotonic()))
+            self._condition.notify()
+
+    def close_all(self) -> None:
+        """Закрытие всех простаивающих соединений"""
+        with self._condition:
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+            self._condition.notify_all()
+        for smtp, _ in idle:
+            self._close(smtp)
+
+    def stats(self) -> Dict[str, int]:
+        """Состояние пула"""
+        with self._condition:
+            return {
+                'size': self.size,
+                'open': self._open,
+                'idle': len(self._idle),
+                'connects': self.connects,
+                'reuses': self.reuses
+            }
+
+
+class MailQueue:
+    """Фоновая очередь доставки писем в таблице mail_queue (funnel.db)
+
+    enqueue() только записывает письмо в таблицу и возвращает ID; если
+    неотправленных писем уже Config.MAIL_QUEUE_MAX_SIZE, выбрасывается
+    MailQueueFull (backpressure) без записи в таблицу. Потоки отправки есть в каждом процессе и
+    атомарно захватывают строки (status = 'sending' с арендой до
+    locked_until), поэтому письмо отправляет один процесс, а письма
+    остановленного процесса доотправляют другие. Временные ошибки
+    повторяются с экспоненциальной паузой; статус письма по ID читается из
+    таблицы и доступен из любого воркера.
+    """
+
+    def __init__(self, pool: SMTPConnectionPool = None, maxsize: int = None, workers: int = None,
+                 db_path: str = None):
+        """
+        Инициализация очереди
+
+        Args:
+            pool: Пул SMTP соединений
+            maxsize: Максимальное количество неотправленных писем
+            workers: Количество потоков отправки
+            db_path: Путь к funnel.db
+        """
+        self.pool = pool or SMTPConnectionPool()
+        self.workers = workers or self.pool.size
+        self.maxsize = maxsize or Config.MAIL_QUEUE_MAX_SIZE
+        self._lock = threading.Lock()
+        self._wake_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._next_purge = 0.0
+        self.counters = {'enqueued': 0, 'sent': 0, 'failed': 0, 'retried': 0, 'rejected': 0}
+
+        self.database = get_database(db_path or Config.DATABASE_PATH)
+        self.database.executescript(SCHEMA)
+
+    def connect(self, immediate: bool = False) -> ContextManager[sqlite3.Connection]:
+        """Транзакция на соединении потока с funnel.db: commit при успехе, rollback при ошибке"""
+        return self.database.transaction(immediate)
+
+    def start(self) -> None:
+        """Запуск потоков отправки"""
+        if any(thread.is_alive() for thread in self._threads):
+            return
+        self._stop_event.clear()
+        self._threads = [
+            threading.Thread(target=self._run, name=f'mail-queue-{index}', daemon=True)
+            for index in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout: float = 5) -> None:
+        """Остановка потоков; неотправленные письма остаются в таблице"""
+        self._stop_event.set()
+        self._wake_event.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self.pool.close_all()
+
+    def enqueue(self, message: EmailMessage, held: bool = False) -> str:
+        """
+        Постановка письма в очередь
+
+        Args:
+            message: Письмо
+            held: Не отправлять до release() (discard() удаляет письмо)
+
+        Returns:
+            ID письма для проверки статуса
+
+        Raises:
+            MailQueueFull: очередь заполнена
+        """
+        # Переполнение проверяется обычным чтением: отказ не пишет в базу,
+        # которую backpressure и защищает (граница мягкая на число одновременных enqueue)
+        with self.connect() as conn:
+            waiting = conn.execute(
+                f'''SELECT COUNT(*) FROM mail_queue
+                    WHERE status IN ({', '.join('?' for _ in PENDING_STATUSES)})''',
+                PENDING_STATUSES
+            ).fetchone()[0]
+        if waiting >= self.maxsize:
+            self._count('rejected')
+            raise MailQueueFull('Очередь писем заполнена')
+
+        message_id = uuid.uuid4().hex
+        now = time.time()
+        with self.connect() as conn:
+            conn.execute(
+                '''INSERT INTO mail_queue (id, recipient, subject, message, status, created_at, updated_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                (message_id, message['To'], message['Subject'], message.as_bytes(),
+                 'held' if held else 'queued', now, now)
+            )
+        self._count('enqueued')
+        if not held:
+            self._wake_event.set()
+        return message_id
+
+    def release(self, message_id: str) -> bool:
+        """Разрешение отправки письма, поставленного с held=True"""
+        with self.connect() as conn:
+            released = conn.execute(
+                "UPDATE mail_queue SET status = 'queued', updated_at = ? WHERE id = ? AND status = 'held'",
+                (time.time(), message_id)
+            ).rowcount
+        if released:
+            self._wake_event.set()
+        return bool(released)
+
+    def discard(self, message_id: str) -> bool:
+        """Удаление письма, поставленного с held=True, без отправки"""
+        with self.connect() as conn:
+            return bool(conn.execute(
+                "DELETE FROM mail_queue WHERE id = ? AND status = 'held'", (message_id,)
+            ).rowcount)
+
+    def status(self, message_id: str) -> Optional[Dict[str, Any]]:
+        """Статус письма по ID"""
+        with self.connect() as conn:
+            row = conn.execute(
+                '''SELECT id, recipient, subject, status, attempts, next_attempt_at, last_error, updated_at
+                   FROM mail_queue WHERE id = ?''',
+                (message_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        status = {
+            'id': row['id'],
+            'to': row['recipient'],
+            'subject': row['subject'],
+            'status': row['status'],
+            'attempts': row['attempts'],
+            'error': row['last_error'],
+            'updated_at': row['updated_at']
+        }
+        if row['status'] == 'retrying':
+            status['retry_in'] = max(0.0, round(row['next_attempt_at'] - time.time(), 1))
+        return status
+
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики этого процесса, письма по статусам во всей очереди и состояние пула"""
+        with self._lock:
+            counters = dict(self.counters)
+        with self.connect() as conn:
+            statuses = {
+                row['status']: row['count']
+                for row in conn.execute('SELECT status, COUNT(*) AS count FROM mail_queue GROUP BY status')
+            }
+        queued = sum(statuses.get(status, 0) for status in WAITING_STATUSES)
+        return dict(counters, queued=queued, statuses=statuses, pool=self.pool.stats())
+
+    def _run(self) -> None:
+        while not self._stop_event.is_set():
+            try:
+                row = self._claim()
+            except sqlite3.Error as e:
+                print(f"Ошибка чтения очереди писем: {e}")
+                row = None
+
+            if row is None:
+                self._maybe_purge()
+                # Письма других процессов видны не позже чем через MAIL_QUEUE_POLL_SECONDS
+                self._wake_event.wait(Config.MAIL_QUEUE_POLL_SECONDS)
+                self._wake_event.clear()
+                continue
+
+            self._deliver(row)
+
+    def _claim(self) -> Optional[sqlite3.Row]:
+        """
+        Атомарный захват следующего готового к отправке письма
+
+        Готовые письма ищутся обычным чтением; транзакция BEGIN IMMEDIATE
+        (блокировка записи, нужная и сохранению лидов и встреч) берется, только
+        если они есть. UPDATE повторяет условие готовности, поэтому письмо,
+        захваченное другим потоком или процессом между чтением и записью,
+        пропускается.
+        """
+        now = time.time()
+        ready = f'''((status IN ({', '.join('?' for _ in WAITING_STATUSES)}) AND next_attempt_at <= ?)
+                    OR (status = 'sending' AND locked_until < ?))'''
+        with self.connect() as conn:
+            candidates = [
+                row['id'] for row in conn.execute(
+                    f'SELECT id FROM mail_queue WHERE {ready} ORDER BY next_attempt_at LIMIT ?',
+                    WAITING_STATUSES + (now, now, self.workers)
+                )
+            ]
+        if not candidates:
+            return None
+
+        with self.connect(immediate=True) as conn:
+            for message_id in candidates:
+                claimed = conn.execute(
+                    f'''UPDATE mail_queue
+                        SET status = 'sending', attempts = attempts + 1, locked_until = ?, updated_at = ?
+                        WHERE id = ? AND {ready}''',
+                    (now + Config.MAIL_QUEUE_LEASE_SECONDS, now, message_id) + WAITING_STATUSES + (now, now)
+                ).rowcount
+                if claimed:
+                    return conn.execute(
+                        'SELECT id, message, attempts FROM mail_queue WHERE id = ?',
+                        (message_id,)
+                    ).fetchone()
+        return None
+
+    def _maybe_purge(self) -> None:
+        """Удаление старых отправленных, брошенных и не отпущенных писем (не чаще раза в минуту на процесс)"""
+        now = time.time()
+        with self._lock:
+            if now < self._next_purge:
+                return
+            self._next_purge = now + 60
+        cutoff = now - Config.MAIL_QUEUE_RETENTION_SECONDS
+        try:
+            with self.connect() as conn:
+                expired = conn.execute(
+                    "SELECT 1 FROM mail_queue WHERE status IN ('sent', 'failed', 'held') AND updated_at < ? LIMIT 1",
+                    (cutoff,)
+                ).fetchone()
+            if expired:
+                with self.connect() as conn:
+                    conn.execute(
+                        # held старше срока хранения - письмо процесса, упавшего до release()
+                        "DELETE FROM mail_queue WHERE status IN ('sent', 'failed', 'held') AND updated_at < ?",
+                        (cutoff,)
+                    )
+        except sqlite3.Error as e:
+            print(f"Ошибка очистки очереди писем: {e}")
+
+    def _deliver(self, row: sqlite3.Row) -> None:
+        message_id = row['id']
+        attempts = row['attempts']  # уже с учетом этой попытки
+        try:
+            message = message_from_bytes(row['message'], policy=policy.default)
+            with self.pool.connection() as smtp, metrics.timed('smtp', 'send'):
+                smtp.send_message(message)
+        except Exception as e:
+            if self._is_permanent(e) or attempts >= Config.MAIL_QUEUE_MAX_ATTEMPTS:
+                self._finish(message_id, 'failed', error=str(e))
+                self._count('failed')
+                print(f"Письмо {message_id} не доставлено: {e}")
+                return
+
+            delay = Config.MAIL_QUEUE_RETRY_BASE_SECONDS * (2 ** (attempts - 1))
+            self._finish(message_id, 'retrying', error=str(e), delay=delay)
+            self._count('retried')
+            return
+
+        self._finish(message_id, 'sent')
+        self._count('sent')
+
+    def _finish(self, message_id: str, status: str, error: str = None, delay: float = 0) -> None:
+        now = time.time()
+        with self.connect() as conn:
+            # Тело отправленного или брошенного письма больше не нужно
+            conn.execute(
+                '''UPDATE mail_queue
+                   SET status = ?, last_error = ?, next_attempt_at = ?, locked_until = NULL, updated_at = ?,
+                       message = CASE WHEN ? = 'retrying' THEN message END
+                   WHERE id = ?''',
+                (status, error, now + delay, now, status, message_id)
+            )
+
+    @staticmethod
+    def _is_permanent(error: Exception) -> bool:
+        """5xx ответ SMTP сервера (кроме разрыва соединения) повторять бессмысленно"""
+        if isinstance(error, smtplib.SMTPRecipientsRefused):
+            return all(code >= 500 for code, _ in error.recipients.values())
+        if isinstance(error, smtplib.SMTPResponseException):
+            return error.smtp_code >= 500
+        return False
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self.counters[name] += 1
@@ -0,0 +1,325 @@
+"""
+Metrics Module
+Счетчики, гистограммы задержек и gauge в формате Prometheus, общие для всех воркеров
+"""
+
+import atexit
+import bisect
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Sequence, Tuple
+
+from config import Config
+from database.connection import get_database
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS metrics_snapshots (
+    process TEXT PRIMARY KEY,
+    pid INTEGER NOT NULL,
+    payload TEXT NOT NULL,
+    updated_at REAL NOT NULL
+) WITHOUT ROWID;
+'''
+
+# Имя -> (тип, описание, имена меток)
+METRICS: Dict[str, Tuple[str, str, Tuple[str, ...]]] = {
+    'funnel_http_requests_total': (
+        'counter', 'HTTP requests handled', ('method', 'route', 'status')
+    ),
+    'funnel_http_request_duration_seconds': (
+        'histogram', 'HTTP request latency', ('method', 'route', 'status')
+    ),
+    'funnel_http_requests_in_flight': (
+        'gauge', 'HTTP requests being handled', ()
+    ),
+    'funnel_outbound_request_duration_seconds': (
+        'histogram', 'Latency of calls to external services', ('service', 'operation', 'outcome')
+    ),
+    'funnel_rate_limited_total': (
+        'counter', 'Requests rejected by the rate limiter', ('route', 'key')
+    ),
+}
+
+Labels = Tuple[str, ...]
+Series = Dict[Tuple[str, Labels], List[float]]
+
+# Строка metrics_snapshots с накопленными счетчиками завершившихся процессов
+RETIRED_PROCESS = 'retired'
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+class Metrics:
+    """Метрики процесса с агрегацией по всем воркерам через funnel.db
+
+    Запись метрики не берет блокировок: у каждого потока свой шард (словарь
+    серий), который изменяет только этот поток. Фоновый поток раз в
+    Config.METRICS_FLUSH_SECONDS объединяет шарды и сохраняет снимок процесса
+    в metrics_snapshots; /metrics складывает снимки всех процессов. Gauge
+    процессов, которые перестали присылать снимки, не учитываются.
+    """
+
+    def __init__(self, db_path: str = None, flush_seconds: float = None, buckets: Sequence[float] = None):
+        """
+        Инициализация метрик
+
+        Args:
+            db_path: Путь к funnel.db
+            flush_seconds: Интервал сохранения снимка процесса
+            buckets: Границы корзин гистограмм в секундах
+        """
+        self.db_path = db_path or Config.DATABASE_PATH
+        self.flush_seconds = flush_seconds or Config.METRICS_FLUSH_SECONDS
+        self.buckets = tuple(sorted(buckets or Config.METRICS_BUCKETS))
+        self._schema_ready = False
+        self._reset()
+        os.register_at_fork(after_in_child=self._reset)
+        atexit.register(self._flush_at_exit)
+
+    def _reset(self) -> None:
+        """Начальное состояние процесса (также после fork - счетчики родителя не наследуются)"""
+        self._local = threading.local()
+        self._shards: List[Tuple[threading.Thread, Series]] = []
+        self._retired: Series = {}
+        self._process = f'{os.getpid()}-{uuid.uuid4().hex[:8]}'
+        self._flusher = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    # ------------------------------------------------------------------
+    # Запись
+    # ------------------------------------------------------------------
+
+    def _shard(self) -> Series:
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+                if self._flusher is None:
+                    self._start_flusher()
+        return shard
+
+    def inc(self, name: str, labels: Labels = (), value: float = 1) -> None:
+        """Увеличение счетчика или gauge (отрицательное value уменьшает gauge)"""
+        shard = self._shard()
+        series = shard.get((name, labels))
+        if series is None:
+            series = shard[(name, labels)] = [0]
+        series[0] += value
+
+    def observe(self, name: str, labels: Labels, value: float) -> None:
+        """Наблюдение гистограммы: [корзины..., +Inf, сумма]"""
+        shard = self._shard()
+        series = shard.get((name, labels))
+        if series is None:
+            series = shard[(name, labels)] = [0] * (len(self.buckets) + 2)
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    @contextmanager
+    def timed(self, service: str, operation: str) -> Iterator[None]:
+        """
+        Замер вызова внешнего сервиса
+
+        Args:
+            service: Сервис (smtp, google_calendar)
+            operation: Операция
+        """
+        started = time.perf_counter()
+        outcome = 'error'
+        try:
+            yield
+            outcome = 'ok'
+        finally:
+            self.observe_outbound(service, operation, outcome, time.perf_counter() - started)
+
+    def observe_outbound(self, service: str, operation: str, outcome: str, seconds: float) -> None:
+        """Запись длительности вызова внешнего сервиса"""
+        self.observe('funnel_outbound_request_duration_seconds', (service, operation, outcome), seconds)
+
+    # ------------------------------------------------------------------
+    # Агрегация
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _merge(target: Series, source: Series) -> None:
+        for key, values in source.items():
+            current = target.get(key)
+            if current is None:
+                target[key] = list(values)
+            else:
+                for index, value in enumerate(values):
+                    current[index] += value
+
+    def snapshot(self) -> Series:
+        """Сумма шардов всех потоков процесса"""
+        with self._lock:
+            alive = []
+            for thread, shard in self._shards:
+                if thread.is_alive():
+                    alive.append((thread, shard))
+                else:
+                    # Шард завершившегося потока больше не меняется - переносим его в общий
+                    self._merge(self._retired, shard)
+            self._shards = alive
+            merged: Series = {}
+            self._merge(merged, self._retired)
+            for _, shard in alive:
+                # Копия словаря делается целиком под GIL; поток-владелец может продолжать запись
+                self._merge(merged, dict(shard))
+        return merged
+
+    def _ensure_schema(self) -> None:
+        if not self._schema_ready:
+            get_database(self.db_path).executescript(SCHEMA)
+            self._schema_ready = True
+
+    @staticmethod
+    def _encode(series: Series) -> str:
+        return json.dumps([[name, list(labels), values] for (name, labels), values in series.items()])
+
+    @staticmethod
+    def _decode(payload: str, gauges: bool = True) -> Series:
+        series = {}
+        for name, labels, values in json.loads(payload):
+            if name not in METRICS:
+                continue
+            if METRICS[name][0] == 'gauge' and not gauges:
+                continue
+            series[(name, tuple(labels))] = values
+        return series
+
+    def flush(self) -> None:
+        """Сохранение снимка процесса в metrics_snapshots"""
+        self._ensure_schema()
+        payload = self._encode(self.snapshot())
+        with get_database(self.db_path).transaction() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO metrics_snapshots (process, pid, payload, updated_at) VALUES (?, ?, ?, ?)',
+                (self._process, os.getpid(), payload, time.time())
+            )
+
+    def collect(self) -> Dict[str, Any]:
+        """
+        Метрики всех процессов
+
+        Снимки процессов, молчащих дольше Config.METRICS_RETENTION_SECONDS,
+        прибавляются к строке RETIRED_PROCESS и только потом удаляются, поэтому
+        счетчики в сумме не уменьшаются (для Prometheus это выглядело бы как
+        сброс счетчика).
+
+        Returns:
+            {'processes': число живых процессов, 'series': {(имя, метки): значения}}
+        """
+        self.flush()
+        now = time.time()
+        with get_database(self.db_path).transaction(immediate=True) as conn:
+            expired = conn.execute(
+                'SELECT process, payload FROM metrics_snapshots WHERE updated_at < ? AND process != ?',
+                (now - Config.METRICS_RETENTION_SECONDS, RETIRED_PROCESS)
+            ).fetchall()
+            if expired:
+                row = conn.execute(
+                    'SELECT payload FROM metrics_snapshots WHERE process = ?', (RETIRED_PROCESS,)
+                ).fetchone()
+                retired = self._decode(row['payload']) if row else {}
+                for row in expired:
+                    self._merge(retired, self._decode(row['payload'], gauges=False))
+                conn.execute(
+                    'INSERT OR REPLACE INTO metrics_snapshots (process, pid, payload, updated_at) VALUES (?, 0, ?, ?)',
+                    (RETIRED_PROCESS, self._encode(retired), now)
+                )
+                conn.executemany(
+                    'DELETE FROM metrics_snapshots WHERE process = ?', [(row['process'],) for row in expired]
+                )
+            rows = conn.execute('SELECT process, payload, updated_at FROM metrics_snapshots').fetchall()
+
+        stale_before = now - Config.METRICS_STALE_SECONDS
+        total: Series = {}
+        processes = 0
+        for row in rows:
+            live = row['process'] != RETIRED_PROCESS and row['updated_at'] >= stale_before
+            processes += live
+            self._merge(total, self._decode(row['payload'], gauges=live))
+        return {'processes': processes, 'series': total}
+
+    def render(self) -> str:
+        """Все метрики в текстовом формате Prometheus (version 0.0.4)"""
+        collected = self.collect()
+        by_name: Dict[str, List[Tuple[Labels, List[float]]]] = {}
+        for (name, labels), values in sorted(collected['series'].items()):
+            by_name.setdefault(name, []).append((labels, values))
+
+        lines = [
+            '# HELP funnel_metrics_processes Worker processes that reported metrics recently',
+            '# TYPE funnel_metrics_processes gauge',
+            f"funnel_metrics_processes {collected['processes']}"
+        ]
+        for name, (kind, description, label_names) in METRICS.items():
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, values in by_name.get(name, []):
+                if kind != 'histogram':
+                    lines.append(f'{name}{_format_labels(label_names, labels)} {_format_value(values[0])}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float('inf'),), values[:-1]):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else _format_value(bound)
+                    bucket_labels = _format_labels(label_names, labels, f'le="{le}"')
+                    lines.append(f'{name}_bucket{bucket_labels} {int(cumulative)}')
+                lines.append(f'{name}_sum{_format_labels(label_names, labels)} {_format_value(values[-1])}')
+                lines.append(f'{name}_count{_format_labels(label_names, labels)} {int(cumulative)}')
+        return '\n'.join(lines) + '\n'
+
+    # ------------------------------------------------------------------
+    # Фоновое сохранение
+    # ------------------------------------------------------------------
+
+    def _start_flusher(self) -> None:
+        self._flusher = threading.Thread(target=self._run, name='metrics-flusher', daemon=True)
+        self._flusher.start()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.flush_seconds):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Ошибка сохранения метрик: {e}")
+
+    def _flush_at_exit(self) -> None:
+        if self._shards or self._retired:
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Ошибка сохранения метрик: {e}")
+
+    def stop(self) -> None:
+        """Остановка фонового сохранения и запись последнего снимка"""
+        self._stop.set()
+        self._flush_at_exit()
+
+
+# Метрики процесса
+metrics = Metrics()
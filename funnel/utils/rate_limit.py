@@ -0,0 +1,295 @@
+"""
+Rate Limit Module
+Token bucket по IP и email для эндпоинтов форм: в памяти процесса или общий для воркеров в SQLite
+"""
+
+import ipaddress
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple
+
+from config import Config
+from database.connection import get_database
+from utils.metrics import metrics
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+    key TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    expires_at REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_rate_limit_buckets_expires ON rate_limit_buckets (expires_at);
+'''
+
+# Быстрый путь: email ищется в сыром теле запроса без разбора JSON
+EMAIL_PATTERN = re.compile(rb'"email"\s*:\s*"([^"\\]{1,254})"')
+
+KEY_KINDS = ('ip', 'email')
+
+
+def email_from_body(body: bytes) -> Optional[str]:
+    """
+    Email из JSON тела запроса
+
+    Регулярному выражению верим, только если в первых
+    Config.RATE_LIMIT_MAX_BODY_BYTES байтах ровно одно совпадение и в теле нет
+    escape-последовательностей. Иначе (ключ записан через \\u, email дальше
+    лимита, несколько ключей email) тело разбирается json.loads - тем же
+    способом, что и в обработчике, чтобы лимит нельзя было обойти.
+
+    Args:
+        body: Сырое тело запроса
+
+    Returns:
+        Email в нижнем регистре или None
+    """
+    matches = EMAIL_PATTERN.findall(body, 0, Config.RATE_LIMIT_MAX_BODY_BYTES)
+    if len(matches) == 1 and b'\\' not in body and len(body) <= Config.RATE_LIMIT_MAX_BODY_BYTES:
+        email = matches[0].decode('utf-8', 'replace')
+    else:
+        try:
+            data = json.loads(body)
+        except (ValueError, RecursionError):
+            return None
+        email = data.get('email') if isinstance(data, dict) else None
+        if not isinstance(email, str):
+            return None
+    return email.strip().lower() or None
+
+
+def client_ip(remote_addr: Optional[str], headers: Mapping[str, str]) -> Optional[str]:
+    """
+    IP клиента с учетом заголовка доверенного прокси
+
+    Если задан Config.RATE_LIMIT_PROXY_HEADER (например X-Forwarded-For),
+    берется последний адрес из заголовка - его добавил наш прокси. Без
+    заголовка за локальным прокси (nginx на 127.0.0.1) все клиенты имели бы
+    один адрес и делили одну корзину, поэтому для loopback возвращается None
+    и ограничение по IP не применяется.
+    """
+    if Config.RATE_LIMIT_PROXY_HEADER:
+        forwarded = headers.get(Config.RATE_LIMIT_PROXY_HEADER)
+        if forwarded:
+            return forwarded.rsplit(',', 1)[-1].strip()
+    if not remote_addr or _is_loopback(remote_addr):
+        return None
+    return remote_addr
+
+
+def _is_loopback(address: str) -> bool:
+    try:
+        return ipaddress.ip_address(address).is_loopback
+    except ValueError:
+        return False
+
+
+def _refill(tokens: float, updated_at: float, now: float, capacity: float, rate: float) -> float:
+    return min(capacity, tokens + max(now - updated_at, 0) * rate)
+
+
+class MemoryBuckets:
+    """Корзины в памяти процесса (LRU по количеству ключей)"""
+
+    shared = False
+
+    def __init__(self, max_keys: int = None):
+        self.max_keys = max_keys or Config.RATE_LIMIT_MAX_KEYS
+        self._buckets: 'OrderedDict[str, List[float]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def take(self, key: str, capacity: float, rate: float, now: float) -> Tuple[bool, float]:
+        """
+        Взять токен из корзины
+
+        Returns:
+            (разрешено, остаток токенов)
+        """
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = [capacity, now]
+                self._buckets[key] = bucket
+                while len(self._buckets) > self.max_keys:
+                    # Вытесненный ключ начнет с полной корзины
+                    self._buckets.popitem(last=False)
+                    self.evictions += 1
+            else:
+                self._buckets.move_to_end(key)
+            tokens = _refill(bucket[0], bucket[1], now, capacity, rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            bucket[0], bucket[1] = tokens, now
+            return allowed, tokens
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'backend': 'memory', 'keys': len(self._buckets), 'evictions': self.evictions}
+
+
+class SQLiteBuckets:
+    """Корзины в funnel.db (rate_limit_buckets), общие для всех воркеров
+
+    Каждая проверка - короткая транзакция BEGIN IMMEDIATE. Строка удаляется,
+    когда корзина заполнилась бы снова (expires_at).
+    """
+
+    shared = True
+
+    def __init__(self, db_path: str = None):
+        self.database = get_database(db_path or Config.DATABASE_PATH)
+        self.database.executescript(SCHEMA)
+        self._next_purge = 0.0
+
+    def take(self, key: str, capacity: float, rate: float, now: float) -> Tuple[bool, float]:
+        """
+        Взять токен из корзины
+
+        Returns:
+            (разрешено, остаток токенов)
+        """
+        self._maybe_purge(now)
+        with self.database.transaction(immediate=True) as conn:
+            row = conn.execute(
+                'SELECT tokens, updated_at FROM rate_limit_buckets WHERE key = ?', (key,)
+            ).fetchone()
+            tokens = capacity if row is None else _refill(row[0], row[1], now, capacity, rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            conn.execute(
+                '''INSERT OR REPLACE INTO rate_limit_buckets (key, tokens, updated_at, expires_at)
+                   VALUES (?, ?, ?, ?)''',
+                (key, tokens, now, now + (capacity - tokens) / rate)
+            )
+        return allowed, tokens
+
+    def purge(self, now: float = None) -> int:
+        """Удаление заполнившихся корзин"""
+        with self.database.transaction() as conn:
+            return conn.execute(
+                'DELETE FROM rate_limit_buckets WHERE expires_at <= ?', (now or time.time(),)
+            ).rowcount
+
+    def _maybe_purge(self, now: float) -> None:
+        if now < self._next_purge:
+            return
+        self._next_purge = now + Config.RATE_LIMIT_PURGE_INTERVAL_SECONDS
+        try:
+            self.purge(now)
+        except Exception as e:
+            print(f"Ошибка очистки rate_limit_buckets: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self.database.transaction() as conn:
+            keys = conn.execute('SELECT COUNT(*) FROM rate_limit_buckets').fetchone()[0]
+        return {'backend': 'sqlite', 'keys': keys}
+
+
+class RateLimiter:
+    """Token bucket по IP и по email для POST эндпоинтов форм
+
+    Лимиты задаются в Config.RATE_LIMITS: путь -> {'ip'|'email': (burst,
+    запросов в минуту)}. Проверка выполняется до обработчика: IP берется из
+    соединения (client_ip()), email - из сырого тела (email_from_body()).
+    Запрос без известного IP (loopback без заголовка прокси) проверяется
+    только по email и считается в ip_unknown. Запрос,
+    отклоненный по IP, не расходует токен email. Если общее хранилище
+    недоступно, запрос пропускается (fail open) и считается в backend_errors.
+    """
+
+    def __init__(self, limits: Dict[str, Dict[str, Tuple[float, float]]] = None, backend: str = None,
+                 db_path: str = None):
+        """
+        Инициализация
+
+        Args:
+            limits: Лимиты по путям (по умолчанию Config.RATE_LIMITS)
+            backend: 'memory' - в процессе, 'sqlite' - общий для воркеров
+            db_path: Путь к funnel.db для backend='sqlite'
+        """
+        self.limits = limits if limits is not None else Config.RATE_LIMITS
+        backend = backend or Config.RATE_LIMIT_BACKEND
+        if backend == 'sqlite':
+            self.buckets = SQLiteBuckets(db_path)
+        elif backend == 'memory':
+            self.buckets = MemoryBuckets()
+        else:
+            raise ValueError(f"Неизвестный backend ограничения запросов: {backend}")
+        self._lock = threading.Lock()
+        self.counters = {'allowed': 0, 'backend_errors': 0, 'ip_unknown': 0}
+        self.shed: Dict[str, Dict[str, int]] = {path: dict.fromkeys(KEY_KINDS, 0) for path in self.limits}
+
+    @property
+    def shared(self) -> bool:
+        """Проверка обращается к базе (из asyncio ее нужно выполнять в потоке)"""
+        return self.buckets.shared
+
+    def applies(self, path: str) -> bool:
+        """Для пути заданы лимиты"""
+        return path in self.limits
+
+    def check(self, path: str, ip: Optional[str], read_body: Callable[[], bytes] = None) -> Optional[int]:
+        """
+        Проверка запроса
+
+        Args:
+            path: Путь запроса
+            ip: IP клиента (client_ip()); None - ограничение по IP не применяется
+            read_body: Возвращает сырое тело запроса; вызывается, только если запрос прошел проверку по IP
+
+        Returns:
+            None - запрос разрешен; иначе через сколько секунд повторить (Retry-After)
+        """
+        route_limits = self.limits.get(path)
+        if not route_limits:
+            return None
+        now = time.time()
+        for kind in KEY_KINDS:
+            if kind not in route_limits:
+                continue
+            if kind == 'ip':
+                value = ip
+                if not value:
+                    self._count('ip_unknown')
+            else:
+                value = email_from_body(read_body()) if read_body else None
+            if not value:
+                continue
+            burst, per_minute = route_limits[kind]
+            rate = per_minute / 60
+            try:
+                allowed, tokens = self.buckets.take(f'{path} {kind} {value}', burst, rate, now)
+            except Exception as e:
+                self._count('backend_errors')
+                print(f"Ошибка проверки ограничения запросов: {e}")
+                return None
+            if not allowed:
+                with self._lock:
+                    self.shed[path][kind] += 1
+                if Config.METRICS_ENABLED:
+                    metrics.inc('funnel_rate_limited_total', (path, kind))
+                return max(int((1 - tokens) / rate + 0.999), 1)
+        self._count('allowed')
+        return None
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self.counters[name] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики пропущенных и отклоненных запросов этого процесса"""
+        with self._lock:
+            result = dict(self.counters, shed={path: dict(kinds) for path, kinds in self.shed.items()})
+        result['buckets'] = self.buckets.stats()
+        result['limits'] = {
+            path: {kind: {'burst': burst, 'per_minute': per_minute} for kind, (burst, per_minute) in kinds.items()}
+            for path, kinds in self.limits.items()
+        }
+        return result
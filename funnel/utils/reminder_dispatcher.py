@@ -0,0 +1,278 @@
+"""
+Reminder Dispatcher Module
+Пакетная параллельная отправка напоминаний о встречах
+"""
+
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, ContextManager, Dict, List, Optional
+from zoneinfo import ZoneInfo
+
+from config import Config
+from database.connection import get_database
+from utils.email_messages import build_reminder_email
+from utils.mail_queue import MESSAGE_REJECTED_ERRORS, SMTPConnectionPool
+from utils.metrics import metrics
+
+
+# Встреча ждет напоминания: не отправлено или захват отправителя, упавшего до конца отправки, истек
+REMINDER_DUE = '(reminder_sent = 0 OR reminder_claimed_until < ?)'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS reminder_runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    target_date TEXT NOT NULL,
+    last_appointment_id INTEGER NOT NULL DEFAULT 0,
+    sent INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL DEFAULT 'running',
+    started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    finished_at TIMESTAMP
+);
+'''
+
+
+class ReminderDispatcher:
+    """Отправка напоминаний страницами с параллельной доставкой
+
+    Встречи без напоминания выбираются страницами по id (keyset) и в той же
+    транзакции помечаются reminder_sent = 1 с арендой до
+    reminder_claimed_until, поэтому прогоны в разных процессах и планировщик
+    не отправят одно напоминание дважды. Письма страницы отправляются
+    параллельно через пул SMTP соединений, после чего одной транзакцией на
+    страницу аренда отправленных снимается, а с неотправленных встреч
+    снимается отметка. Позиция прогона сохраняется в reminder_runs: после
+    падения процесса следующий запуск продолжает с последней сохраненной
+    страницы, а встречи незавершенной страницы выбирает прогон, начатый
+    после истечения их аренды (Config.REMINDER_CLAIM_LEASE_SECONDS).
+    """
+
+    def __init__(self, pool: SMTPConnectionPool, db_path: str = None,
+                 concurrency: int = None, page_size: int = None):
+        """
+        Инициализация диспетчера
+
+        Args:
+            pool: Пул SMTP соединений
+            db_path: Путь к funnel.db
+            concurrency: Количество параллельных отправок
+            page_size: Размер страницы выборки
+        """
+        self.pool = pool
+        self.db_path = db_path or Config.DATABASE_PATH
+        self.concurrency = concurrency or Config.REMINDER_CONCURRENCY
+        self.page_size = page_size or Config.REMINDER_PAGE_SIZE
+        self._run_lock = threading.Lock()
+
+        self.database = get_database(self.db_path)
+        self.database.executescript(SCHEMA)
+
+    def connect(self, immediate: bool = False) -> ContextManager[sqlite3.Connection]:
+        """Транзакция на соединении потока с funnel.db: commit при успехе, rollback при ошибке"""
+        return self.database.transaction(immediate)
+
+    @staticmethod
+    def default_target_date() -> str:
+        """Дата встреч, о которых пора напомнить (через REMINDER_EMAIL_HOURS_BEFORE)"""
+        now = datetime.now(ZoneInfo(Config.DEFAULT_TIMEZONE))
+        return (now + timedelta(hours=Config.REMINDER_EMAIL_HOURS_BEFORE)).strftime('%Y-%m-%d')
+
+    def dispatch(self, target_date: str = None) -> Dict[str, Any]:
+        """
+        Отправка напоминаний о встречах на дату
+
+        Args:
+            target_date: Дата встреч YYYY-MM-DD (по умолчанию - через REMINDER_EMAIL_HOURS_BEFORE)
+
+        Returns:
+            Словарь с количеством отправленных писем, ошибками и пропускной способностью
+        """
+        result = {
+            'success': False,
+            'target_date': target_date or self.default_target_date(),
+            'reminders_sent': 0,
+            'failed': 0,
+            'resumed': False,
+            'elapsed_seconds': 0.0,
+            'messages_per_second': 0.0,
+            'failures': []
+        }
+
+        if not self._run_lock.acquire(blocking=False):
+            result['error'] = 'Reminder dispatch is already running'
+            result['busy'] = True
+            return result
+
+        started = time.monotonic()
+        try:
+            run_id, last_id, resumed = self._start_run(result['target_date'])
+            result['resumed'] = resumed
+
+            with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='reminder') as executor:
+                while True:
+                    page = self._claim_page(result['target_date'], last_id)
+                    if not page:
+                        break
+
+                    outcomes = list(executor.map(self._send, page))
+                    sent_ids = [row['id'] for row, error in zip(page, outcomes) if error is None]
+                    failures = [
+                        {'appointment_id': row['id'], 'email': row['email'], 'error': error}
+                        for row, error in zip(page, outcomes) if error is not None
+                    ]
+                    last_id = page[-1]['id']
+                    failed_ids = [failure['appointment_id'] for failure in failures]
+                    self._commit_page(run_id, last_id, sent_ids, failed_ids)
+
+                    result['reminders_sent'] += len(sent_ids)
+                    result['failed'] += len(failures)
+                    result['failures'].extend(failures[:max(0, 50 - len(result['failures']))])
+
+            self._finish_run(run_id)
+            result['success'] = True
+
+        except Exception as e:
+            result['error'] = f'Ошибка отправки напоминаний: {e}'
+        finally:
+            self._run_lock.release()
+            elapsed = time.monotonic() - started
+            result['elapsed_seconds'] = round(elapsed, 3)
+            if elapsed > 0:
+                result['messages_per_second'] = round(result['reminders_sent'] / elapsed, 2)
+
+        return result
+
+    def send_one(self, appointment_id: int, appointment_date: str = None,
+                 appointment_time: str = None) -> Dict[str, Any]:
+        """
+        Отправка напоминания об одной встрече
+
+        Встреча атомарно помечается reminder_sent = 1 до отправки, поэтому
+        пакетный прогон и планировщик (в том числе в разных процессах) не
+        отправят напоминание дважды. При ошибке отправки отметка снимается,
+        а если процесс упал до конца отправки - истекает аренда захвата.
+
+        Args:
+            appointment_id: ID встречи
+            appointment_date: Ожидаемая дата встречи; если встречу перенесли, напоминание не отправляется
+            appointment_time: Ожидаемое время встречи
+
+        Returns:
+            Словарь с результатом отправки
+        """
+        now = time.time()
+        with self.connect() as conn:
+            claimed = conn.execute(
+                f'''UPDATE appointments SET reminder_sent = 1, reminder_claimed_until = ?
+                    WHERE id = ? AND {REMINDER_DUE} AND COALESCE(status, '') != 'cancelled'
+                      AND (? IS NULL OR appointment_date = ?) AND (? IS NULL OR appointment_time = ?)''',
+                (now + Config.REMINDER_CLAIM_LEASE_SECONDS, appointment_id, now,
+                 appointment_date, appointment_date, appointment_time, appointment_time)
+            ).rowcount
+            row = conn.execute(
+                '''SELECT id, name, email, appointment_date, appointment_time, timezone
+                   FROM appointments WHERE id = ?''',
+                (appointment_id,)
+            ).fetchone() if claimed else None
+
+        if row is None:
+            return {
+                'success': False,
+                'skipped': True,
+                'error': 'Напоминание уже отправлено, встреча удалена или перенесена'
+            }
+
+        error = self._send(row)
+        with self.connect() as conn:
+            conn.execute(
+                'UPDATE appointments SET reminder_sent = ?, reminder_claimed_until = NULL WHERE id = ?',
+                (0 if error is not None else 1, appointment_id)
+            )
+        if error is not None:
+            return {'success': False, 'skipped': False, 'error': error}
+
+        return {'success': True, 'skipped': False, 'message': f"Напоминание отправлено на {row['email']}"}
+
+    def rearm(self, appointment_id: int) -> None:
+        """Снятие отметки reminder_sent, чтобы о перенесенной встрече напомнили снова"""
+        with self.connect() as conn:
+            conn.execute(
+                'UPDATE appointments SET reminder_sent = 0, reminder_claimed_until = NULL WHERE id = ?',
+                (appointment_id,)
+            )
+
+    def _start_run(self, target_date: str):
+        """Продолжение незавершенного прогона на эту дату или создание нового"""
+        with self.connect(immediate=True) as conn:
+            row = conn.execute(
+                '''SELECT id, last_appointment_id FROM reminder_runs
+                   WHERE target_date = ? AND status = 'running'
+                   ORDER BY id DESC LIMIT 1''',
+                (target_date,)
+            ).fetchone()
+            if row:
+                return row['id'], row['last_appointment_id'], True
+            cursor = conn.execute('INSERT INTO reminder_runs (target_date) VALUES (?)', (target_date,))
+            return cursor.lastrowid, 0, False
+
+    def _claim_page(self, target_date: str, last_id: int) -> List[sqlite3.Row]:
+        """Выборка страницы встреч без напоминания и их захват (reminder_sent = 1 с арендой) одной транзакцией"""
+        now = time.time()
+        with self.connect(immediate=True) as conn:
+            page = conn.execute(
+                f'''SELECT id, name, email, appointment_date, appointment_time, timezone
+                    FROM appointments
+                    WHERE appointment_date = ? AND {REMINDER_DUE}
+                      AND COALESCE(status, '') != 'cancelled' AND id > ?
+                    ORDER BY id LIMIT ?''',
+                (target_date, now, last_id, self.page_size)
+            ).fetchall()
+            conn.executemany(
+                'UPDATE appointments SET reminder_sent = 1, reminder_claimed_until = ? WHERE id = ?',
+                [(now + Config.REMINDER_CLAIM_LEASE_SECONDS, row['id']) for row in page]
+            )
+            return page
+
+    def _send(self, row: sqlite3.Row) -> Optional[str]:
+        """Отправка одного напоминания; возвращает текст ошибки или None"""
+        message = build_reminder_email(
+            row['email'], row['name'], row['appointment_date'], row['appointment_time'], row['timezone']
+        )
+        last_error = None
+        # Вторая попытка получает из пула новое соединение, если старое оборвалось
+        for _ in range(2):
+            try:
+                with self.pool.connection() as smtp, metrics.timed('smtp', 'send'):
+                    smtp.send_message(message)
+                return None
+            except MESSAGE_REJECTED_ERRORS as e:
+                return str(e)
+            except Exception as e:
+                last_error = str(e)
+        return last_error
+
+    def _commit_page(self, run_id: int, last_id: int, sent_ids: List[int], failed_ids: List[int]) -> None:
+        """Снятие аренды (и отметки с неотправленных встреч) и сохранение позиции прогона одной транзакцией"""
+        with self.connect() as conn:
+            conn.executemany(
+                'UPDATE appointments SET reminder_sent = ?, reminder_claimed_until = NULL WHERE id = ?',
+                [(1, appointment_id) for appointment_id in sent_ids]
+                + [(0, appointment_id) for appointment_id in failed_ids]
+            )
+            conn.execute(
+                '''UPDATE reminder_runs
+                   SET last_appointment_id = ?, sent = sent + ?, failed = failed + ?
+                   WHERE id = ?''',
+                (last_id, len(sent_ids), len(failed_ids), run_id)
+            )
+
+    def _finish_run(self, run_id: int) -> None:
+        with self.connect() as conn:
+            conn.execute(
+                '''UPDATE reminder_runs SET status = 'finished', finished_at = CURRENT_TIMESTAMP
+                   WHERE id = ?''',
+                (run_id,)
+            )
@@ -0,0 +1,382 @@
+"""
+Reminder Scheduler Module
+Планировщик напоминаний внутри процесса на min-heap
+"""
+
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from config import Config
+from utils.reminder_dispatcher import ReminderDispatcher
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS reminder_schedule_changes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    appointment_id INTEGER NOT NULL,
+    action TEXT NOT NULL,
+    appointment_date TEXT,
+    appointment_time TEXT,
+    timezone TEXT,
+    created_at REAL NOT NULL
+);
+'''
+
+
+def reminder_time(appointment_date: str, appointment_time: str, timezone: str = None,
+                  hours_before: float = None) -> Tuple[float, float]:
+    """
+    Время начала встречи и время отправки напоминания
+
+    Args:
+        appointment_date: Дата встречи YYYY-MM-DD
+        appointment_time: Время встречи HH:MM в часовом поясе встречи
+        timezone: Часовой пояс встречи
+        hours_before: За сколько часов напоминать (по умолчанию Config.REMINDER_EMAIL_HOURS_BEFORE)
+
+    Returns:
+        (начало встречи, время напоминания) как unix timestamp
+    """
+    try:
+        tz = ZoneInfo(timezone or Config.DEFAULT_TIMEZONE)
+    except Exception:
+        tz = ZoneInfo(Config.DEFAULT_TIMEZONE)
+    if hours_before is None:
+        hours_before = Config.REMINDER_EMAIL_HOURS_BEFORE
+    start = datetime.strptime(f'{appointment_date} {appointment_time}', '%Y-%m-%d %H:%M').replace(tzinfo=tz)
+    return start.timestamp(), (start - timedelta(hours=hours_before)).timestamp()
+
+
+class ReminderScheduler:
+    """Отправка каждого напоминания в свое время без периодического сканирования
+
+    Планировщик работает в одном процессе (лидере). При старте (в том числе
+    когда лидером становится другой процесс) предстоящие встречи без
+    напоминания загружаются из funnel.db в min-heap по времени напоминания.
+    В процессе лидера очередь обновляется сразу через schedule()/cancel()
+    при создании, изменении и удалении встречи; в остальных процессах эти
+    вызовы записывают изменение в reminder_schedule_changes, а лидер читает
+    новые строки по id раз в poll_seconds. Поток спит до ближайшего
+    напоминания; замененные и отмененные записи удаляются из кучи лениво,
+    когда оказываются на вершине. Перед отправкой дата и время встречи
+    сверяются с базой, так что устаревшая запись ничего не отправит.
+    """
+
+    def __init__(self, dispatcher: ReminderDispatcher, hours_before: float = None,
+                 workers: int = None, max_sleep_seconds: float = None, poll_seconds: float = None):
+        """
+        Инициализация планировщика
+
+        Args:
+            dispatcher: Диспетчер напоминаний (отправка и отметка reminder_sent)
+            hours_before: За сколько часов до встречи отправлять напоминание
+            workers: Количество потоков отправки
+            max_sleep_seconds: Максимальный сон без проверки часов
+            poll_seconds: Интервал чтения изменений от других процессов
+        """
+        self.dispatcher = dispatcher
+        self.hours_before = hours_before if hours_before is not None else Config.REMINDER_EMAIL_HOURS_BEFORE
+        self.workers = workers or Config.REMINDER_CONCURRENCY
+        self.max_sleep_seconds = max_sleep_seconds or Config.REMINDER_SCHEDULER_MAX_SLEEP_SECONDS
+        self.poll_seconds = poll_seconds or Config.REMINDER_SCHEDULER_POLL_SECONDS
+        self._heap: List[Tuple[float, int, int]] = []  # (fire_at, seq, appointment_id)
+        self._entries: Dict[int, Dict[str, Any]] = {}  # appointment_id -> актуальная запись
+        self._given_up: Dict[int, Tuple[str, str]] = {}  # appointment_id -> (дата, время) после всех попыток
+        self._active = False  # планировщик запущен в этом процессе
+        self._seq = itertools.count()
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._stopping = False
+        self._last_change_id = 0  # последнее примененное изменение reminder_schedule_changes
+        self._next_purge = 0.0
+        self.counters = {'scheduled': 0, 'cancelled': 0, 'sent': 0, 'skipped': 0, 'failed': 0, 'retried': 0}
+
+        self.dispatcher.database.executescript(SCHEMA)
+
+    def start(self) -> None:
+        """Загрузка предстоящих встреч и запуск потока планировщика"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping = False
+        self._active = True
+        print(f"Запланировано напоминаний: {self.load()}")
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='reminder-scheduler')
+        self._thread = threading.Thread(target=self._run, name='reminder-scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5) -> None:
+        """Остановка потока планировщика"""
+        with self._condition:
+            self._stopping = True
+            self._active = False
+            self._condition.notify_all()
+        if self._thread:
+            self._thread.join(timeout)
+        if self._executor:
+            self._executor.shutdown(wait=False)
+
+    def load(self) -> int:
+        """
+        Загрузка встреч без напоминания и сверка с ними кучи
+
+        Новые и перенесенные встречи планируются, записи удаленных встреч и
+        встреч с уже отправленным напоминанием отменяются. Вызывается при
+        старте планировщика; дальше куча обновляется по reminder_schedule_changes.
+
+        Returns:
+            Количество запланированных напоминаний
+        """
+        # Вчерашняя дата покрывает встречи в часовых поясах западнее DEFAULT_TIMEZONE
+        since = (datetime.now(ZoneInfo(Config.DEFAULT_TIMEZONE)) - timedelta(days=1)).strftime('%Y-%m-%d')
+        with self.dispatcher.connect() as conn:
+            # Изменения, записанные после этой точки, применятся повторно - это безопасно
+            self._last_change_id = conn.execute(
+                'SELECT COALESCE(MAX(id), 0) FROM reminder_schedule_changes'
+            ).fetchone()[0]
+            rows = conn.execute(
+                '''SELECT id, appointment_date, appointment_time, timezone FROM appointments
+                   WHERE reminder_sent = 0 AND appointment_date >= ?
+                     AND COALESCE(status, '') != 'cancelled' ''',
+                (since,)
+            ).fetchall()
+
+        scheduled = 0
+        for row in rows:
+            schedule_key = (row['appointment_date'], row['appointment_time'])
+            with self._condition:
+                entry = self._entries.get(row['id'])
+                if entry is not None and (entry['appointment_date'], entry['appointment_time'],
+                                          entry['timezone']) == (*schedule_key, row['timezone']):
+                    scheduled += 1
+                    continue
+                if self._given_up.get(row['id']) == schedule_key:
+                    continue
+            if self.schedule(row['id'], row['appointment_date'], row['appointment_time'], row['timezone']):
+                scheduled += 1
+
+        current_ids = {row['id'] for row in rows}
+        with self._condition:
+            for appointment_id in [key for key in self._entries if key not in current_ids]:
+                self._cancel(appointment_id)
+            self._given_up = {key: value for key, value in self._given_up.items() if key in current_ids}
+        return scheduled
+
+    def schedule(self, appointment_id: int, appointment_date: str, appointment_time: str,
+                 timezone: str = None, attempts: int = 0, fire_at: float = None) -> bool:
+        """
+        Планирование (или перепланирование) напоминания о встрече
+
+        Args:
+            appointment_id: ID встречи
+            appointment_date: Дата встречи YYYY-MM-DD
+            appointment_time: Время встречи HH:MM
+            timezone: Часовой пояс встречи
+            attempts: Количество уже сделанных попыток отправки
+            fire_at: Время отправки (по умолчанию - за hours_before до встречи)
+
+        Returns:
+            True, если напоминание запланировано (или передано лидеру); False,
+            если встреча уже прошла
+        """
+        if not self._active:
+            return self._record_change(appointment_id, 'schedule', appointment_date, appointment_time, timezone)
+        try:
+            starts_at, reminder_at = reminder_time(appointment_date, appointment_time, timezone, self.hours_before)
+        except (TypeError, ValueError) as e:
+            print(f"Не удалось запланировать напоминание для встречи {appointment_id}: {e}")
+            return False
+
+        with self._condition:
+            if starts_at <= time.time():
+                self._cancel(appointment_id)
+                return False
+            seq = next(self._seq)
+            fire_at = reminder_at if fire_at is None else fire_at
+            self._entries[appointment_id] = {
+                'seq': seq,
+                'fire_at': fire_at,
+                'starts_at': starts_at,
+                'appointment_date': appointment_date,
+                'appointment_time': appointment_time,
+                'timezone': timezone,
+                'attempts': attempts
+            }
+            heapq.heappush(self._heap, (fire_at, seq, appointment_id))
+            self.counters['scheduled'] += 1
+            # Будим поток только если новое напоминание раньше текущего ожидания
+            if self._heap[0][1] == seq:
+                self._condition.notify()
+        return True
+
+    def cancel(self, appointment_id: int) -> bool:
+        """
+        Отмена напоминания (запись в куче удаляется лениво)
+
+        Args:
+            appointment_id: ID встречи
+
+        Returns:
+            True, если напоминание было запланировано (или отмена передана лидеру)
+        """
+        if not self._active:
+            return self._record_change(appointment_id, 'cancel')
+        with self._condition:
+            return self._cancel(appointment_id)
+
+    def _record_change(self, appointment_id: int, action: str, appointment_date: str = None,
+                       appointment_time: str = None, timezone: str = None) -> bool:
+        """Запись изменения для планировщика в процессе лидера"""
+        now = time.time()
+        try:
+            with self.dispatcher.connect() as conn:
+                conn.execute(
+                    '''INSERT INTO reminder_schedule_changes
+                       (appointment_id, action, appointment_date, appointment_time, timezone, created_at)
+                       VALUES (?, ?, ?, ?, ?, ?)''',
+                    (appointment_id, action, appointment_date, appointment_time, timezone, now)
+                )
+                # Без лидера (автозапуск выключен) изменения никто не читает
+                if now >= self._next_purge:
+                    self._next_purge = now + 3600
+                    conn.execute(
+                        'DELETE FROM reminder_schedule_changes WHERE created_at < ?',
+                        (now - Config.REMINDER_SCHEDULER_CHANGES_RETENTION_SECONDS,)
+                    )
+        except Exception as e:
+            print(f"Ошибка записи изменения расписания напоминаний: {e}")
+            return False
+        return True
+
+    def apply_changes(self) -> int:
+        """
+        Применение изменений, записанных другими процессами после последнего чтения
+
+        Returns:
+            Количество примененных изменений
+        """
+        with self.dispatcher.connect() as conn:
+            rows = conn.execute(
+                '''SELECT id, appointment_id, action, appointment_date, appointment_time, timezone
+                   FROM reminder_schedule_changes WHERE id > ? ORDER BY id''',
+                (self._last_change_id,)
+            ).fetchall()
+        if not rows:
+            return 0
+
+        for row in rows:
+            if row['action'] == 'cancel':
+                self.cancel(row['appointment_id'])
+            else:
+                self.schedule(row['appointment_id'], row['appointment_date'], row['appointment_time'], row['timezone'])
+        self._last_change_id = rows[-1]['id']
+        # Изменения читает только лидер; новый лидер все равно начинает с load()
+        with self.dispatcher.connect() as conn:
+            conn.execute('DELETE FROM reminder_schedule_changes WHERE id <= ?', (self._last_change_id,))
+        return len(rows)
+
+    def _cancel(self, appointment_id: int) -> bool:
+        if self._entries.pop(appointment_id, None) is None:
+            return False
+        self.counters['cancelled'] += 1
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        """Состояние планировщика"""
+        with self._condition:
+            self._drop_stale()
+            next_fire_at = self._heap[0][0] if self._heap else None
+            return dict(
+                self.counters,
+                pending=len(self._entries),
+                heap_size=len(self._heap),
+                next_reminder_at=datetime.fromtimestamp(next_fire_at).astimezone().isoformat() if next_fire_at else None,
+                running=bool(self._thread and self._thread.is_alive())
+            )
+
+    def _drop_stale(self) -> None:
+        """Удаление с вершины кучи замененных и отмененных записей"""
+        while self._heap:
+            _, seq, appointment_id = self._heap[0]
+            entry = self._entries.get(appointment_id)
+            if entry is not None and entry['seq'] == seq:
+                return
+            heapq.heappop(self._heap)
+
+    def _run(self) -> None:
+        next_poll = time.monotonic() + self.poll_seconds
+        while True:
+            if time.monotonic() >= next_poll:
+                # Встречи, созданные, измененные и удаленные в других процессах
+                try:
+                    self.apply_changes()
+                except Exception as e:
+                    print(f"Ошибка чтения изменений расписания напоминаний: {e}")
+                next_poll = time.monotonic() + self.poll_seconds
+
+            appointment_id = entry = None
+            with self._condition:
+                while True:
+                    if self._stopping:
+                        return
+                    self._drop_stale()
+                    poll_in = next_poll - time.monotonic()
+                    if poll_in <= 0:
+                        break
+                    if not self._heap:
+                        self._condition.wait(min(self.max_sleep_seconds, poll_in))
+                        continue
+                    delay = self._heap[0][0] - time.time()
+                    if delay > 0:
+                        # Ограниченный сон защищает от перевода системных часов
+                        self._condition.wait(min(delay, self.max_sleep_seconds, poll_in))
+                        continue
+                    _, _, appointment_id = heapq.heappop(self._heap)
+                    entry = self._entries.pop(appointment_id)
+                    break
+
+            if appointment_id is not None:
+                self._executor.submit(self._fire, appointment_id, entry)
+
+    def _fire(self, appointment_id: int, entry: Dict[str, Any]) -> None:
+        try:
+            # Встречу могли перенести в другом процессе: тогда send_one ее пропустит,
+            # а новое время придет через reminder_schedule_changes
+            result = self.dispatcher.send_one(
+                appointment_id, entry['appointment_date'], entry['appointment_time']
+            )
+        except Exception as e:
+            result = {'success': False, 'skipped': False, 'error': str(e)}
+
+        with self._condition:
+            if result['success']:
+                self.counters['sent'] += 1
+                return
+            if result.get('skipped'):
+                self.counters['skipped'] += 1
+                return
+
+        attempts = entry['attempts'] + 1
+        if attempts >= Config.MAIL_QUEUE_MAX_ATTEMPTS:
+            with self._condition:
+                self.counters['failed'] += 1
+                self._given_up[appointment_id] = (entry['appointment_date'], entry['appointment_time'])
+            print(f"Напоминание о встрече {appointment_id} не отправлено: {result['error']}")
+            return
+
+        with self._condition:
+            self.counters['retried'] += 1
+            # Встречу могли перепланировать, пока шла отправка
+            if appointment_id in self._entries:
+                return
+        delay = Config.MAIL_QUEUE_RETRY_BASE_SECONDS * (2 ** (attempts - 1))
+        self.schedule(
+            appointment_id, entry['appointment_date'], entry['appointment_time'], entry['timezone'],
+            attempts=attempts, fire_at=time.time() + delay
+        )
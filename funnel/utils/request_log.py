@@ -0,0 +1,228 @@
+"""
+Request Log Module
+Неблокирующее журналирование запросов: очередь, фоновая пакетная запись JSON строк
+"""
+
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from config import Config
+
+
+# Поля LogRecord, которые не переносятся в JSON как пользовательские
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON строка на запись: время, уровень, сообщение и поля из extra"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        for name, value in vars(record).items():
+            if name not in _RECORD_ATTRIBUTES:
+                entry[name] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler с ограниченной очередью: при переполнении запись отбрасывается, а не блокирует запрос"""
+
+    def __init__(self, log_queue: 'queue.Queue[logging.LogRecord]'):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Форматирование выполняется в фоновом потоке
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class BatchFileWriter:
+    """Фоновый поток, который забирает записи из очереди и пишет их в файл пачками
+
+    Пачка записывается одним write() при накоплении batch_size записей или
+    через flush_seconds после первой записи пачки.
+    """
+
+    def __init__(self, log_queue: 'queue.Queue[logging.LogRecord]', path: str,
+                 batch_size: int, flush_seconds: float, formatter: logging.Formatter = None):
+        self.queue = log_queue
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.formatter = formatter or JsonFormatter()
+        self.written = 0
+        self.batches = 0
+        self._thread: Optional[threading.Thread] = None
+        self._stop = object()
+
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name='request-log-writer', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5) -> None:
+        if not self._thread:
+            return
+        # Сигнал остановки должен попасть в очередь даже если она заполнена
+        while self._thread.is_alive():
+            try:
+                self.queue.put(self._stop, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        self._thread.join(timeout)
+
+    def _run(self) -> None:
+        with open(self.path, 'a', encoding='utf-8') as stream:
+            while True:
+                item = self.queue.get()
+                if item is self._stop:
+                    return
+                batch = [item]
+                deadline = time.monotonic() + self.flush_seconds
+                stop = False
+                while len(batch) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = self.queue.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                    if item is self._stop:
+                        stop = True
+                        break
+                    batch.append(item)
+                self._write(stream, batch)
+                if stop:
+                    return
+
+    def _write(self, stream, batch: List[logging.LogRecord]) -> None:
+        lines = []
+        for record in batch:
+            try:
+                lines.append(self.formatter.format(record))
+            except Exception as e:
+                lines.append(json.dumps({'level': 'ERROR', 'message': f'Unformattable log record: {e}'}))
+        try:
+            stream.write('\n'.join(lines) + '\n')
+            stream.flush()
+        except OSError as e:
+            print(f"Ошибка записи журнала запросов: {e}")
+            return
+        self.written += len(lines)
+        self.batches += 1
+
+
+class RequestLogger:
+    """Журнал HTTP запросов вне критического пути обработки
+
+    log_request() только кладет запись в ограниченную очередь; форматирование
+    в JSON и запись на диск выполняет BatchFileWriter. Для маршрутов из
+    Config.REQUEST_LOG_SAMPLE_RATES пишется только доля запросов, но ошибки
+    (status >= 400) и медленные запросы пишутся всегда.
+    """
+
+    def __init__(self, path: str = None, queue_size: int = None, batch_size: int = None,
+                 flush_seconds: float = None, sample_rates: Dict[str, float] = None):
+        """
+        Инициализация журнала
+
+        Args:
+            path: Файл журнала (JSON lines)
+            queue_size: Максимальное количество записей в очереди
+            batch_size: Записей в одной пачке записи
+            flush_seconds: Максимальная задержка записи пачки
+            sample_rates: Префикс пути -> доля записываемых запросов
+        """
+        self.sample_rates = sorted(
+            (sample_rates if sample_rates is not None else Config.REQUEST_LOG_SAMPLE_RATES).items(),
+            key=lambda item: len(item[0]),
+            reverse=True
+        )
+        self.queue: 'queue.Queue[logging.LogRecord]' = queue.Queue(queue_size or Config.REQUEST_LOG_QUEUE_SIZE)
+        self.handler = DroppingQueueHandler(self.queue)
+        self.writer = BatchFileWriter(
+            self.queue,
+            path or Config.REQUEST_LOG_PATH,
+            batch_size or Config.REQUEST_LOG_BATCH_SIZE,
+            flush_seconds or Config.REQUEST_LOG_FLUSH_SECONDS
+        )
+        self.logger = logging.getLogger('funnel.requests')
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        self.logger.handlers = [self.handler]
+        self.sampled_out = 0
+
+    def start(self) -> None:
+        """Запуск фоновой записи"""
+        self.writer.start()
+
+    def stop(self, timeout: float = 5) -> None:
+        """Запись оставшихся записей и остановка"""
+        self.writer.stop(timeout)
+
+    def _sample_rate(self, path: str) -> float:
+        for prefix, rate in self.sample_rates:
+            if path.startswith(prefix):
+                return rate
+        return 1.0
+
+    def log_request(self, method: str, path: str, status: int, duration_ms: float, **fields) -> None:
+        """
+        Постановка записи о запросе в очередь (без ожидания)
+
+        Args:
+            method: HTTP метод
+            path: Путь запроса
+            status: Код ответа
+            duration_ms: Время обработки в миллисекундах
+            **fields: Дополнительные поля записи
+        """
+        if status < 400 and duration_ms < Config.REQUEST_LOG_SLOW_MS:
+            rate = self._sample_rate(path)
+            if rate < 1.0 and random.random() >= rate:
+                self.sampled_out += 1
+                return
+            if rate < 1.0:
+                fields['sample_rate'] = rate
+
+        level = logging.ERROR if status >= 500 else logging.WARNING if status >= 400 else logging.INFO
+        self.logger.log(level, 'request', extra=dict(
+            fields, method=method, path=path, status=status, duration_ms=round(duration_ms, 2)
+        ))
+
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики журнала"""
+        return {
+            'queued': self.queue.qsize(),
+            'dropped': self.handler.dropped,
+            'sampled_out': self.sampled_out,
+            'written': self.writer.written,
+            'batches': self.writer.batches
+        }
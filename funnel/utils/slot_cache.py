@@ -0,0 +1,273 @@
+"""
+Slot Cache Module
+Кэш доступных слотов в памяти процесса (TTL + LRU) с общей для воркеров инвалидацией
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from config import Config
+from database.connection import get_database
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS slot_cache_invalidations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    date TEXT,
+    calendar_id TEXT,
+    pid INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+'''
+
+
+class SlotCache:
+    """Потокобезопасный кэш доступных слотов с TTL и вытеснением по LRU
+
+    Ключ кэша - кортеж (calendar_id, date, duration_minutes), поэтому
+    инвалидация по дате затрагивает все длительности для этой даты.
+    Инвалидация также увеличивает счетчик поколения даты: результат загрузки,
+    начатой до инвалидации, в кэш не попадает (иначе занятый слот снова
+    предлагался бы весь TTL).
+
+    Кэш у каждого процесса свой. Чтобы запись встречи в одном воркере и
+    синхронизация календаря в процессе-лидере сбрасывали кэш во всех
+    воркерах, инвалидации записываются в slot_cache_invalidations, а
+    каждый процесс не чаще раза в Config.SLOT_CACHE_INVALIDATION_POLL_SECONDS
+    применяет чужие записи перед чтением кэша.
+    """
+
+    def __init__(self, ttl_seconds: int = None, max_entries: int = None,
+                 shared: bool = None, db_path: str = None):
+        """
+        Инициализация кэша
+
+        Args:
+            ttl_seconds: Время жизни записи в секундах
+            max_entries: Максимальное количество записей в кэше
+            shared: Делить инвалидации с другими процессами через funnel.db
+            db_path: Путь к funnel.db
+        """
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else Config.SLOT_CACHE_TTL_SECONDS
+        self.max_entries = max_entries if max_entries is not None else Config.SLOT_CACHE_MAX_ENTRIES
+        self._entries: 'OrderedDict[Tuple[Hashable, ...], Tuple[float, Any]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._generations: Dict[str, int] = {}  # date -> номер поколения
+        self._global_generation = 0  # увеличивается при инвалидации всех дат
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.stale_loads = 0
+        self.remote_invalidations = 0
+
+        self.shared = Config.SLOT_CACHE_SHARED_INVALIDATION if shared is None else shared
+        self._poll_lock = threading.Lock()
+        self._next_poll = 0.0
+        self._next_purge = 0.0
+        self._last_seen_id = 0
+        if self.shared:
+            self.database = get_database(db_path or Config.DATABASE_PATH)
+            self.database.executescript(SCHEMA)
+            with self.database.transaction() as conn:
+                self._last_seen_id = conn.execute(
+                    'SELECT COALESCE(MAX(id), 0) FROM slot_cache_invalidations'
+                ).fetchone()[0]
+
+    @staticmethod
+    def make_key(calendar_id: str, date: str, duration_minutes: int) -> Tuple[str, str, int]:
+        """Формирование ключа кэша"""
+        return (calendar_id, date, int(duration_minutes))
+
+    def get(self, key: Tuple[Hashable, ...]) -> Optional[Any]:
+        """
+        Получение значения из кэша
+
+        Args:
+            key: Ключ кэша
+
+        Returns:
+            Сохраненное значение или None, если записи нет или она устарела
+        """
+        self._poll()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires_at, value = entry
+            if expires_at <= now:
+                del self._entries[key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def generation(self, key: Tuple[Hashable, ...]) -> Tuple[int, int]:
+        """
+        Поколение даты ключа; снимается до загрузки и передается в set()
+
+        Args:
+            key: Ключ кэша
+
+        Returns:
+            Непрозрачное значение, которое меняется при каждой инвалидации даты
+        """
+        self._poll()
+        with self._lock:
+            return self._global_generation, self._generations.get(key[1], 0)
+
+    def set(self, key: Tuple[Hashable, ...], value: Any, generation: Tuple[int, int] = None) -> bool:
+        """
+        Сохранение значения в кэш
+
+        Args:
+            key: Ключ кэша
+            value: Значение (список слотов)
+            generation: Результат generation() до начала загрузки значения
+
+        Returns:
+            False, если дату инвалидировали после начала загрузки (значение не сохранено)
+        """
+        if self.ttl_seconds <= 0 or self.max_entries <= 0:
+            return False
+
+        expires_at = time.monotonic() + self.ttl_seconds
+        with self._lock:
+            if generation is not None and generation != (self._global_generation, self._generations.get(key[1], 0)):
+                self.stale_loads += 1
+                return False
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return True
+
+    def get_or_load(self, key: Tuple[Hashable, ...], loader: Callable[[], Any]) -> Any:
+        """
+        Получение значения из кэша с загрузкой при промахе
+
+        Args:
+            key: Ключ кэша
+            loader: Функция, возвращающая актуальное значение
+
+        Returns:
+            Значение из кэша или результат loader()
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        generation = self.generation(key)
+        value = loader()
+        if value is not None:
+            self.set(key, value, generation)
+        return value
+
+    def invalidate(self, date: str = None, calendar_id: str = None) -> int:
+        """
+        Инвалидация записей кэша
+
+        Args:
+            date: Дата в формате YYYY-MM-DD; если не указана - все даты
+            calendar_id: ID календаря; если не указан - все календари
+
+        Returns:
+            Количество удаленных записей в этом процессе
+        """
+        removed = self._invalidate_local(date, calendar_id)
+        if self.shared:
+            now = time.time()
+            try:
+                with self.database.transaction() as conn:
+                    conn.execute(
+                        '''INSERT INTO slot_cache_invalidations (date, calendar_id, pid, created_at)
+                           VALUES (?, ?, ?, ?)''',
+                        (date, calendar_id, os.getpid(), now)
+                    )
+                    if now >= self._next_purge:
+                        self._next_purge = now + Config.SLOT_CACHE_INVALIDATION_RETENTION_SECONDS / 10
+                        conn.execute(
+                            'DELETE FROM slot_cache_invalidations WHERE created_at < ?',
+                            (now - Config.SLOT_CACHE_INVALIDATION_RETENTION_SECONDS,)
+                        )
+            except Exception as e:
+                print(f"Ошибка записи инвалидации кэша слотов: {e}")
+        return removed
+
+    def _poll(self) -> None:
+        """Применение инвалидаций, сделанных другими процессами"""
+        if not self.shared or time.monotonic() < self._next_poll:
+            return
+        if not self._poll_lock.acquire(blocking=False):
+            return
+        try:
+            self._next_poll = time.monotonic() + Config.SLOT_CACHE_INVALIDATION_POLL_SECONDS
+            with self.database.transaction() as conn:
+                rows = conn.execute(
+                    '''SELECT id, date, calendar_id, pid FROM slot_cache_invalidations
+                       WHERE id > ? ORDER BY id''',
+                    (self._last_seen_id,)
+                ).fetchall()
+            for row in rows:
+                self._last_seen_id = row['id']
+                if row['pid'] != os.getpid():
+                    self._invalidate_local(row['date'], row['calendar_id'])
+                    self.remote_invalidations += 1
+        except Exception as e:
+            print(f"Ошибка чтения инвалидаций кэша слотов: {e}")
+        finally:
+            self._poll_lock.release()
+
+    def _invalidate_local(self, date: Optional[str], calendar_id: Optional[str]) -> int:
+        with self._lock:
+            if date is None:
+                self._global_generation += 1
+            else:
+                self._generations[date] = self._generations.get(date, 0) + 1
+            if date is None and calendar_id is None:
+                removed = len(self._entries)
+                self._entries.clear()
+            else:
+                stale = [
+                    key for key in self._entries
+                    if (date is None or key[1] == date)
+                    and (calendar_id is None or key[0] == calendar_id)
+                ]
+                for key in stale:
+                    del self._entries[key]
+                removed = len(stale)
+
+            self.invalidations += removed
+            return removed
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Статистика работы кэша
+
+        Returns:
+            Словарь со счетчиками попаданий и промахов
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'stale_loads': self.stale_loads,
+                'remote_invalidations': self.remote_invalidations,
+                'shared': self.shared
+            }
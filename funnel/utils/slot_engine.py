@@ -0,0 +1,250 @@
+"""
+Slot Engine Module
+Расчет свободных слотов по отсортированным интервалам занятости
+"""
+
+from bisect import bisect_right
+from datetime import date as date_cls, datetime, time, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from zoneinfo import ZoneInfo
+
+from config import Config
+
+Interval = Tuple[datetime, datetime]
+
+
+def parse_time(value: str) -> time:
+    """Разбор времени в формате HH:MM"""
+    hours, minutes = value.split(':')
+    return time(int(hours), int(minutes))
+
+
+def parse_datetime(value: str, tz: ZoneInfo) -> datetime:
+    """
+    Разбор даты/времени из Google Calendar в datetime с часовым поясом
+
+    Args:
+        value: RFC3339 строка ('2025-08-23T10:00:00Z', '...+03:00') или дата 'YYYY-MM-DD'
+        tz: Часовой пояс для значений без смещения и для событий на весь день
+
+    Returns:
+        datetime с часовым поясом
+    """
+    if len(value) == 10:
+        return datetime.combine(date_cls.fromisoformat(value), time(0, 0), tzinfo=tz)
+
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=tz)
+    return parsed
+
+
+def event_to_interval(event: Dict[str, Any], tz: ZoneInfo) -> Optional[Interval]:
+    """
+    Преобразование события Google Calendar в интервал занятости
+
+    Args:
+        event: Событие из events().list
+        tz: Часовой пояс календаря
+
+    Returns:
+        Кортеж (start, end) или None, если событие не занимает время
+    """
+    if event.get('status') == 'cancelled' or event.get('transparency') == 'transparent':
+        return None
+
+    start = event.get('start') or {}
+    end = event.get('end') or {}
+    start_value = start.get('dateTime', start.get('date'))
+    end_value = end.get('dateTime', end.get('date'))
+    if not start_value or not end_value:
+        return None
+
+    event_tz = ZoneInfo(start['timeZone']) if start.get('timeZone') else tz
+    interval = (parse_datetime(start_value, event_tz), parse_datetime(end_value, event_tz))
+    if interval[1] <= interval[0]:
+        return None
+    return interval
+
+
+def merge_intervals(intervals: Iterable[Interval]) -> List[Interval]:
+    """
+    Слияние пересекающихся и смежных интервалов
+
+    Args:
+        intervals: Интервалы занятости в произвольном порядке
+
+    Returns:
+        Отсортированный список непересекающихся интервалов
+    """
+    merged: List[Interval] = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def busy_intervals_from_events(events: Iterable[Dict[str, Any]], tz: ZoneInfo) -> List[Interval]:
+    """Слитые интервалы занятости для списка событий Google Calendar"""
+    return merge_intervals(
+        interval for interval in (event_to_interval(event, tz) for event in events)
+        if interval is not None
+    )
+
+
+def busy_intervals_from_freebusy(busy: Iterable[Dict[str, str]], tz: ZoneInfo) -> List[Interval]:
+    """Слитые интервалы занятости из ответа freebusy.query"""
+    return merge_intervals(
+        (parse_datetime(item['start'], tz), parse_datetime(item['end'], tz))
+        for item in busy
+        if item.get('start') and item.get('end')
+    )
+
+
+def interval_dates(start: datetime, end: datetime, tz: ZoneInfo) -> Set[str]:
+    """Даты YYYY-MM-DD в часовом поясе tz, которые затрагивает интервал [start, end)"""
+    day = start.astimezone(tz).date()
+    last_day = (end - timedelta(microseconds=1)).astimezone(tz).date()
+    dates = set()
+    while day <= last_day:
+        dates.add(day.isoformat())
+        day += timedelta(days=1)
+    return dates
+
+
+def day_bounds(day: date_cls, tz: ZoneInfo) -> Interval:
+    """Начало и конец календарного дня в указанном часовом поясе"""
+    start = datetime.combine(day, time(0, 0), tzinfo=tz)
+    end = datetime.combine(day + timedelta(days=1), time(0, 0), tzinfo=tz)
+    return start, end
+
+
+def free_slots(day: date_cls,
+               busy: List[Interval],
+               tz: ZoneInfo,
+               duration_minutes: int = 60,
+               granularity_minutes: int = None,
+               work_start: time = None,
+               work_end: time = None) -> List[str]:
+    """
+    Свободные слоты на день
+
+    Слот свободен, если [start, start + duration) не пересекается ни с одним
+    интервалом занятости и целиком помещается в рабочие часы. Для каждого слота
+    выполняется бинарный поиск по концам интервалов, поэтому общая сложность
+    O(slots * log(events)) после сортировки событий.
+
+    Args:
+        day: Дата
+        busy: Отсортированные непересекающиеся интервалы (результат merge_intervals)
+        tz: Часовой пояс, в котором задаются рабочие часы и возвращаются слоты
+        duration_minutes: Длительность встречи в минутах
+        granularity_minutes: Шаг сетки слотов в минутах
+        work_start: Начало рабочего дня
+        work_end: Конец рабочего дня
+
+    Returns:
+        Список слотов в формате HH:MM
+    """
+    granularity = timedelta(minutes=granularity_minutes or Config.SLOT_GRANULARITY_MINUTES)
+    duration = timedelta(minutes=duration_minutes)
+    work_start = work_start or parse_time(Config.WORKING_HOURS_START)
+    work_end = work_end or parse_time(Config.WORKING_HOURS_END)
+    if granularity <= timedelta(0) or duration <= timedelta(0):
+        return []
+
+    busy_starts = [start for start, _ in busy]
+    busy_ends = [end for _, end in busy]
+
+    slots = []
+    slot_start = datetime.combine(day, work_start, tzinfo=tz)
+    day_end = datetime.combine(day, work_end, tzinfo=tz)
+    while slot_start + duration <= day_end:
+        slot_end = slot_start + duration
+        # Первый интервал занятости, который заканчивается позже начала слота
+        index = bisect_right(busy_ends, slot_start)
+        if index == len(busy_starts) or busy_starts[index] >= slot_end:
+            slots.append(slot_start.strftime('%H:%M'))
+        slot_start += granularity
+
+    return slots
+
+
+def free_slots_for_events(date: str,
+                          events: Iterable[Dict[str, Any]],
+                          timezone: str = None,
+                          duration_minutes: int = 60,
+                          granularity_minutes: int = None,
+                          work_start: str = None,
+                          work_end: str = None) -> List[str]:
+    """
+    Свободные слоты на дату по списку событий Google Calendar
+
+    Args:
+        date: Дата в формате YYYY-MM-DD
+        events: События из events().list
+        timezone: Часовой пояс рабочих часов (по умолчанию Config.DEFAULT_TIMEZONE)
+        duration_minutes: Длительность встречи в минутах
+        granularity_minutes: Шаг сетки слотов в минутах
+        work_start: Начало рабочего дня HH:MM
+        work_end: Конец рабочего дня HH:MM
+
+    Returns:
+        Список слотов в формате HH:MM
+    """
+    tz = ZoneInfo(timezone or Config.DEFAULT_TIMEZONE)
+    return free_slots(
+        date_cls.fromisoformat(date),
+        busy_intervals_from_events(events, tz),
+        tz,
+        duration_minutes=duration_minutes,
+        granularity_minutes=granularity_minutes,
+        work_start=parse_time(work_start) if work_start else None,
+        work_end=parse_time(work_end) if work_end else None
+    )
+
+
+def free_slots_by_day(date_from: str,
+                      date_to: str,
+                      busy: List[Interval],
+                      timezone: str = None,
+                      duration_minutes: int = 60,
+                      granularity_minutes: int = None,
+                      work_start: str = None,
+                      work_end: str = None) -> Dict[str, List[str]]:
+    """
+    Свободные слоты для каждого дня диапазона за один проход
+
+    Args:
+        date_from: Первая дата диапазона YYYY-MM-DD (включительно)
+        date_to: Последняя дата диапазона YYYY-MM-DD (включительно)
+        busy: Отсортированные непересекающиеся интервалы занятости на весь диапазон
+        timezone: Часовой пояс рабочих часов (по умолчанию Config.DEFAULT_TIMEZONE)
+        duration_minutes: Длительность встречи в минутах
+        granularity_minutes: Шаг сетки слотов в минутах
+        work_start: Начало рабочего дня HH:MM
+        work_end: Конец рабочего дня HH:MM
+
+    Returns:
+        Словарь {дата: [слоты]}
+    """
+    tz = ZoneInfo(timezone or Config.DEFAULT_TIMEZONE)
+    day = date_cls.fromisoformat(date_from)
+    last_day = date_cls.fromisoformat(date_to)
+
+    slots_by_day = {}
+    while day <= last_day:
+        slots_by_day[day.isoformat()] = free_slots(
+            day,
+            busy,
+            tz,
+            duration_minutes=duration_minutes,
+            granularity_minutes=granularity_minutes,
+            work_start=parse_time(work_start) if work_start else None,
+            work_end=parse_time(work_end) if work_end else None
+        )
+        day += timedelta(days=1)
+    return slots_by_day
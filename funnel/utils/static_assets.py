@@ -0,0 +1,502 @@
+"""
+Static Assets Module
+Отдача статики: отпечатки в URL, заранее сжатые варианты gzip/brotli, ETag и LRU кэш малых файлов
+
+Сжатые варианты собираются при сборке/деплое (из каталога funnel):
+    python -m utils.static_assets static templates pages
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import sys
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from flask import Response, abort, request, send_file
+from werkzeug.security import safe_join
+
+from config import Config
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Кодировка -> расширение сжатого варианта, в порядке предпочтения
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+# Типы, которые имеет смысл сжимать (видео и изображения уже сжаты)
+COMPRESSIBLE_TYPES = (
+    'text/', 'application/javascript', 'application/json', 'application/xml',
+    'application/manifest+json', 'image/svg+xml'
+)
+
+# app.3f2a1b9c0d12.css -> app.css
+_FINGERPRINTED = re.compile(r'^(?P<stem>.+)\.(?P<hash>[0-9a-f]{12})(?P<ext>\.[^./]+)$')
+HASH_LENGTH = 12
+
+# Ссылка на файл статики в HTML: src="/static/app.css", href='/static/...', url(/static/...)
+_STATIC_LINK = re.compile(r'''(?<=["'(])/static/(?P<path>[^"'()\s?#]+)''')
+
+
+def _is_compressible(mimetype: str) -> bool:
+    return mimetype.startswith(COMPRESSIBLE_TYPES)
+
+
+def _is_variant(path: str) -> bool:
+    """Сжатый вариант другого файла (file.css.gz рядом с file.css)"""
+    return path.endswith(tuple(suffix for _, suffix in ENCODINGS)) and os.path.isfile(path[:path.rfind('.')])
+
+
+def _file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as stream:
+        for block in iter(lambda: stream.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    """Запись через временный файл: воркер никогда не прочитает недописанный вариант"""
+    descriptor, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    try:
+        with os.fdopen(descriptor, 'wb') as stream:
+            stream.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+
+
+def precompress(path: str, min_bytes: int = None) -> List[str]:
+    """
+    Сборка сжатых вариантов файла (file.gz и, если установлен brotli, file.br)
+
+    Вариант пересобирается, если он старше исходного файла, и не
+    сохраняется, если сжатие экономит меньше 10%.
+
+    Args:
+        path: Путь к исходному файлу
+        min_bytes: Файлы меньше этого размера не сжимаются
+
+    Returns:
+        Список созданных кодировок
+    """
+    min_bytes = min_bytes if min_bytes is not None else Config.STATIC_PRECOMPRESS_MIN_BYTES
+    stat = os.stat(path)
+    if stat.st_size < min_bytes:
+        return []
+
+    data = None
+    built = []
+    for encoding, suffix in ENCODINGS:
+        if encoding == 'br' and brotli is None:
+            continue
+        variant = path + suffix
+        try:
+            if os.stat(variant).st_mtime_ns >= stat.st_mtime_ns:
+                continue
+        except FileNotFoundError:
+            pass
+        if data is None:
+            with open(path, 'rb') as stream:
+                data = stream.read()
+        if encoding == 'br':
+            compressed = brotli.compress(data, quality=11)
+        else:
+            compressed = gzip.compress(data, compresslevel=9, mtime=0)
+        if len(compressed) > len(data) * 0.9:
+            continue
+        _write_atomic(variant, compressed)
+        built.append(encoding)
+    return built
+
+
+class ByteCache:
+    """Потокобезопасный LRU кэш содержимого файлов, ограниченный суммарным размером в байтах"""
+
+    def __init__(self, max_bytes: int = None, max_file_bytes: int = None):
+        """
+        Инициализация кэша
+
+        Args:
+            max_bytes: Максимальный суммарный размер кэша
+            max_file_bytes: Файлы больше этого размера не кэшируются
+        """
+        self.max_bytes = max_bytes if max_bytes is not None else Config.STATIC_CACHE_MAX_BYTES
+        self.max_file_bytes = max_file_bytes if max_file_bytes is not None else Config.STATIC_CACHE_MAX_FILE_BYTES
+        self._entries: 'OrderedDict[Tuple[str, int], bytes]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def cacheable(self, size: int) -> bool:
+        return size <= self.max_file_bytes and size <= self.max_bytes
+
+    def read(self, path: str, mtime_ns: int) -> bytes:
+        """
+        Содержимое файла из кэша или с диска
+
+        Args:
+            path: Путь к файлу
+            mtime_ns: Время изменения файла (входит в ключ, старая версия вытесняется сама)
+        """
+        key = (path, mtime_ns)
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return data
+            self.misses += 1
+
+        with open(path, 'rb') as stream:
+            data = stream.read()
+
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = data
+                self.size += len(data)
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+        return data
+
+    def stats(self) -> Dict[str, int]:
+        """Счетчики кэша"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+
+class StaticAssets:
+    """Отдача файлов одного каталога
+
+    При старте каталог сканируется: для каждого файла вычисляется SHA-256
+    (отпечаток и сильный ETag), находятся сжатые варианты file.br/file.gz.
+    Файл доступен и по обычному имени, и по имени с отпечатком
+    (app.3f2a1b9c0d12.css) - такой URL кэшируется клиентом навсегда
+    (immutable), потому что при изменении файла меняется и URL. Обычные URL
+    кэшируются на max_age секунд и перепроверяются по ETag (304).
+    Файлы больше Config.STATIC_HASH_MAX_BYTES (видео) не хэшируются: их
+    ETag строится из размера и времени изменения.
+
+    Если задан links, в отдаваемых HTML файлах ссылки /static/... заменяются
+    на URL с отпечатком из каталога links. Переписанная страница хранится в
+    памяти (вместе с gzip) до изменения файла или индекса links.
+    """
+
+    def __init__(self, root: str, max_age: int = None, cache: ByteCache = None, precompress_on_scan: bool = None,
+                 links: 'StaticAssets' = None):
+        """
+        Инициализация каталога статики
+
+        Args:
+            root: Каталог с файлами
+            max_age: Cache-Control max-age для URL без отпечатка
+            cache: Общий кэш содержимого файлов
+            precompress_on_scan: Собирать недостающие сжатые варианты при сканировании
+                (по умолчанию Config.STATIC_PRECOMPRESS; обычно их собирают при сборке)
+            links: Каталог статики для замены ссылок /static/... в HTML
+        """
+        self.root = os.path.abspath(root)
+        self.max_age = max_age if max_age is not None else Config.STATIC_MAX_AGE_SECONDS
+        self.cache = cache or ByteCache()
+        self.precompress_on_scan = (precompress_on_scan if precompress_on_scan is not None
+                                    else Config.STATIC_PRECOMPRESS)
+        self.links = links
+        self.version = 0  # меняется при переиндексации файлов
+        self._assets: Dict[str, Dict[str, Any]] = {}
+        self._rendered: Dict[str, Dict[str, Any]] = {}  # путь HTML -> переписанная страница
+        self._lock = threading.Lock()
+
+    # ------------------------------------------------------------------
+    # Индекс файлов
+    # ------------------------------------------------------------------
+
+    def scan(self) -> int:
+        """
+        Сканирование каталога
+
+        Returns:
+            Количество найденных файлов
+        """
+        assets = {}
+        for directory, _, files in os.walk(self.root):
+            for name in files:
+                path = os.path.join(directory, name)
+                if name.startswith('.tmp-') or _is_variant(path):
+                    continue
+                relative = os.path.relpath(path, self.root).replace(os.sep, '/')
+                try:
+                    assets[relative] = self._describe(path)
+                except OSError as e:
+                    print(f"Ошибка индексации {path}: {e}")
+        with self._lock:
+            self._assets = assets
+            self.version += 1
+        return len(assets)
+
+    def _describe(self, path: str) -> Dict[str, Any]:
+        stat = os.stat(path)
+        mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        if self.precompress_on_scan and _is_compressible(mimetype):
+            try:
+                precompress(path)
+            except OSError as e:
+                # Каталог только для чтения - отдаем без сжатых вариантов
+                print(f"Не удалось сжать {path}: {e}")
+
+        digest = None
+        if stat.st_size <= Config.STATIC_HASH_MAX_BYTES:
+            digest = _file_hash(path)
+            etag = digest[:32]
+        else:
+            etag = f'{stat.st_size:x}-{stat.st_mtime_ns:x}'
+
+        variants = {}
+        for encoding, suffix in ENCODINGS:
+            try:
+                variant_stat = os.stat(path + suffix)
+            except FileNotFoundError:
+                continue
+            if variant_stat.st_mtime_ns >= stat.st_mtime_ns:
+                variants[encoding] = {
+                    'path': path + suffix,
+                    'size': variant_stat.st_size,
+                    'mtime_ns': variant_stat.st_mtime_ns
+                }
+
+        return {
+            'path': path,
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'mtime': stat.st_mtime,
+            'mimetype': mimetype,
+            'fingerprint': digest[:HASH_LENGTH] if digest else None,
+            'etag': etag,
+            'variants': variants
+        }
+
+    def _lookup(self, relative: str) -> Optional[Dict[str, Any]]:
+        """Описание файла; файл, измененный после сканирования, индексируется заново"""
+        path = safe_join(self.root, relative)
+        if path is None:
+            return None
+        with self._lock:
+            asset = self._assets.get(relative)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if not os.path.isfile(path) or _is_variant(path):
+            return None
+        if asset is None or asset['mtime_ns'] != stat.st_mtime_ns or asset['size'] != stat.st_size:
+            asset = self._describe(path)
+            with self._lock:
+                self._assets[relative] = asset
+                self.version += 1
+        return asset
+
+    def url(self, relative: str) -> str:
+        """
+        Имя файла с отпечатком для ссылок из страниц
+
+        Args:
+            relative: Путь файла относительно каталога
+
+        Returns:
+            Путь с отпечатком или исходный путь, если файл не хэшируется
+        """
+        asset = self._lookup(relative)
+        if not asset or not asset['fingerprint']:
+            return relative
+        stem, ext = os.path.splitext(relative)
+        return f"{stem}.{asset['fingerprint']}{ext}"
+
+    def resolve(self, filename: str) -> Tuple[Optional[Dict[str, Any]], bool]:
+        """
+        Поиск файла по URL
+
+        Returns:
+            (описание файла или None, URL содержит актуальный отпечаток)
+        """
+        asset = self._lookup(filename)
+        if asset is not None:
+            return asset, False
+        match = _FINGERPRINTED.match(filename)
+        if match:
+            asset = self._lookup(match.group('stem') + match.group('ext'))
+            if asset is not None:
+                # Устаревший отпечаток (файл изменили) - отдаем текущую версию без immutable
+                return asset, asset['fingerprint'] == match.group('hash')
+        return None, False
+
+    def rewrite_links(self, html: str) -> str:
+        """
+        Замена ссылок /static/... в HTML на URL с отпечатком
+
+        Args:
+            html: Текст страницы
+
+        Returns:
+            Текст страницы со ссылками из каталога links
+        """
+        return _STATIC_LINK.sub(lambda match: '/static/' + self.links.url(match.group('path')), html)
+
+    def _render(self, asset: Dict[str, Any]) -> Dict[str, Any]:
+        """Переписанная HTML страница из памяти или с диска"""
+        with self._lock:
+            rendered = self._rendered.get(asset['path'])
+        if rendered is not None and rendered['key'] == (asset['mtime_ns'], self.links.version):
+            return rendered
+
+        html = self.cache.read(asset['path'], asset['mtime_ns']).decode('utf-8')
+        body = self.rewrite_links(html).encode('utf-8')
+        compressed = None
+        if len(body) >= Config.STATIC_PRECOMPRESS_MIN_BYTES:
+            compressed = gzip.compress(body, compresslevel=6, mtime=0)
+            if len(compressed) > len(body) * 0.9:
+                compressed = None
+        rendered = {
+            # Версия links берется после переписывания: url() мог переиндексировать файлы
+            'key': (asset['mtime_ns'], self.links.version),
+            'body': body,
+            'gzip': compressed,
+            'etag': hashlib.sha256(body).hexdigest()[:32]
+        }
+        with self._lock:
+            self._rendered[asset['path']] = rendered
+        return rendered
+
+    # ------------------------------------------------------------------
+    # Отдача
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _choose_encoding(asset: Dict[str, Any]) -> Optional[str]:
+        if not asset['variants']:
+            return None
+        accepted = request.accept_encodings
+        best, best_quality = None, 0
+        for encoding, _ in ENCODINGS:
+            if encoding in asset['variants']:
+                quality = accepted[encoding]
+                if quality > best_quality:
+                    best, best_quality = encoding, quality
+        return best
+
+    def serve(self, filename: str, max_age: int = None) -> Response:
+        """
+        Ответ с файлом
+
+        Args:
+            filename: Путь из URL (можно с отпечатком)
+            max_age: Cache-Control max-age вместо значения каталога (0 - всегда перепроверять)
+
+        Returns:
+            Flask Response; 304 при совпадении ETag, 404 если файла нет
+        """
+        asset, immutable = self.resolve(filename)
+        if asset is None:
+            abort(404)
+        if self.links is not None and asset['mimetype'] == 'text/html':
+            return self._serve_rendered(asset, immutable, max_age)
+
+        encoding = self._choose_encoding(asset)
+        source = asset['variants'][encoding] if encoding else asset
+        # У каждого представления свой сильный ETag
+        etag = f"{asset['etag']}-{encoding}" if encoding else asset['etag']
+
+        if self.cache.cacheable(source['size']):
+            response = Response(self.cache.read(source['path'], source['mtime_ns']), mimetype=asset['mimetype'])
+            response.set_etag(etag)
+            response.last_modified = asset['mtime']
+        else:
+            response = send_file(
+                source['path'],
+                mimetype=asset['mimetype'],
+                etag=etag,
+                last_modified=asset['mtime'],
+                conditional=False
+            )
+
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        if asset['variants']:
+            response.vary.add('Accept-Encoding')
+
+        self._set_cache_control(response, immutable, max_age)
+        return response.make_conditional(request, accept_ranges=True, complete_length=source['size'])
+
+    def _serve_rendered(self, asset: Dict[str, Any], immutable: bool, max_age: Optional[int]) -> Response:
+        """Ответ с HTML страницей, ссылки которой переписаны на URL с отпечатком"""
+        rendered = self._render(asset)
+        encoding = 'gzip' if rendered['gzip'] is not None and request.accept_encodings['gzip'] else None
+        body = rendered['gzip'] if encoding else rendered['body']
+
+        response = Response(body, mimetype=asset['mimetype'])
+        response.set_etag(f"{rendered['etag']}-{encoding}" if encoding else rendered['etag'])
+        response.last_modified = asset['mtime']
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        if rendered['gzip'] is not None:
+            response.vary.add('Accept-Encoding')
+        self._set_cache_control(response, immutable, max_age)
+        return response.make_conditional(request, accept_ranges=True, complete_length=len(body))
+
+    def _set_cache_control(self, response: Response, immutable: bool, max_age: Optional[int]) -> None:
+        response.cache_control.public = True
+        if immutable:
+            response.cache_control.max_age = Config.STATIC_IMMUTABLE_MAX_AGE_SECONDS
+            response.cache_control.immutable = True
+        else:
+            age = self.max_age if max_age is None else max_age
+            response.cache_control.max_age = age
+            if age == 0:
+                response.cache_control.no_cache = True
+
+    def stats(self) -> Dict[str, Any]:
+        """Состояние индекса"""
+        with self._lock:
+            assets = list(self._assets.values())
+        return {
+            'root': self.root,
+            'files': len(assets),
+            'fingerprinted': sum(1 for asset in assets if asset['fingerprint']),
+            'precompressed': sum(1 for asset in assets if asset['variants'])
+        }
+
+
+def main(argv: List[str]) -> int:
+    roots = argv or ['static', 'templates', 'pages']
+    for root in roots:
+        if not os.path.isdir(root):
+            print(f"Каталог {root} не найден")
+            continue
+        assets = StaticAssets(root, precompress_on_scan=True)
+        assets.scan()
+        print(f"{root}: {assets.stats()}")
+    if brotli is None:
+        print("Модуль brotli не установлен - собраны только gzip варианты")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
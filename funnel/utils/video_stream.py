@@ -0,0 +1,319 @@
+"""
+Video Stream Module
+Отдача видео с поддержкой HTTP Range (в том числе multipart/byteranges), sendfile и ограничением скорости
+"""
+
+import mimetypes
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from flask import Response, abort, request
+from werkzeug.http import is_resource_modified, quote_etag
+from werkzeug.wsgi import wrap_file
+
+from config import Config
+from utils.static_assets import StaticAssets
+
+
+# Типы файлов, которые отдаются через VideoStreamer
+STREAMED_TYPES = ('video/', 'audio/')
+
+ByteRange = Tuple[int, int]  # [start, stop)
+
+
+def is_streamed(filename: str) -> bool:
+    """Файл отдается через VideoStreamer (видео и аудио)"""
+    mimetype = mimetypes.guess_type(filename)[0] or ''
+    return mimetype.startswith(STREAMED_TYPES)
+
+
+def parse_ranges(value: str) -> Optional[List[Tuple[int, Optional[int]]]]:
+    """
+    Разбор заголовка Range
+
+    В отличие от werkzeug.http.parse_range_header допускает пересекающиеся
+    и неупорядоченные диапазоны - они объединяются в normalize_ranges().
+
+    Args:
+        value: Значение заголовка (bytes=0-99,200-,-500)
+
+    Returns:
+        Список (start, stop) как в werkzeug Range.ranges (stop не включается,
+        отрицательный start - суффикс) или None, если заголовок некорректен
+    """
+    units, _, spec = value.partition('=')
+    if units.strip().lower() != 'bytes':
+        return None
+    ranges = []
+    items = [item.strip() for item in spec.split(',') if item.strip()]
+    if not items:
+        return None
+    for item in items:
+        first, separator, last = item.partition('-')
+        first, last = first.strip(), last.strip()
+        if not separator or not (first or last) or not (first.isdigit() or not first) \
+                or not (last.isdigit() or not last):
+            return None
+        if not first:
+            # Суффикс нулевой длины недостижим - пропускается
+            if int(last) > 0:
+                ranges.append((-int(last), None))
+            continue
+        start = int(first)
+        stop = int(last) + 1 if last else None
+        if stop is not None and stop <= start:
+            return None
+        ranges.append((start, stop))
+    return ranges
+
+
+def normalize_ranges(ranges: List[Tuple[int, Optional[int]]], size: int) -> List[ByteRange]:
+    """
+    Приведение диапазонов заголовка Range к границам файла
+
+    Суффиксы (bytes=-500) и открытые диапазоны (bytes=100-) раскрываются,
+    недостижимые диапазоны отбрасываются, пересекающиеся и соседние
+    объединяются.
+
+    Args:
+        ranges: Диапазоны из parse_ranges() (stop не включается)
+        size: Размер файла
+
+    Returns:
+        Отсортированный список [start, stop)
+    """
+    normalized = []
+    for start, stop in ranges:
+        if start < 0:
+            start, stop = max(size + start, 0), size
+        elif stop is None or stop > size:
+            stop = size
+        if start < stop:
+            normalized.append((start, stop))
+
+    merged: List[ByteRange] = []
+    for start, stop in sorted(normalized):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], stop))
+        else:
+            merged.append((start, stop))
+    return merged
+
+
+class _Throttle:
+    """Ограничение скорости одного соединения: первые burst байт без задержки, дальше rate байт/с"""
+
+    def __init__(self, rate: int, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.started = time.monotonic()
+        self.sent = 0
+
+    def sent_bytes(self, count: int) -> None:
+        self.sent += count
+        if not self.rate or self.sent <= self.burst:
+            return
+        delay = self.started + (self.sent - self.burst) / self.rate - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class VideoStreamer:
+    """Отдача больших медиафайлов из каталога StaticAssets
+
+    Поиск файла, отпечатки в URL и ETag берутся из StaticAssets. Полный файл
+    и диапазон до конца файла (так браузер запрашивает видео при перемотке)
+    отдаются через wsgi.file_wrapper - gunicorn передает такой ответ
+    системным вызовом sendfile без копирования через Python. Остальные
+    диапазоны и multipart/byteranges читаются блоками через os.pread.
+    Если задан Config.VIDEO_MAX_BYTES_PER_SECOND, скорость каждого ответа
+    ограничивается после первых Config.VIDEO_BURST_BYTES (при этом sendfile
+    не используется).
+    """
+
+    def __init__(self, assets: StaticAssets, max_bytes_per_second: int = None, burst_bytes: int = None,
+                 chunk_size: int = None, max_ranges: int = None):
+        """
+        Инициализация
+
+        Args:
+            assets: Каталог статики с видео
+            max_bytes_per_second: Ограничение скорости одного ответа (0 - без ограничения)
+            burst_bytes: Сколько байт отдается без ограничения скорости
+            chunk_size: Размер блока чтения
+            max_ranges: Больше диапазонов в одном запросе не обслуживается - отдается весь файл
+        """
+        self.assets = assets
+        self.max_bytes_per_second = (max_bytes_per_second if max_bytes_per_second is not None
+                                     else Config.VIDEO_MAX_BYTES_PER_SECOND)
+        self.burst_bytes = burst_bytes if burst_bytes is not None else Config.VIDEO_BURST_BYTES
+        self.chunk_size = chunk_size or Config.VIDEO_CHUNK_SIZE
+        self.max_ranges = max_ranges or Config.VIDEO_MAX_RANGES
+        self._lock = threading.Lock()
+        self.counters = {'full': 0, 'single_range': 0, 'multi_range': 0, 'not_modified': 0,
+                         'unsatisfiable': 0, 'sendfile': 0}
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self.counters[name] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики ответов"""
+        with self._lock:
+            return dict(self.counters, max_bytes_per_second=self.max_bytes_per_second)
+
+    # ------------------------------------------------------------------
+    # Тело ответа
+    # ------------------------------------------------------------------
+
+    def _read(self, fd: int, start: int, stop: int, throttle: _Throttle) -> Iterator[bytes]:
+        offset = start
+        while offset < stop:
+            chunk = os.pread(fd, min(self.chunk_size, stop - offset), offset)
+            if not chunk:
+                return
+            offset += len(chunk)
+            yield chunk
+            throttle.sent_bytes(len(chunk))
+
+    def _body(self, path: str, parts: List[Tuple[bytes, int, int]], tail: bytes) -> Iterator[bytes]:
+        """Части ответа: заголовок части (может быть пустым) и диапазон файла"""
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            throttle = _Throttle(self.max_bytes_per_second, self.burst_bytes)
+            for header, start, stop in parts:
+                if header:
+                    yield header
+                yield from self._read(fd, start, stop, throttle)
+            if tail:
+                yield tail
+        finally:
+            os.close(fd)
+
+    def _file_response(self, asset: Dict[str, Any], start: int, stop: int, status: int) -> Response:
+        size = asset['size']
+        if stop == size and not self.max_bytes_per_second:
+            # Диапазон до конца файла: сервер может отдать его через sendfile
+            stream = open(asset['path'], 'rb')
+            stream.seek(start)
+            if 'wsgi.file_wrapper' in request.environ:
+                self._count('sendfile')
+            body = wrap_file(request.environ, stream, self.chunk_size)
+        else:
+            body = self._body(asset['path'], [(b'', start, stop)], b'')
+        response = Response(body, status=status, mimetype=asset['mimetype'], direct_passthrough=True)
+        response.content_length = stop - start
+        return response
+
+    def _multipart_response(self, asset: Dict[str, Any], ranges: List[ByteRange]) -> Response:
+        boundary = uuid.uuid4().hex
+        size = asset['size']
+        parts = []
+        length = 0
+        for start, stop in ranges:
+            header = (
+                f'\r\n--{boundary}\r\n'
+                f"Content-Type: {asset['mimetype']}\r\n"
+                f'Content-Range: bytes {start}-{stop - 1}/{size}\r\n\r\n'
+            ).encode('ascii')
+            parts.append((header, start, stop))
+            length += len(header) + stop - start
+        tail = f'\r\n--{boundary}--\r\n'.encode('ascii')
+        length += len(tail)
+
+        response = Response(
+            self._body(asset['path'], parts, tail),
+            status=206,
+            content_type=f'multipart/byteranges; boundary={boundary}',
+            direct_passthrough=True
+        )
+        response.content_length = length
+        return response
+
+    # ------------------------------------------------------------------
+    # Запрос
+    # ------------------------------------------------------------------
+
+    def _requested_ranges(self, asset: Dict[str, Any], etag: str) -> Optional[List[ByteRange]]:
+        """
+        Диапазоны, которые нужно отдать
+
+        Returns:
+            None - отдать файл целиком; [] - диапазоны недостижимы (416)
+        """
+        if 'Range' not in request.headers:
+            return None
+        # If-Range: диапазон отдается, только если у клиента та же версия файла
+        if_range = request.if_range
+        if if_range.etag and if_range.etag != etag:
+            return None
+        if if_range.date and if_range.date.timestamp() < int(asset['mtime']):
+            return None
+        ranges = parse_ranges(request.headers['Range'])
+        if ranges is None:
+            # Некорректный заголовок Range игнорируется (RFC 9110)
+            return None
+        if len(ranges) > self.max_ranges:
+            return None
+        return normalize_ranges(ranges, asset['size'])
+
+    def serve(self, filename: str) -> Response:
+        """
+        Ответ с медиафайлом
+
+        Args:
+            filename: Путь из URL (можно с отпечатком)
+
+        Returns:
+            200, 206, 304 или 416; 404 если файла нет
+        """
+        asset, immutable = self.assets.resolve(filename)
+        if asset is None:
+            abort(404)
+
+        etag = asset['etag']
+        size = asset['size']
+        last_modified = datetime.fromtimestamp(int(asset['mtime']), timezone.utc)
+        if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+            response = Response(status=304)
+            self._count('not_modified')
+        else:
+            ranges = self._requested_ranges(asset, etag)
+            if ranges is None:
+                if request.method == 'HEAD':
+                    response = Response(status=200, mimetype=asset['mimetype'])
+                else:
+                    response = self._file_response(asset, 0, size, 200)
+                response.content_length = size
+                self._count('full')
+            elif not ranges:
+                response = Response(status=416)
+                response.headers['Content-Range'] = f'bytes */{size}'
+                self._count('unsatisfiable')
+            elif len(ranges) == 1:
+                start, stop = ranges[0]
+                if request.method == 'HEAD':
+                    response = Response(status=206, mimetype=asset['mimetype'])
+                else:
+                    response = self._file_response(asset, start, stop, 206)
+                response.content_length = stop - start
+                response.headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+                self._count('single_range')
+            else:
+                response = self._multipart_response(asset, ranges)
+                self._count('multi_range')
+
+        response.headers['ETag'] = quote_etag(etag)
+        response.last_modified = asset['mtime']
+        response.accept_ranges = 'bytes'
+        response.cache_control.public = True
+        if immutable:
+            response.cache_control.max_age = Config.STATIC_IMMUTABLE_MAX_AGE_SECONDS
+            response.cache_control.immutable = True
+        else:
+            response.cache_control.max_age = self.assets.max_age
+        return response
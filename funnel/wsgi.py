@@ -0,0 +1,20 @@
+"""
+WSGI entry point for production
+
+Run from the funnel directory:
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+gunicorn.conf.py preloads the app in the master process, forks the workers
+and calls init_worker() in each of them. Every worker runs the request log
+and mail queue threads; the calendar sync, calendar outbox and reminder
+scheduler run only in the worker holding the leader lock
+(Config.LEADER_LOCK_PATH), and another worker takes over when it exits. Graceful reload of workers:
+    kill -HUP <master pid>
+With preload enabled, HUP restarts workers from the already loaded code;
+to deploy new code, start a new master with USR2 and stop the old one with
+QUIT, or set GUNICORN_PRELOAD=false so that HUP reloads the code as well.
+"""
+
+from app import app, init_worker, preload_google_client, stop_background_services
+
+__all__ = ['app', 'init_worker', 'preload_google_client', 'stop_background_services']